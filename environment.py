@@ -29,11 +29,43 @@ class EnvironmentConfiguration(DoubleConfiguration):
         """
         return self.get('paths', 'compiled-corpora')
 
+    def download_connections(self):
+        """Returns number of concurrent connections for downloading one file
+        """
+        return int(self.get('downloads', 'connections'))
+
+    def download_bandwidth_limit(self):
+        """Returns bandwidth limit for all downloads (bytes per second)
+
+        0 means no limit.
+        """
+        return int(self.get('downloads', 'bandwidth-limit'))
+
+    def dump_store_path(self):
+        """Returns path to shared dump store ('' if there is none)
+        """
+        return self.get('dump-store', 'path') or ''
+
+    def dump_store_quota(self):
+        """Returns maximal size of dump store (bytes, 0 = no limit)
+        """
+        return int(self.get('dump-store', 'quota'))
+
     def registry_path(self):
         """Returns path to parent directory for registry (corpora protocols)
         """
         return self.get('paths', 'registry')
 
+    def tagger_cache_path(self):
+        """Returns path to cache of tagged paragraphs ('' if there is none)
+        """
+        return self.get('tagger-cache', 'path') or ''
+
+    def tagger_cache_size(self):
+        """Returns maximal size of tagger cache (bytes, 0 = no limit)
+        """
+        return int(self.get('tagger-cache', 'size'))
+
     def verticals_path(self):
         """Returns path to parent directory for all verticals
         """
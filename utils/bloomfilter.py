@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for compact probabilistic set membership (Bloom filter).
+"""
+
+from __future__ import unicode_literals
+import hashlib
+import math
+import struct
+
+
+class BloomFilter(object):
+
+    """Compact probabilistic set of unicode strings
+
+    Membership test can return false positives (with probability close to
+    :error_rate: when the filter holds :capacity: items), but never false
+    negatives. All items are kept as bits only, so the memory needed is about
+    1.2 bytes per item for error rate 0.1 % regardless of the item lengths.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        :capacity: [int] expected number of items
+        :error_rate: [float] desired false positive probability
+        """
+        if capacity <= 0:
+            capacity = 1
+        if not 0 < error_rate < 1:
+            raise ValueError(':error_rate: has to be between 0 and 1')
+        # optimal number of bits and hash functions
+        self._bits_count = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes_count = max(1, int(round(
+            float(self._bits_count) / capacity * math.log(2))))
+        self._bits = bytearray((self._bits_count + 7) // 8)
+        self._length = 0
+        self._distinct = 0
+
+    def add(self, item):
+        """Adds :item: to the filter
+
+        :item: unicode
+        """
+        new = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not self._bits[position >> 3] & mask:
+                self._bits[position >> 3] |= mask
+                new = True
+        self._length += 1
+        if new:
+            self._distinct += 1
+
+    def update(self, items):
+        """Adds all :items: to the filter
+        """
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        bits = self._bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        """Returns number of added items (including duplicates)
+        """
+        return self._length
+
+    def distinct_count(self):
+        """Returns number of distinct added items
+
+        The number is approximate, items which were false positives when they
+        were added are counted as duplicates.
+        """
+        return self._distinct
+
+    def size_in_bytes(self):
+        """Returns size of the bit array
+        """
+        return len(self._bits)
+
+    def _positions(self, item):
+        """Generates bit positions for :item: using double hashing
+        """
+        if isinstance(item, unicode):
+            item = item.encode('utf-8')
+        digest = hashlib.md5(item).digest()
+        first, second = struct.unpack(b'<QQ', digest)
+        for i in xrange(self._hashes_count):
+            yield (first + i * second) % self._bits_count
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for utilities concerning bzip2 compression
+"""
+
+from __future__ import unicode_literals
+import bz2
+
+# size of compressed chunks read at once
+CHUNK = 64 * 1024
+
+
+class BZ2StreamReader(object):
+
+    """File-like object decompressing data read from another file-like object
+
+    Unlike bz2.BZ2File, it doesn't need a real file, so it can decompress
+    e.g. a file which is being downloaded. Only read() is supported.
+    Concatenated (multistream) bzip2 files are supported as well.
+    """
+
+    def __init__(self, compressed_file):
+        """
+        :compressed_file: file-like object with read() method
+        """
+        self._compressed_file = compressed_file
+        self._decompressor = bz2.BZ2Decompressor()
+        self._buffer = b''
+        self._eof = False
+
+    def read(self, size=-1):
+        """Reads at most :size: decompressed bytes (all if size < 0)
+        """
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            self._decompress_chunk()
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _decompress_chunk(self):
+        compressed = self._compressed_file.read(CHUNK)
+        if not compressed:
+            self._eof = True
+            return
+        while compressed:
+            try:
+                self._buffer += self._decompressor.decompress(compressed)
+            except EOFError:
+                # previous stream has just ended, start a new one
+                self._decompressor = bz2.BZ2Decompressor()
+                continue
+            compressed = self._decompressor.unused_data
+            if compressed:
+                self._decompressor = bz2.BZ2Decompressor()
+
+    def close(self):
+        pass
@@ -5,47 +5,154 @@
 """
 
 from __future__ import unicode_literals
-from contextlib import closing
+from collections import defaultdict
+from contextlib import contextmanager
 from progressbar import ProgressBar
+from urlparse import urljoin, urlsplit
+import fcntl
 import hashlib
-import urllib2
+import httplib
+import json
+import logging
+import os
+import socket
+import threading
+import time
 
 # download constants
 CHUNK = 32 * 1024
 
+# number of download attempts before giving up
+ATTEMPTS = 5
 
-def download_large_file(url, path, md5sum=None):
+# delay between two download attempts (in seconds)
+RETRY_DELAY = 10
+
+# timeout for blocking operations on connection (in seconds)
+TIMEOUT = 60
+
+# suffix of partially downloaded files
+PARTIAL_SUFFIX = '.part'
+
+# suffix of files with state of segmented downloads
+SEGMENTS_SUFFIX = '.segments'
+
+# how often (in bytes) is the state of segmented download stored
+SEGMENTS_CHECKPOINT = 64 * 1024 * 1024
+
+# files smaller than this (per connection) are not split to segments
+MIN_SEGMENT_SIZE = CHUNK
+
+# HTTP statuses of redirects
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# maximal number of redirects followed
+MAX_REDIRECTS = 5
+
+
+def download_large_file(url, path, md5sum=None, attempts=ATTEMPTS,
+        retry_delay=RETRY_DELAY, connections=1):
     """ Downloads large file from :url: to :path:
 
+    File is downloaded to :path: + '.part' first. If the connection drops,
+    the download is resumed by HTTP Range request (MD5 state is rebuilt
+    by hashing already downloaded part). If the MD5 checksum is wrong,
+    the file is downloaded again from the beginning.
+
+    If more :connections: are allowed (and the server supports ranges),
+    the file is preallocated and downloaded in the same number of segments
+    concurrently. Each segment is retried separately and the state of all
+    segments is stored in :path: + '.part.segments', so even segmented
+    download can be resumed.
+
     :url: unicode
         url of file to download
     :path: unicode
         location where to download the file
     :md5sum: unicode [optional]
         md5 checksum
+    :attempts: int
+        number of download attempts
+    :retry_delay: float
+        delay between download attempts (in seconds)
+    :connections: int
+        number of concurrent connections (segments)
+
+    :throws: DownloadException if all attempts fail
     """
-    # download file and compute md5
-    md5 = hashlib.md5()
-    with closing(urllib2.urlopen(url)) as request:
-        # read file size from headers
-        file_size = int(request.info().getheaders('Content-Length')[0])
-        print 'file size:', human_readable_size(file_size)
-        progressbar = ProgressBar(file_size)
-        with open(path, 'wb') as output_file:
-            while True:
-                chunk = request.read(CHUNK)
-                if not chunk:
-                    break
-                output_file.write(chunk)
-                md5.update(chunk)
-                progressbar.add(len(chunk))
-        progressbar.finish()
-    # check MD5 checksum
-    if md5sum:
-        if md5.hexdigest() == md5sum:
+    partial_path = path + PARTIAL_SUFFIX
+    segments_path = partial_path + SEGMENTS_SUFFIX
+    for attempt in range(1, attempts + 1):
+        if attempt > 1:
+            time.sleep(retry_delay)
+        try:
+            if connections > 1 or os.path.exists(segments_path):
+                md5 = _download_segmented_file(url, partial_path,
+                    connections, attempts, retry_delay)
+            else:
+                md5 = _download_partial_file(url, partial_path)
+        except (httplib.HTTPException, socket.error,
+                DownloadException) as exc:
+            logging.warning('Download attempt {n} of {url} failed: {error}'
+                .format(n=attempt, url=url, error=exc))
+            continue
+        # check MD5 checksum
+        if md5sum:
+            if md5.hexdigest() != md5sum:
+                logging.warning('Wrong MD5 checksum of {url} (attempt {n}).'
+                    .format(url=url, n=attempt))
+                # corrupted file can't be resumed
+                os.remove(partial_path)
+                continue
             print 'MD5 checksum: OK'
-        else:
-            print 'Wrong MD5 checksum! Try download the file again.'
+        os.rename(partial_path, path)
+        return
+    raise DownloadException('Downloading {url} failed ({n} attempts).'
+        .format(url=url, n=attempts))
+
+
+@contextmanager
+def download_stream(url, path, md5sum=None):
+    """Downloads file from :url: to :path: and yields its content meanwhile
+
+    Yields file-like object (only read() is supported) which reads the file
+    as it's being downloaded, so the file can be processed at the same time.
+    Unread rest of the file is downloaded after the with statement.
+    Download can't be resumed, it always starts from the beginning.
+
+    Allows to write:
+        with download_stream(url, path, md5sum) as stream:
+            process(stream)
+
+    :url: unicode
+    :path: unicode
+    :md5sum: unicode [optional]
+
+    :throws: DownloadException if the download is incomplete or if the
+        checksum is wrong (partially downloaded file is kept in the former
+        case, so it can be resumed by download_large_file)
+    """
+    partial_path = path + PARTIAL_SUFFIX
+    with connection_pool.open(url) as response:
+        _check_status(response, url)
+        file_size = _get_content_length(response)
+        _print_file_size(file_size)
+        with open(partial_path, 'wb') as output_file:
+            stream = TeeReader(response, output_file)
+            yield stream
+            # download the rest which was not read
+            while stream.read(CHUNK):
+                pass
+    if file_size is not None and stream.size() < file_size:
+        raise DownloadException('connection dropped after {size}'.format(
+            size=human_readable_size(stream.size())))
+    if md5sum:
+        if stream.md5().hexdigest() != md5sum:
+            os.remove(partial_path)
+            raise DownloadException('Wrong MD5 checksum of {url}.'.format(
+                url=url))
+        print 'MD5 checksum: OK'
+    os.rename(partial_path, path)
 
 
 def get_online_file(url, lines=False):
@@ -56,11 +163,25 @@ def get_online_file(url, lines=False):
 
     :return: unicode || list of unicodes
     """
-    with closing(urllib2.urlopen(url)) as request:
-        if lines:
-            return request.readlines()
-        else:
-            return request.read()
+    with connection_pool.open(url) as response:
+        _check_status(response, url)
+        content = response.read()
+    if lines:
+        return content.splitlines(True)
+    else:
+        return content
+
+
+def get_online_file_size(url):
+    """Returns size of online file (from HEAD request)
+
+    :url: unicode
+    :return: int || None (if the server doesn't send the size)
+    """
+    with connection_pool.open(url, method='HEAD') as response:
+        _check_status(response, url)
+        response.read()
+        return _get_content_length(response)
 
 
 def human_readable_size(size):
@@ -73,3 +194,470 @@ def human_readable_size(size):
         if size < 1024.0:
             return '{size:1.1f} {unit}'.format(size=size, unit=unit)
         size /= 1024.0
+
+
+def set_bandwidth_limit(limit, state_path=None):
+    """Sets global bandwidth limit for all downloads
+
+    :limit: int (bytes per second, 0 or None = unlimited)
+    :state_path: unicode [optional]
+        path to the state file of the token bucket shared by all processes
+        which use the same path (e.g. several languages downloaded at once),
+        if not set, the limit applies only to downloads of this process
+    """
+    bandwidth_limiter.set_limit(limit, state_path)
+
+
+# ---------------------------------------------------------------------------
+#  connection pool and bandwidth limiter
+# ---------------------------------------------------------------------------
+
+class ConnectionPool(object):
+
+    """Pool of persistent HTTP(S) connections
+
+    Connections are reused for consecutive requests to the same host
+    (e.g. for md5sums file and for the dump itself), redirects are followed.
+    Pool can be used from several threads at once.
+    """
+
+    def __init__(self, timeout=TIMEOUT):
+        self._timeout = timeout
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open(self, url, method='GET', headers=None):
+        """Sends request and yields response (in with statement)
+
+        Connection is returned to the pool after the with statement if the
+        response was read completely, otherwise it's closed.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            key, connection, response = self._request(url, method, headers)
+            if response.status not in REDIRECT_STATUSES:
+                break
+            url = urljoin(url, response.getheader('Location'))
+            response.read()
+            self._release(key, connection, response)
+        else:
+            raise DownloadException('too many redirects')
+        try:
+            yield response
+        finally:
+            self._release(key, connection, response)
+
+    def _request(self, url, method, headers):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        selector = parts.path + ('?' + parts.query if parts.query else '')
+        connection, reused = self._acquire(key)
+        try:
+            connection.request(method, selector, headers=headers or {})
+            return key, connection, connection.getresponse()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+        # idle connection was closed by the server in the meantime
+        connection, _ = self._connect(key)
+        connection.request(method, selector, headers=headers or {})
+        return key, connection, connection.getresponse()
+
+    def _acquire(self, key):
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop(), True
+        return self._connect(key)
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        return connection_class(netloc, timeout=self._timeout), False
+
+    def _release(self, key, connection, response):
+        if response.isclosed() and not response.will_close:
+            with self._lock:
+                self._idle[key].append(connection)
+        else:
+            connection.close()
+
+
+class BandwidthLimiter(object):
+
+    """Token bucket limiting total bandwidth of all downloading threads
+
+    The bucket can be shared by several processes through a state file
+    (available bytes and time of the last update), which is updated under
+    an exclusive lock (fcntl), so all processes using the same state file
+    download at most :limit: bytes per second together.
+    """
+
+    def __init__(self, limit=None, state_path=None):
+        """
+        :limit: int (bytes per second, 0 or None = unlimited)
+        :state_path: unicode [optional] (state file of shared bucket)
+        """
+        self._lock = threading.Lock()
+        self._available = 0.0
+        self._last_time = time.time()
+        self._state_file = None
+        self.set_limit(limit, state_path)
+
+    def set_limit(self, limit, state_path=None):
+        with self._lock:
+            self._limit = limit or None
+            if self._state_file is not None:
+                self._state_file.close()
+                self._state_file = None
+            if self._limit and state_path:
+                fd = os.open(state_path, os.O_RDWR | os.O_CREAT, 0o666)
+                self._state_file = os.fdopen(fd, 'r+b')
+
+    def consume(self, amount):
+        """Waits until :amount: of bytes can be transferred
+        """
+        if not self._limit:
+            return
+        with self._lock:
+            if self._state_file is None:
+                self._available, self._last_time = self._take(amount,
+                    self._available, self._last_time)
+                available = self._available
+            else:
+                available = self._take_shared(amount)
+            delay = -available / self._limit
+        if delay > 0:
+            time.sleep(delay)
+
+    def _take(self, amount, available, last_time):
+        """Returns state of the bucket after :amount: is taken from it
+        """
+        now = time.time()
+        # bucket holds at most one second worth of data
+        available = min(self._limit,
+            available + max(0.0, now - last_time) * self._limit)
+        return available - amount, now
+
+    def _take_shared(self, amount):
+        """Takes :amount: from the bucket in the state file
+
+        :returns: available bytes after the amount is taken
+        """
+        state_file = self._state_file
+        fcntl.flock(state_file.fileno(), fcntl.LOCK_EX)
+        try:
+            state_file.seek(0)
+            state = state_file.read().split()
+            if len(state) == 2:
+                available, last_time = float(state[0]), float(state[1])
+            else:
+                available, last_time = 0.0, time.time()
+            available, last_time = self._take(amount, available, last_time)
+            state_file.seek(0)
+            state_file.truncate()
+            state_file.write(b'{available!r} {time!r}\n'.format(
+                available=available, time=last_time))
+            state_file.flush()
+        finally:
+            fcntl.flock(state_file.fileno(), fcntl.LOCK_UN)
+        return available
+
+
+class TeeReader(object):
+
+    """File-like object reading from response and copying it to a file"""
+
+    def __init__(self, response, output_file):
+        """
+        :response: file-like object to read from (e.g. HTTP response)
+        :output_file: file where all read data are written
+        """
+        self._response = response
+        self._output_file = output_file
+        self._md5 = hashlib.md5()
+        self._size = 0
+
+    def read(self, size=CHUNK):
+        chunk = self._response.read(size)
+        if chunk:
+            bandwidth_limiter.consume(len(chunk))
+            self._output_file.write(chunk)
+            self._md5.update(chunk)
+            self._size += len(chunk)
+        return chunk
+
+    def md5(self):
+        """Returns MD5 hash object of the data read so far
+        """
+        return self._md5
+
+    def size(self):
+        """Returns number of bytes read so far
+        """
+        return self._size
+
+
+# shared by all downloads in this process
+connection_pool = ConnectionPool()
+bandwidth_limiter = BandwidthLimiter()
+
+
+# ---------------------------------------------------------------------------
+#  private functions
+# ---------------------------------------------------------------------------
+
+def _check_status(response, url):
+    if response.status >= 400:
+        raise DownloadException('HTTP error {status} for {url}'.format(
+            status=response.status, url=url))
+
+
+def _get_content_length(response):
+    """Returns length of content of :response: (or None if it's unknown,
+    e.g. for chunked responses)
+    """
+    length = response.getheader('Content-Length')
+    try:
+        return int(length) if length else None
+    except ValueError:
+        return None
+
+
+def _print_file_size(file_size):
+    print 'file size:', human_readable_size(file_size)\
+        if file_size is not None else 'unknown'
+
+
+def _read_to_file(response, output_file, md5=None, progressbar=None):
+    """Copies content of :response: to :output_file:
+
+    :returns: number of copied bytes
+    """
+    copied = 0
+    while True:
+        chunk = response.read(CHUNK)
+        if not chunk:
+            break
+        bandwidth_limiter.consume(len(chunk))
+        output_file.write(chunk)
+        if md5 is not None:
+            md5.update(chunk)
+        if progressbar is not None:
+            progressbar.add(len(chunk))
+        copied += len(chunk)
+    return copied
+
+
+def _hash_file(path, md5=None):
+    """Returns MD5 hash object of the file and its size
+    """
+    md5 = md5 or hashlib.md5()
+    size = 0
+    with open(path, 'rb') as hashed_file:
+        while True:
+            chunk = hashed_file.read(CHUNK)
+            if not chunk:
+                break
+            md5.update(chunk)
+            size += len(chunk)
+    return md5, size
+
+
+def _download_partial_file(url, partial_path):
+    """Downloads (rest of) the file from :url: to :partial_path:
+
+    :returns: MD5 hash object of the whole file
+    :throws: DownloadException if the connection dropped before the end
+    """
+    # rebuild MD5 state from already downloaded part
+    if os.path.exists(partial_path):
+        md5, downloaded = _hash_file(partial_path)
+    else:
+        md5, downloaded = hashlib.md5(), 0
+
+    headers = {}
+    if downloaded:
+        headers['Range'] = 'bytes={start}-'.format(start=downloaded)
+    with connection_pool.open(url, headers=headers) as response:
+        # requested range starts at the end of the file -> nothing to do
+        if downloaded and response.status \
+                == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+            response.read()
+            return md5
+        _check_status(response, url)
+        length = _get_content_length(response)
+        if downloaded and response.status == httplib.PARTIAL_CONTENT:
+            print 'resuming download at:', human_readable_size(downloaded)
+            mode = 'ab'
+        else:
+            # server ignored the range -> start from the beginning
+            md5 = hashlib.md5()
+            downloaded = 0
+            mode = 'wb'
+        # (size of the file is unknown if the server doesn't send it, then
+        # dropped connection can be found out only by the checksum)
+        file_size = downloaded + length if length is not None else None
+        _print_file_size(file_size)
+        progressbar = ProgressBar(file_size)
+        progressbar.update(downloaded)
+        with open(partial_path, mode) as output_file:
+            downloaded += _read_to_file(response, output_file, md5,
+                progressbar)
+        progressbar.finish()
+
+    if file_size is not None and downloaded < file_size:
+        raise DownloadException('connection dropped after {size}'.format(
+            size=human_readable_size(downloaded)))
+    return md5
+
+
+def _download_segmented_file(url, partial_path, connections, attempts,
+        retry_delay):
+    """Downloads the file from :url: by concurrent segments
+
+    :returns: MD5 hash object of the whole file
+    :throws: DownloadException if some segment can't be downloaded
+    """
+    segments_path = partial_path + SEGMENTS_SUFFIX
+    with connection_pool.open(url, method='HEAD') as response:
+        _check_status(response, url)
+        response.read()
+        file_size = _get_content_length(response)
+        accepts_ranges = response.getheader('Accept-Ranges') == 'bytes'
+
+    # load state of previous segmented download of the same file
+    segments = None
+    if os.path.exists(segments_path) and os.path.exists(partial_path):
+        with open(segments_path) as segments_file:
+            state = json.load(segments_file)
+        if state['size'] == file_size:
+            segments = state['segments']
+    if segments is None:
+        if not accepts_ranges or connections <= 1 or file_size is None\
+                or file_size < connections * MIN_SEGMENT_SIZE:
+            # segmented download is not possible (or not wanted, e.g. for
+            # empty or small files or files of unknown size)
+            if os.path.exists(segments_path):
+                # preallocated file of previous segmented download can't be
+                # resumed by a single stream
+                os.remove(segments_path)
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            return _download_partial_file(url, partial_path)
+        # preallocate the file and split it to segments [start, end, done]
+        with open(partial_path, 'wb') as partial_file:
+            partial_file.truncate(file_size)
+        segment_size = -(-file_size // connections)
+        segments = [[start, min(start + segment_size, file_size), 0]
+            for start in range(0, file_size, segment_size)]
+    else:
+        print 'resuming segmented download'
+
+    print 'file size:', human_readable_size(file_size)
+    progressbar = ProgressBar(file_size)
+    progressbar.update(sum(done for _, _, done in segments))
+    lock = threading.Lock()
+    failures = []
+    # segment files open for writing (by all threads)
+    open_files = []
+
+    def store_state():
+        # (called with the lock acquired) downloaded sizes of segments are
+        # counted after writing, so all their data have to be written to the
+        # disk before the state, otherwise the download could be resumed
+        # after data which were never written
+        for open_file in open_files:
+            open_file.flush()
+            os.fsync(open_file.fileno())
+        with open(segments_path, 'w') as segments_file:
+            json.dump({'size': file_size, 'segments': segments},
+                segments_file)
+
+    def download_segment(segment):
+        for attempt in range(1, attempts + 1):
+            start, end, done = segment
+            if start + done >= end:
+                return
+            if attempt > 1:
+                time.sleep(retry_delay)
+            headers = {'Range': 'bytes={s}-{e}'.format(
+                s=start + done, e=end - 1)}
+            try:
+                with connection_pool.open(url, headers=headers) as response:
+                    _check_status(response, url)
+                    if response.status != httplib.PARTIAL_CONTENT:
+                        raise DownloadException('server ignored the range')
+                    with open(partial_path, 'r+b') as partial_file:
+                        with lock:
+                            open_files.append(partial_file)
+                        try:
+                            _read_segment(response, partial_file,
+                                start + done, segment, lock, progressbar,
+                                store_state)
+                        finally:
+                            with lock:
+                                open_files.remove(partial_file)
+            except (httplib.HTTPException, socket.error,
+                    DownloadException) as exc:
+                logging.warning('Segment {s}-{e} of {url} failed: {error}'
+                    .format(s=start, e=end, url=url, error=exc))
+            finally:
+                with lock:
+                    store_state()
+        start, end, done = segment
+        if start + done < end:
+            with lock:
+                failures.append(segment)
+
+    threads = [threading.Thread(target=download_segment, args=(segment,))
+        for segment in segments]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    progressbar.finish()
+
+    if failures:
+        raise DownloadException('{n} segments failed'.format(n=len(failures)))
+    os.remove(segments_path)
+    # MD5 of segments can't be combined, so the whole file is hashed
+    md5, _ = _hash_file(partial_path)
+    return md5
+
+
+def _read_segment(response, partial_file, offset, segment, lock, progressbar,
+        store_state):
+    """Copies content of :response: to :partial_file: from :offset:
+
+    Downloaded size of the :segment: is updated and the state of all
+    segments is stored by :store_state: once per SEGMENTS_CHECKPOINT bytes.
+    """
+    partial_file.seek(offset)
+    checkpoint = 0
+    while True:
+        chunk = response.read(CHUNK)
+        if not chunk:
+            break
+        bandwidth_limiter.consume(len(chunk))
+        partial_file.write(chunk)
+        checkpoint += len(chunk)
+        with lock:
+            segment[2] += len(chunk)
+            progressbar.add(len(chunk))
+            if checkpoint >= SEGMENTS_CHECKPOINT:
+                store_state()
+                checkpoint = 0
+
+
+# ---------------------------------------------------------------------------
+#  Exceptions
+# ---------------------------------------------------------------------------
+
+class DownloadException(Exception):
+    """ Class for reprezentation of exception raised during downloading
+    """
+    pass
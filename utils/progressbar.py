@@ -6,7 +6,11 @@ import sys
 
 class ProgressBar(object):
 
-    """Class for progress visualization"""
+    """Class for progress visualization
+
+    If the total amount of work is unknown (None), only the done work is
+    shown.
+    """
 
     def __init__(self, total=100):
         self._total = total
@@ -19,12 +23,18 @@ class ProgressBar(object):
         self.update(self._done + amount)
 
     def finish(self):
-        self.update(self._total)
+        if self._total is not None:
+            self.update(self._total)
         print
 
     def draw(self):
         """Print progress bar representing current progress
         """
+        if self._total is None:
+            sys.stdout.write('\r[{bar}] {done}'.format(bar='?' * 20,
+                done=self._done))
+            sys.stdout.flush()
+            return
         # progressbar length
         LENGTH = 20
         pieces_done = int(self.get_progress() * LENGTH)
@@ -39,11 +49,15 @@ class ProgressBar(object):
 
             Returns: float (between 0 and 1)
         """
+        if not self._total:
+            # (e.g. empty file)
+            return 1.0
         return float(self._done) / self._total
 
     def update(self, done):
         """Sets how many pieces of work are done and (re)draw progressbar
         """
         # self._done has to be in interval [0; self._total]
-        self._done = max(0, min(done, self._total))
+        self._done = max(0, done if self._total is None
+            else min(done, self._total))
         self.draw()
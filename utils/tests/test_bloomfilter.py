@@ -0,0 +1,43 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for bloomfilter.py module
+"""
+
+from __future__ import unicode_literals
+from utils.bloomfilter import BloomFilter
+import unittest
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    """Class of unit tests for bloomfilter.py module"""
+
+    def test_no_false_negatives(self):
+        """ All added items has to be found in the filter
+        """
+        titles = ['Title {i}'.format(i=i) for i in range(1000)]
+        titles.append('Žluťoučký kůň')
+        titles_filter = BloomFilter(len(titles))
+        titles_filter.update(titles)
+        for title in titles:
+            self.assertIn(title, titles_filter)
+        self.assertEqual(len(titles), len(titles_filter))
+
+    def test_distinct_count(self):
+        """ Duplicate items are not counted as distinct
+        """
+        titles = ['Title {i}'.format(i=i) for i in range(1000)]
+        titles_filter = BloomFilter(len(titles))
+        titles_filter.update(titles + titles[:100])
+        self.assertEqual(1100, len(titles_filter))
+        self.assertTrue(990 <= titles_filter.distinct_count() <= 1000)
+
+    def test_false_positives_rate(self):
+        """ False positives rate should be close to the desired error rate
+        """
+        titles_filter = BloomFilter(1000, error_rate=0.01)
+        titles_filter.update('Title {i}'.format(i=i) for i in range(1000))
+        false_positives = sum(1 for i in range(10000)
+            if 'Other {i}'.format(i=i) in titles_filter)
+        self.assertLess(false_positives, 300)
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for downloader.py module
+"""
+
+from __future__ import unicode_literals
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from utils.downloader import download_large_file, DownloadException
+from utils.downloader import download_stream
+from utils.downloader import BandwidthLimiter
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# content of the file served by the test server
+CONTENT = b''.join(b'line %d\n' % i for i in range(20000))
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+
+    """Serves content with Range support, can simulate dropped connection"""
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        if self.server.send_length:
+            self.send_header('Content-Length', str(len(self.server.content)))
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        content = server.content
+        server.ranges.append(self.headers.getheader('Range'))
+        start, end = 0, len(content)
+        match = re.match(r'bytes=(\d+)-(\d*)',
+            self.headers.getheader('Range', ''))
+        if match:
+            start = int(match.group(1))
+            if match.group(2):
+                end = int(match.group(2)) + 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {s}-{e}/{total}'.format(
+                s=start, e=end - 1, total=len(content)))
+        else:
+            self.send_response(200)
+        if server.send_length:
+            self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        with server.lock:
+            drop = server.drops > 0
+            server.drops -= 1
+        if drop:
+            # send only a part of the content and close the connection
+            self.wfile.write(content[start:min(start + 10000, end)])
+        else:
+            self.wfile.write(content[start:end])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownloader(unittest.TestCase):
+
+    """Class of unit tests for downloader.py module"""
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        self.server.content = CONTENT
+        self.server.ranges = []
+        self.server.drops = 0
+        self.server.send_length = True
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{port}/dump.xml.bz2'.format(
+            port=self.server.server_port)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'dump.xml.bz2')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_download(self):
+        """ Downloading without connection problems
+        """
+        download_large_file(self.url, self.path,
+            md5sum=hashlib.md5(CONTENT).hexdigest())
+        with open(self.path, 'rb') as downloaded_file:
+            self.assertEqual(CONTENT, downloaded_file.read())
+        self.assertEqual([None], self.server.ranges)
+
+    def test_resume_after_dropped_connection(self):
+        """ Download is resumed by Range request after dropped connection
+        """
+        self.server.drops = 2
+        download_large_file(self.url, self.path,
+            md5sum=hashlib.md5(CONTENT).hexdigest(), retry_delay=0)
+        with open(self.path, 'rb') as downloaded_file:
+            self.assertEqual(CONTENT, downloaded_file.read())
+        self.assertEqual([None, 'bytes=10000-', 'bytes=20000-'],
+            self.server.ranges)
+
+    def test_wrong_checksum(self):
+        """ Wrong checksum is a hard failure after all attempts
+        """
+        with self.assertRaises(DownloadException):
+            download_large_file(self.url, self.path, md5sum='0' * 32,
+                attempts=2, retry_delay=0)
+        # each attempt downloads the whole file again
+        self.assertEqual([None, None], self.server.ranges)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_segmented_download(self):
+        """ Download by concurrent segments with dropped connections
+        """
+        self.server.drops = 2
+        download_large_file(self.url, self.path,
+            md5sum=hashlib.md5(CONTENT).hexdigest(), retry_delay=0,
+            connections=4)
+        with open(self.path, 'rb') as downloaded_file:
+            self.assertEqual(CONTENT, downloaded_file.read())
+        # 4 segments + 2 resumed ones
+        self.assertEqual(6, len(self.server.ranges))
+        self.assertFalse(os.path.exists(self.path + '.part.segments'))
+
+    def test_empty_file(self):
+        """ Empty file is downloaded by one connection
+        """
+        self.server.content = b''
+        download_large_file(self.url, self.path,
+            md5sum=hashlib.md5(b'').hexdigest(), connections=4)
+        with open(self.path, 'rb') as downloaded_file:
+            self.assertEqual(b'', downloaded_file.read())
+        self.assertEqual([None], self.server.ranges)
+
+    def test_unknown_size(self):
+        """ File of unknown size is downloaded by one connection
+        """
+        self.server.send_length = False
+        md5sum = hashlib.md5(CONTENT).hexdigest()
+        download_large_file(self.url, self.path, md5sum=md5sum,
+            connections=4)
+        with open(self.path, 'rb') as downloaded_file:
+            self.assertEqual(CONTENT, downloaded_file.read())
+        self.assertEqual([None], self.server.ranges)
+        os.remove(self.path)
+        with download_stream(self.url, self.path, md5sum) as stream:
+            self.assertEqual(CONTENT, stream.read(len(CONTENT)))
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_shared_bandwidth_limit(self):
+        """ Limiters sharing a state file download at the limit together
+        """
+        state_path = os.path.join(self.directory, 'bandwidth')
+        limiters = [BandwidthLimiter(1000000, state_path) for _ in range(2)]
+        threads = [threading.Thread(target=limiter.consume, args=(100000,))
+            for limiter in limiters]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 200 KB at 1 MB/s (each limiter alone would wait 0.1 s only)
+        self.assertGreaterEqual(time.time() - started, 0.19)
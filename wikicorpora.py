@@ -6,10 +6,14 @@ from configuration.configuration import ConfigurationException
 from environment import environment
 from subprocess import call
 #from utils.language_utils import get_language_name
-from wikicorpus.samplewikicorpus import SampleWikiCorpus
+from wikicorpus.postprocessing import FILTERS, parse_filters
+from wikicorpus.samplewikicorpus import SampleWikiCorpus, TitlesFile
+from wikicorpus.scheduler import Scheduler, parse_size
 from wikicorpus.wikicorpus import WikiCorpus, CorpusException
+from wikicorpus.workqueue import IDLE_TIMEOUT
 import argparse
 import logging
+import multiprocessing
 
 """
 This is a main file for wikicorpora command line application.
@@ -64,6 +68,12 @@ def main():
     #specific_or_not_group.add_argument('--create-own-sample',
     #    action='store_true',
     #    help='create sample from selected articles')
+    sample_group.add_argument('--sample-titles', metavar='FILE',
+        help='create sample from articles listed in FILE (one per line)')
+    sample_group.add_argument('--compact-titles', action='store_true',
+        help='keep sample titles in a compact filter (for huge lists)')
+    sample_group.add_argument('--category',
+        help='create sample from articles of CATEGORY')
 
     # download options
     download_group = parser.add_argument_group('downloading tasks')
@@ -72,19 +82,46 @@ def main():
         help='download dump if not already downloaded')
     soft_or_force_group.add_argument('--force-download', action='store_true',
         help='download dump (even if a dump already exists)')
+    download_group.add_argument('--connections', type=int, metavar='N',
+        help='download dump by N concurrent connections')
+    download_group.add_argument('--overlap', action='store_true',
+        help='create prevertical while the dump is being downloaded')
 
     # options concerning phases
     phases_group = parser.add_argument_group('corpus processing tasks')
     phases_group.add_argument('--prevertical', '-p', action='store_true',
         help='process dump to prevertical')
+    phases_group.add_argument('--category-index', action='store_true',
+        help='record category memberships during preverticalization')
     phases_group.add_argument('--vertical', '-v', action='store_true',
         help='process prevertical to vertical')
+    phases_group.add_argument('--shards', type=int, metavar='K',
+        help='run K language pipeline instances at once when verticalizing')
+    phases_group.add_argument('--stream', action='store_true',
+        help='create vertical directly from dump (with -p and -v)')
+    phases_group.add_argument('--postprocess', metavar='FILTERS',
+        type=postprocessing_filters,
+        help='chain comma-separated FILTERS on vertical when it is created'
+            ' ({names})'.format(names=','.join(FILTERS)))
     phases_group.add_argument('--terms-inference', action='store_true',
         help='infere all terms occurences')
+    phases_group.add_argument('--corpus-terms', action='store_true',
+        help='infere terms linked anywhere in the corpus as well')
+    phases_group.add_argument('--processes', type=int, metavar='N', default=1,
+        help='run N processes of terms inference at once (default 1)')
+    phases_group.add_argument('--distributed', action='store_true',
+        help='process shards of -p, -v and --terms-inference by workers')
     #phases_group.add_argument('--all-processing-tasks', '-a',
     #    action='store_true',
     #    help='execute all corpus processing steps')
 
+    # category options
+    category_group = parser.add_argument_group('category tasks')
+    category_group.add_argument('--category-subcorpus', metavar='CATEGORY',
+        help='resolve CATEGORY to list of titles and subcorpus definition')
+    category_group.add_argument('--category-depth', type=int, default=0,
+        metavar='N', help='include subcategories up to depth N (default 0)')
+
     # compilaton options
     compilation_group = parser.add_argument_group('compilation tasks')
     compilation_group.add_argument('--compile', '-c', action='store_true',
@@ -93,6 +130,30 @@ def main():
         help='print compiled corpus status generated by corpcheck')
     compilation_group.add_argument('--query',
         help='print concordances of a given CQL query')
+    compilation_group.add_argument('--show-doc', metavar='KEY=VALUE',
+        help='print document by its id, url, title or n (position from 0)')
+    compilation_group.add_argument('--show-doc-in', default='vertical',
+        choices=('prevertical', 'vertical', 'terms'),
+        help='file of the document printed by --show-doc (default: vertical)')
+
+    # scheduling options
+    schedule_group = parser.add_argument_group('scheduling tasks')
+    schedule_group.add_argument('--schedule', metavar='LANGUAGES',
+        help='run selected tasks for comma-separated LANGUAGES at once')
+    schedule_group.add_argument('--cores', type=int,
+        default=multiprocessing.cpu_count(),
+        help='number of cores for all scheduled tasks (default: all)')
+    schedule_group.add_argument('--memory', default='8G',
+        help='memory for all scheduled tasks, e.g. 64G (default: 8G)')
+
+    # distributed processing options
+    worker_group = parser.add_argument_group('distributed processing tasks')
+    worker_group.add_argument('--worker', action='store_true',
+        help='process tasks of distributed stages of the corpus')
+    worker_group.add_argument('--worker-idle', type=int, metavar='SECONDS',
+        default=IDLE_TIMEOUT,
+        help='stop worker idle for SECONDS (default: {s})'.format(
+            s=IDLE_TIMEOUT))
 
     # general options
     parser.add_argument('--usage', action='store_true',
@@ -109,12 +170,17 @@ def main():
     no_action = not any([args.force_download, args.soft_download,
         args.create_sample,
         args.prevertical, args.vertical,
-        args.terms_inference,
-        args.compile, args.check, args.query])
+        args.terms_inference, args.category_subcorpus,
+        args.compile, args.check, args.query, args.show_doc, args.worker])
 
     # sample_size has to be either int or None
     sample_size = int(args.size) if args.size else None
 
+    # building of several languages at once
+    if args.schedule:
+        schedule_languages(args)
+        return
+
     # no language specified (can be either mistake or command for info
     # about all corpora or a call without any parameters)
     if not args.language:
@@ -174,9 +240,23 @@ def main():
         else:
             corpus = WikiCorpus(language)
 
+        # preverticalization and verticalization in one streaming pass
+        # (without intermediate prevertical file)
+        stream = args.stream and args.prevertical and args.vertical
+
+        # downloading and preverticalization at once (only for full corpora,
+        # since samples are created from already downloaded dump)
+        overlap = args.overlap and args.prevertical and not sample_size\
+            and not stream and not args.distributed\
+            and (args.soft_download or args.force_download)
+        if overlap:
+            corpus.download_and_create_prevertical(force=args.force_download,
+                category_index=args.category_index)
+
         # download dump
-        if args.soft_download or args.force_download:
-            corpus.download_dump(force=args.force_download)
+        elif args.soft_download or args.force_download:
+            corpus.download_dump(force=args.force_download,
+                connections=args.connections)
 
         # sampling
         #if args.create_own_sample:
@@ -185,19 +265,44 @@ def main():
             if not sample_size:
                 raise CorpusException('Sample size (--sample-size=X) has to '
                     + ' be specified in order to create sample')
-            corpus.create_sample_dump()
+            if args.category:
+                articles = corpus.get_parent_corpus().get_category_titles(
+                    args.category, args.category_depth)
+            elif args.sample_titles:
+                articles = TitlesFile(args.sample_titles)
+            else:
+                articles = None
+            corpus.create_sample_dump(articles,
+                compact_titles=args.compact_titles)
 
         # parsing dump (preverticalization)
-        if args.prevertical:
-            corpus.create_prevertical()
+        if stream:
+            corpus.create_vertical_from_dump(
+                category_index=args.category_index, shards=args.shards,
+                postprocessing=args.postprocess, processes=args.processes)
+        elif args.prevertical and not overlap:
+            corpus.create_prevertical(category_index=args.category_index,
+                distributed=args.distributed)
+
+        # category subcorpus (resolved from category index)
+        if args.category_subcorpus:
+            corpus.create_category_subcorpus(args.category_subcorpus,
+                args.category_depth)
 
         # tokonenization and tagging (verticalization)
-        if args.vertical:
-            corpus.create_vertical()
+        if args.vertical and not stream:
+            corpus.create_vertical(shards=args.shards,
+                distributed=args.distributed, postprocessing=args.postprocess,
+                processes=args.processes)
 
         # terms occurences inference
         if args.terms_inference:
-            corpus.infere_terms_occurences()
+            corpus.infere_terms_occurences(distributed=args.distributed,
+                corpus_terms=args.corpus_terms, processes=args.processes)
+
+        # processing tasks of other nodes
+        if args.worker:
+            corpus.run_worker(idle_timeout=args.worker_idle)
 
         # corpus compilation
         if args.compile:
@@ -211,6 +316,16 @@ def main():
         if args.query:
             corpus.print_concordances(args.query)
 
+        # print one document (found by index of documents)
+        if args.show_doc:
+            key, _, value = args.show_doc.decode('utf-8').partition('=')
+            path = {
+                'prevertical': corpus.get_prevertical_path(),
+                'vertical': corpus.get_vertical_path(),
+                'terms': corpus.get_terms_vertical_path(),
+            }[args.show_doc_in]
+            corpus.print_document(key, value, path)
+
         # corpus information
         if args.info or no_action:
             corpus.print_info()
@@ -223,6 +338,68 @@ def main():
 #  helper functions
 # ---------------------------------------------------------------------------
 
+def postprocessing_filters(names):
+    """Returns list of post-processing filters given as an argument
+    """
+    try:
+        return parse_filters(names.decode('utf-8'))
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(exc.message)
+
+
+def schedule_languages(args):
+    """Runs selected tasks for several languages within cores/memory budget
+    """
+    stages = []
+    options = {}
+    if args.soft_download or args.force_download:
+        stages.append('download')
+        options['download'] = ['--force-download' if args.force_download
+            else '--soft-download']
+        if args.connections:
+            options['download'] += ['--connections', str(args.connections)]
+    if args.prevertical:
+        stages.append('prevertical')
+        options['prevertical'] = ['--prevertical']
+        if args.category_index:
+            options['prevertical'].append('--category-index')
+        if args.overlap:
+            options['prevertical'].append('--overlap')
+    if args.vertical:
+        stages.append('vertical')
+        options['vertical'] = ['--vertical']
+        if args.shards:
+            options['vertical'] += ['--shards', str(args.shards)]
+        if args.stream:
+            options['vertical'].append('--stream')
+        if args.postprocess is not None:
+            options['vertical'] += ['--postprocess',
+                ','.join(args.postprocess)]
+    if args.terms_inference:
+        stages.append('terms-inference')
+        options['terms-inference'] = ['--terms-inference']
+        if args.corpus_terms:
+            options['terms-inference'].append('--corpus-terms')
+        if args.processes > 1:
+            options['terms-inference'] += ['--processes',
+                str(args.processes)]
+    if args.compile:
+        stages.append('compile')
+        options['compile'] = ['--compile']
+    try:
+        scheduler = Scheduler(args.cores, parse_size(args.memory))
+    except ValueError as exc:
+        print exc.message
+        return
+    for language in args.schedule.split(','):
+        language = language.strip()
+        size = WikiCorpus(language).get_dump_size()
+        scheduler.add_job(language, stages, size, options)
+    failed = scheduler.run()
+    if failed:
+        print 'Building failed for: {langs}'.format(langs=', '.join(failed))
+
+
 def list_all_corpora():
     try:
         # uncompiled corpora
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for index of category memberships of documents.
+"""
+
+from __future__ import unicode_literals
+from array import array
+from collections import defaultdict
+
+
+class CategoryIndex(object):
+
+    """Index from categories to ids of documents (and subcategories)
+
+    Document ids are kept in compact integer arrays, so even index of all
+    categories of a large Wikipedia fits in memory. Index is stored as UTF-8
+    text file with one line per category:
+
+        D<tab>category<tab>id id id ...
+        S<tab>category<tab>subcategory<tab>subcategory ...
+    """
+
+    _DOCUMENTS = 'D'
+    _SUBCATEGORIES = 'S'
+
+    def __init__(self):
+        self._documents = defaultdict(lambda: array(b'l'))
+        self._subcategories = defaultdict(set)
+
+    def add_document(self, doc_id, categories):
+        """Records that document :doc_id: belongs to given :categories:
+
+        :doc_id: int
+        :categories: iterable of unicodes
+        """
+        for category in categories:
+            self._documents[category].append(doc_id)
+
+    def add_subcategory(self, category, parents):
+        """Records that :category: is a subcategory of all :parents:
+
+        :category: unicode
+        :parents: iterable of unicodes
+        """
+        for parent in parents:
+            if parent != category:
+                self._subcategories[parent].add(category)
+
+    def categories(self, category, depth=0):
+        """Returns set of :category: and its subcategories up to :depth:
+
+        :category: unicode
+        :depth: int (0 = no subcategories, None = unlimited depth)
+        """
+        found = {category}
+        frontier = [category]
+        level = 0
+        while frontier and (depth is None or level < depth):
+            next_frontier = []
+            for parent in frontier:
+                for subcategory in self._subcategories.get(parent, ()):
+                    if subcategory not in found:
+                        found.add(subcategory)
+                        next_frontier.append(subcategory)
+            frontier = next_frontier
+            level += 1
+        return found
+
+    def documents(self, category, depth=0):
+        """Returns sorted list of ids of documents in :category:
+
+        :category: unicode
+        :depth: int (how deep to descend into subcategories, None = all)
+        """
+        doc_ids = set()
+        for subcategory in self.categories(category, depth):
+            doc_ids.update(self._documents.get(subcategory, ()))
+        return sorted(doc_ids)
+
+    def save(self, path):
+        """Stores the index to file on :path:
+        """
+        with open(path, 'w') as index_file:
+            for category in sorted(self._documents):
+                line = '{kind}\t{category}\t{ids}\n'.format(
+                    kind=CategoryIndex._DOCUMENTS,
+                    category=category,
+                    ids=' '.join(map(unicode, self._documents[category])))
+                index_file.write(line.encode('utf-8'))
+            for category in sorted(self._subcategories):
+                line = '{kind}\t{category}\t{subcategories}\n'.format(
+                    kind=CategoryIndex._SUBCATEGORIES,
+                    category=category,
+                    subcategories='\t'.join(
+                        sorted(self._subcategories[category])))
+                index_file.write(line.encode('utf-8'))
+
+    @classmethod
+    def load(cls, path):
+        """Loads index stored in file on :path:
+
+        :returns: CategoryIndex
+        """
+        index = cls()
+        with open(path) as index_file:
+            for line in index_file:
+                kind, category, rest = line.decode('utf-8')\
+                    .rstrip('\n').split('\t', 2)
+                if kind == CategoryIndex._DOCUMENTS:
+                    index._documents[category].extend(
+                        int(doc_id) for doc_id in rest.split())
+                elif kind == CategoryIndex._SUBCATEGORIES:
+                    index._subcategories[category].update(rest.split('\t'))
+        return index
+
+    def __len__(self):
+        """Returns number of categories with at least one document
+        """
+        return len(self._documents)
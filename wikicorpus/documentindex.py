@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for indexes of documents of prevertical and vertical files.
+
+Index maps position of a document (in the file), its id, url and title to
+its byte offset and length in the file. It's built by DocumentIndexWriter
+from the stream which is written to the file (so no extra pass through the
+file is needed), or by build_document_index from an existing file.
+
+Index file consists of sorted arrays which are memory-mapped and searched
+binary (see DocumentIndex), so nothing is loaded into memory:
+
+    with DocumentIndex(get_index_path(vertical_path)) as index:
+        number = index.find('url', url)
+        with open(vertical_path) as vertical_file:
+            print index.read_document(vertical_file, number)
+
+Files can be also split into byte ranges of whole documents which can be
+read by parallel consumers (see DocumentIndex.shard_ranges).
+"""
+
+from __future__ import unicode_literals
+from array import array
+from bisect import bisect_left
+from termstrie import MappedArray, write_array
+import mmap
+import os
+import re
+import struct
+
+# extension of index file (appended to the path of indexed file)
+INDEX_EXTENSION = '.docindex'
+
+# attributes of documents which are indexed
+KEYS = ('id', 'url', 'title')
+
+# format of index files (see DocumentIndexWriter.save)
+FILE_MAGIC = b'WCDOCIX1'
+HEADER = struct.Struct(b'<8s2q')
+INT = b'<i'
+OFFSET = b'<q'
+
+# beginnings of lines of document tags (encoded)
+DOC_START = b'<doc'
+DOC_END = b'</doc>'
+# characters which can follow the name of document start tag
+DOC_NAME_ENDS = (b' ', b'>', b'\t')
+
+# regex matching attributes of document start tag (values can contain quotes)
+ATTRIBUTE = re.compile(br'\s(\w+)="(.*?)"(?=\s+\w+="|\s*/?>)')
+
+
+def get_index_path(path):
+    """Returns path to index of documents of given file
+    """
+    return path + INDEX_EXTENSION
+
+
+def build_document_index(path, index_path=None):
+    """Indexes documents of an existing file (one pass through the file)
+
+    :path: unicode (path to prevertical or vertical)
+    :index_path: unicode [optional] (default is given by get_index_path)
+    """
+    writer = DocumentIndexWriter(index_path or get_index_path(path))
+    with open(path, 'rb') as indexed_file:
+        for _ in writer.index(indexed_file):
+            pass
+    writer.save()
+
+
+def read_byte_range(path, start, end):
+    """Reads lines of given byte range of a file (see shard_ranges)
+
+    :path: unicode
+    :start: int (offset of the first line)
+    :end: int (offset after the last line)
+    :returns: generator of encoded lines
+    """
+    with open(path, 'rb') as input_file:
+        input_file.seek(start)
+        position = start
+        while position < end:
+            line = input_file.readline(end - position)
+            if not line:
+                return
+            position += len(line)
+            yield line
+
+
+class DocumentIndexWriter(object):
+
+    """Builder of index of documents of a stream written to a file
+
+    The stream is passed through the writer while it's written, documents
+    are found by their start and end lines:
+
+        writer = DocumentIndexWriter(get_index_path(path))
+        with open(path, 'wb') as output_file:
+            output_file.writelines(writer.index(lines))
+        writer.save()
+    """
+
+    def __init__(self, index_path):
+        """
+        :index_path: unicode (where the index is saved)
+        """
+        self._index_path = index_path
+        self._position = 0
+        # (arrays of longs, they are 64-bit on supported platforms)
+        self._offsets = array(b'l')
+        self._lengths = array(b'l')
+        # values of attributes (all KEYS of all documents) in one blob
+        self._values = bytearray()
+        self._value_offsets = array(b'l', [0])
+        # is the last document still open (without its end line)
+        self._open = False
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def index(self, lines):
+        """Indexes documents of the stream
+
+        :lines: iterable of encoded lines (or chunks of whole lines)
+        :returns: generator of the same lines
+        """
+        for chunk in lines:
+            # (fast test, most of the lines are tokens)
+            if b'doc' in chunk:
+                self._index_chunk(chunk)
+            self._position += len(chunk)
+            yield chunk
+
+    def save(self):
+        """Stores the index (atomically)
+
+        File consists of a header (magic, number of documents, size of the
+        indexed file) and of following arrays of little-endian integers (and
+        a blob of UTF-8 values):
+            offsets and lengths of documents (n_documents each)
+            offsets of values (to the blob, KEYS of the document 0, KEYS of
+                the document 1 and so on, len(KEYS) * n_documents + 1)
+            permutations of documents sorted by values (n_documents for each
+                of KEYS)
+            blob of values
+        """
+        self._close_document(self._position)
+        n_documents = len(self)
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'wb') as index_file:
+            index_file.write(HEADER.pack(FILE_MAGIC, n_documents,
+                self._position))
+            for values in (self._offsets, self._lengths,
+                    self._value_offsets):
+                write_array(index_file, values, OFFSET)
+            # (permutations are sorted one by one by precomputed values)
+            blob = bytes(self._values)
+            for key_index in range(len(KEYS)):
+                values = self._get_values(blob, key_index)
+                write_array(index_file, sorted(xrange(n_documents),
+                    key=values.__getitem__), INT)
+            index_file.write(blob)
+        os.rename(tmp_path, self._index_path)
+
+    def _index_chunk(self, chunk):
+        """Finds start and end lines of documents in chunk of whole lines
+        """
+        events = sorted([(start, True) for start
+                in _line_starts(chunk, DOC_START)]
+            + [(start, False) for start in _line_starts(chunk, DOC_END)])
+        for start, is_start in events:
+            line_end = chunk.find(b'\n', start)
+            line_end = len(chunk) if line_end == -1 else line_end + 1
+            if not is_start:
+                self._close_document(self._position + line_end)
+            elif chunk[start + len(DOC_START):start + len(DOC_START) + 1]\
+                    in DOC_NAME_ENDS:
+                self._open_document(self._position + start,
+                    chunk[start:line_end])
+
+    def _open_document(self, offset, start_line):
+        # documents without end line end by the start of the next one
+        self._close_document(offset)
+        self._offsets.append(offset)
+        self._lengths.append(0)
+        attributes = dict(ATTRIBUTE.findall(start_line))
+        for key in KEYS:
+            self._values += attributes.get(key.encode(), b'')
+            self._value_offsets.append(len(self._values))
+        self._open = True
+
+    def _close_document(self, end):
+        if self._open:
+            self._lengths[-1] = end - self._offsets[-1]
+            self._open = False
+
+    def _get_values(self, blob, key_index):
+        """Returns list of values of given key of all documents
+        """
+        offsets = self._value_offsets
+        return [blob[offsets[i]:offsets[i + 1]]
+            for i in xrange(key_index, len(offsets) - 1, len(KEYS))]
+
+
+def _line_starts(chunk, prefix):
+    """Returns offsets of lines of chunk starting by given prefix
+    """
+    starts = [0] if chunk.startswith(prefix) else []
+    start = chunk.find(b'\n' + prefix)
+    while start != -1:
+        starts.append(start + 1)
+        start = chunk.find(b'\n' + prefix, start + 1)
+    return starts
+
+
+class DocumentIndex(object):
+
+    """Index of documents of a file (see DocumentIndexWriter.save)
+
+    The index is memory-mapped and searched binary, so it isn't loaded into
+    memory. Documents are numbered by their position in the file (from 0).
+    Instance can be used in with-statement as follows:
+
+        with DocumentIndex(index_path) as index:
+            <use index>
+    """
+
+    def __init__(self, index_path):
+        """
+        :index_path: unicode (path to the file created by DocumentIndexWriter)
+        """
+        with open(index_path, 'rb') as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+        magic, n_documents, self.file_size = HEADER.unpack_from(self._map, 0)
+        if magic != FILE_MAGIC:
+            raise ValueError('{path} is not a file of document index'.format(
+                path=index_path))
+        position = [HEADER.size]
+
+        def section(length, item_format=INT):
+            mapped = MappedArray(self._map, position[0], length, item_format)
+            position[0] += length * mapped.itemsize
+            return mapped
+
+        self._offsets = section(n_documents, OFFSET)
+        self._lengths = section(n_documents, OFFSET)
+        self._value_offsets = section(len(KEYS) * n_documents + 1, OFFSET)
+        self._sorted = dict((key, section(n_documents)) for key in KEYS)
+        self._blob = position[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def close(self):
+        self._map.close()
+
+    def get_range(self, number):
+        """Returns (byte offset, length) of the document
+
+        :number: int (position of the document in the file)
+        """
+        return self._offsets[number], self._lengths[number]
+
+    def get_value(self, number, key):
+        """Returns value of attribute of the document (or '' if it's missing)
+
+        :number: int
+        :key: unicode (one of KEYS)
+        """
+        return self._get_encoded(number, KEYS.index(key)).decode('utf-8')
+
+    def find(self, key, value):
+        """Returns number of the (first) document with given value (or None)
+
+        :key: unicode (one of KEYS)
+        :value: unicode
+        """
+        values = SortedValues(self, key)
+        encoded = value.encode('utf-8')
+        i = bisect_left(values, encoded)
+        if i < len(values) and values[i] == encoded:
+            return self._sorted[key][i]
+        return None
+
+    def read_document(self, input_file, number):
+        """Returns the document (encoded, with its start and end lines)
+
+        :input_file: file object of the indexed file
+        :number: int
+        """
+        offset, length = self.get_range(number)
+        input_file.seek(offset)
+        return input_file.read(length)
+
+    def shard_ranges(self, shards):
+        """Splits the indexed file into byte ranges of whole documents
+
+        Ranges are of approximately the same size and they cover the whole
+        file, so they can be processed by parallel consumers (see
+        read_byte_range) and their outputs can be concatenated.
+
+        :shards: int (maximal number of ranges)
+        :returns: list of (start, end) offsets
+        """
+        boundaries = [0]
+        for shard in range(1, shards):
+            number = bisect_left(self._offsets,
+                shard * self.file_size // shards)
+            if number < len(self):
+                boundaries.append(max(boundaries[-1], self._offsets[number]))
+        boundaries.append(self.file_size)
+        return [(start, end) for start, end
+            in zip(boundaries, boundaries[1:]) if start < end]
+
+    def _get_encoded(self, number, key_index):
+        value_index = number * len(KEYS) + key_index
+        return self._map[self._blob + self._value_offsets[value_index]:
+            self._blob + self._value_offsets[value_index + 1]]
+
+
+class SortedValues(object):
+
+    """Read-only sorted sequence of encoded values of an attribute
+
+    (view of DocumentIndex for binary search)
+    """
+
+    def __init__(self, index, key):
+        self._index = index
+        self._key_index = KEYS.index(key)
+        self._sorted = index._sorted[key]
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def __getitem__(self, i):
+        return self._index._get_encoded(self._sorted[i], self._key_index)
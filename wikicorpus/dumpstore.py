@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for shared content-addressed store of Wikipedia dumps.
+"""
+
+from __future__ import unicode_literals
+from contextlib import contextmanager
+from utils.system_utils import makedirs
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+# size of chunks read when hashing entries
+CHUNK = 1024 * 1024
+
+
+class DumpStore(object):
+
+    """Store of dumps shared by all corpora, keyed by upstream MD5 checksum
+
+    Corpora point at store entries by hardlinks (or by copies if the store
+    is on another device), so each dump version is stored and downloaded only
+    once. Least recently used entries are evicted if the size of the store
+    exceeds the quota, but only entries which are not linked by any corpus
+    (the others wouldn't free any space). So dumps of corpora always stay
+    available to them.
+
+    Entries are added and linked under an exclusive lock of the entry
+    (fcntl, shared by all processes using the store), so processes fetching
+    the same dump version at once don't overwrite each other's files and
+    an entry is published (renamed into place) only when it's complete.
+    """
+
+    # extension of store entries
+    ENTRY_EXTENSION = 'xml.bz2'
+
+    # extension of lock files of entries
+    LOCK_EXTENSION = 'lock'
+
+    def __init__(self, path, quota=0):
+        """
+        :path: unicode (directory of the store)
+        :quota: int (maximal size of the store in bytes, 0 = unlimited)
+        """
+        self._path = path
+        self._quota = quota
+        makedirs(path)
+
+    def get_entry_path(self, checksum):
+        """Returns path to the store entry for given checksum
+        """
+        return os.path.join(self._path, '{checksum}.{ext}'.format(
+            checksum=checksum, ext=DumpStore.ENTRY_EXTENSION))
+
+    def contains(self, checksum):
+        """Returns True if dump with given checksum is in the store
+        """
+        return os.path.isfile(self.get_entry_path(checksum))
+
+    def add(self, checksum, path, verified=False, replace=False):
+        """Adds file on :path: to the store (as an entry for :checksum:)
+
+        The file is linked (or copied) to a unique temporary file in the
+        store first, it's renamed to the entry only if its MD5 checksum is
+        right.
+
+        :checksum: unicode
+        :path: unicode
+        :verified: Boolean
+            if True, the checksum of the file was already verified (e.g.
+            while it was downloaded), so it isn't hashed again
+        :replace: Boolean (if True, existing entry is replaced)
+        :throws: DumpStoreException if the checksum is wrong
+        """
+        entry_path = self.get_entry_path(checksum)
+        with self._locked(checksum):
+            if os.path.exists(entry_path) and not replace:
+                return
+            tmp_path = self._make_temporary_path(entry_path)
+            try:
+                os.remove(tmp_path)
+                try:
+                    os.link(path, tmp_path)
+                except OSError as exc:
+                    if exc.errno != errno.EXDEV:
+                        raise
+                    # store is on another device -> the file has to be copied
+                    shutil.copyfile(path, tmp_path)
+                if not verified and hash_file(tmp_path) != checksum:
+                    raise DumpStoreException('Wrong MD5 checksum of {path}'
+                        .format(path=path))
+                os.rename(tmp_path, entry_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def fetch(self, checksum, target_path, download, force=False):
+        """Makes :target_path: point at the entry, downloads it if it's missing
+
+        Only one process downloads the entry, others wait for it.
+
+        :checksum: unicode
+        :target_path: unicode
+        :download: function downloading the dump to given path (it has to
+            verify the checksum and create the file only if it's right)
+        :force: Boolean
+            if True, the entry is downloaded again even if it's in the store
+            (corpora linking the old entry keep their files)
+        :returns: True if the entry was downloaded, False if it was in store
+        """
+        entry_path = self.get_entry_path(checksum)
+        with self._locked(checksum):
+            if force and os.path.isfile(entry_path):
+                os.remove(entry_path)
+            downloaded = not os.path.isfile(entry_path)
+            if downloaded:
+                download(entry_path)
+            self._link(checksum, target_path)
+        return downloaded
+
+    def link(self, checksum, target_path):
+        """Makes :target_path: point at the store entry for :checksum:
+
+        Existing file on :target_path: is replaced.
+        """
+        with self._locked(checksum):
+            self._link(checksum, target_path)
+
+    def evict(self, keep=()):
+        """Removes least recently used entries until the store fits quota
+
+        Entries linked by corpora (or locked by other processes) are kept,
+        since removing them wouldn't free any space (or they're being used).
+
+        :keep: checksums of entries which must not be removed
+        """
+        if not self._quota:
+            return
+        keep_paths = set(self.get_entry_path(checksum) for checksum in keep)
+        entries = []
+        for name in os.listdir(self._path):
+            if name.endswith('.' + DumpStore.ENTRY_EXTENSION):
+                path = os.path.join(self._path, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path, name))
+        total_size = sum(size for _, size, _, _ in entries)
+        for _, size, path, name in sorted(entries):
+            if total_size <= self._quota:
+                break
+            if path in keep_paths:
+                continue
+            checksum = name[:-len('.' + DumpStore.ENTRY_EXTENSION)]
+            with self._locked(checksum, blocking=False) as locked:
+                # only entries without other links free space
+                if not locked or not os.path.exists(path)\
+                        or os.stat(path).st_nlink > 1:
+                    continue
+                logging.info('Evicting dump {path} from dump store.'.format(
+                    path=path))
+                os.remove(path)
+            total_size -= size
+
+    def _link(self, checksum, target_path):
+        """Links the entry to :target_path: (the entry has to be locked)
+        """
+        entry_path = self.get_entry_path(checksum)
+        # mark the entry as recently used
+        os.utime(entry_path, None)
+        if os.path.exists(target_path)\
+                and os.path.samefile(entry_path, target_path):
+            return
+        tmp_path = self._make_temporary_path(target_path)
+        try:
+            os.remove(tmp_path)
+            try:
+                os.link(entry_path, tmp_path)
+            except OSError as exc:
+                if exc.errno != errno.EXDEV:
+                    raise
+                # store is on another device -> the entry has to be copied
+                # (a symlink would be broken by eviction of the entry)
+                shutil.copyfile(entry_path, tmp_path)
+            os.rename(tmp_path, target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _make_temporary_path(self, path):
+        """Returns unique path of a new temporary file next to :path:
+        """
+        directory, name = os.path.split(path)
+        fd, tmp_path = tempfile.mkstemp(prefix=name + '.', suffix='.tmp',
+            dir=directory or '.')
+        os.close(fd)
+        return tmp_path
+
+    @contextmanager
+    def _locked(self, checksum, blocking=True):
+        """Exclusive lock of the entry with statement manager
+
+        Yields True if the entry is locked (False only if not :blocking:
+        and the entry is locked by another process).
+        """
+        lock_path = '{path}.{ext}'.format(path=self.get_entry_path(checksum),
+            ext=DumpStore.LOCK_EXTENSION)
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX
+                    | (0 if blocking else fcntl.LOCK_NB))
+            except IOError as exc:
+                if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            # (the lock is released by closing the file)
+            yield True
+
+
+def hash_file(path):
+    """Returns MD5 checksum of the file (hexadecimal)
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as hashed_file:
+        while True:
+            chunk = hashed_file.read(CHUNK)
+            if not chunk:
+                break
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+# ----------------------------------------------------------------------------
+#  Exceptions
+# ----------------------------------------------------------------------------
+
+class DumpStoreException(Exception):
+    """ Class for reprezentation of exception raised by dump store
+    """
+    pass
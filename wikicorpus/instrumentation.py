@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for measuring stages of corpus building.
+
+Each stage (a method of a corpus decorated by measured_stage) records wall
+and CPU time, time of its subprocesses, sizes of its input and output files,
+numbers of processed documents and tokens and peak RSS. Records are appended
+as JSON lines to the report file next to the corpus, so runs of different
+months and languages can be compared, e.g.:
+
+    {"run": "node1-4242-20140301T120000", "stage": "create_vertical",
+     "status": "ok", "wall_seconds": 3512.4, "cpu_seconds": 420.1,
+     "children_seconds": 26320.7, "input_bytes": 9423110211, ...}
+"""
+
+from __future__ import unicode_literals
+from functools import wraps
+import json
+import logging
+import os
+import resource
+import socket
+import time
+
+# identifier of this run (shared by all stages run by this process)
+RUN_ID = '{host}-{pid}-{time}'.format(host=socket.gethostname(),
+    pid=os.getpid(), time=time.strftime('%Y%m%dT%H%M%S'))
+
+# marks counted in streams of documents
+DOCUMENT_END = b'</doc>'
+LINE_END = b'\n'
+TAG_LINE_START = b'\n<'
+TAG_START = b'<'
+
+
+def measured_stage(stage, inputs=(), outputs=()):
+    """Decorator of corpus methods which are stages of corpus building
+
+    Decorated method can count processed documents and tokens by wrapping
+    its streams by StageMeasurement.count (available as the attribute
+    _measurement of the corpus). Stages called from other stages are
+    measured as a part of the outer stage.
+
+    :stage: unicode (name of the stage in the report)
+    :inputs: tuple of names of corpus methods returning paths to input files
+    :outputs: tuple of names of corpus methods returning paths to outputs
+    """
+    def decorator(method):
+        @wraps(method)
+        def measured_method(corpus, *args, **kwargs):
+            if corpus._measurement is not None:
+                return method(corpus, *args, **kwargs)
+            measurement = StageMeasurement(stage)
+            corpus._measurement = measurement
+            try:
+                result = method(corpus, *args, **kwargs)
+            except BaseException:
+                measurement.status = 'failed'
+                raise
+            finally:
+                corpus._measurement = None
+                measurement.stop(
+                    [getattr(corpus, name)() for name in inputs],
+                    [getattr(corpus, name)() for name in outputs])
+                measurement.save(corpus.get_report_path(),
+                    corpus.get_corpus_name())
+            return result
+        return measured_method
+    return decorator
+
+
+class StageMeasurement(object):
+
+    """Resources used by one stage (measured since the instance creation)"""
+
+    def __init__(self, stage):
+        """
+        :stage: unicode (name of the stage)
+        """
+        self.stage = stage
+        self.status = 'ok'
+        self.documents = None
+        self.tokens = None
+        self.input_bytes = None
+        self.output_bytes = None
+        self._started = time.time()
+        self._usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._record = None
+
+    def count(self, lines, tokens=True):
+        """Counts documents (and tokens) in stream of vertical
+
+        :lines: iterable of encoded lines (or chunks of whole lines)
+        :tokens: Boolean (if False, only documents are counted)
+        :returns: generator of the same lines
+        """
+        documents = 0
+        token_lines = 0
+        try:
+            for chunk in lines:
+                documents += chunk.count(DOCUMENT_END)
+                if tokens:
+                    # lines which are not tags (chunks end by line end)
+                    token_lines += chunk.count(LINE_END)\
+                        - chunk.count(TAG_LINE_START)\
+                        - chunk.startswith(TAG_START)
+                yield chunk
+        finally:
+            self.documents = (self.documents or 0) + documents
+            if tokens:
+                self.tokens = (self.tokens or 0) + token_lines
+
+    def stop(self, input_paths=(), output_paths=()):
+        """Ends the measurement
+
+        :input_paths: list of paths to input files (or directories)
+        :output_paths: list of paths to output files (or directories)
+        """
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall_seconds = time.time() - self._started
+        if input_paths:
+            self.input_bytes = sum(path_size(path) for path in input_paths)
+        if output_paths:
+            self.output_bytes = sum(path_size(path) for path in output_paths)
+        self._record = {
+            'run': RUN_ID,
+            'stage': self.stage,
+            'status': self.status,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                time.localtime(self._started)),
+            'wall_seconds': round(wall_seconds, 3),
+            'cpu_seconds': round(cpu_time(usage) - cpu_time(self._usage), 3),
+            'children_seconds': round(cpu_time(children_usage)
+                - cpu_time(self._children_usage), 3),
+            'input_bytes': self.input_bytes,
+            'output_bytes': self.output_bytes,
+            'throughput': round(self.input_bytes / wall_seconds, 1)
+                if self.input_bytes and wall_seconds else None,
+            'documents': self.documents,
+            'tokens': self.tokens,
+            # (ru_maxrss is in kilobytes; peak of the whole process and
+            # of its largest subprocess)
+            'peak_rss_bytes': usage.ru_maxrss * 1024,
+            'children_peak_rss_bytes': children_usage.ru_maxrss * 1024,
+        }
+
+    def get_record(self):
+        """Returns measured values (dict, None before the end)
+        """
+        return self._record
+
+    def save(self, report_path, corpus_name):
+        """Appends record of the stage to the report (as one JSON line)
+        """
+        record = dict(self._record, corpus=corpus_name)
+        try:
+            with open(report_path, 'a') as report_file:
+                report_file.write(json.dumps(record, sort_keys=True) + b'\n')
+        except IOError as exc:
+            # report must not break the build
+            logging.warning('Report of stage {stage} not saved: {error}'
+                .format(stage=self.stage, error=exc))
+            return
+        logging.info('Stage {stage} took {wall:.1f} s (CPU {cpu:.1f} s,'
+            ' subprocesses {children:.1f} s).'.format(stage=self.stage,
+                wall=record['wall_seconds'], cpu=record['cpu_seconds'],
+                children=record['children_seconds']))
+
+
+def cpu_time(usage):
+    """Returns user and system time of given resource usage
+    """
+    return usage.ru_utime + usage.ru_stime
+
+
+def path_size(path):
+    """Returns size of file (or of all files in directory) on given path
+
+    :returns: int (0 if the path doesn't exist)
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(directory, name))
+            for directory, _, names in os.walk(path) for name in names)
+    if os.path.exists(path):
+        return os.path.getsize(path)
+    return 0
+
+
+def read_report(report_path):
+    """Reads all records of a report
+
+    :returns: list of dicts
+    """
+    with open(report_path) as report_file:
+        return [json.loads(line) for line in report_file if line.strip()]
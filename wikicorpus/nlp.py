@@ -5,7 +5,11 @@ from __future__ import unicode_literals
 from collections import defaultdict
 #from environment import environment
 #from registry.tagsets import TAGSETS
-from subprocess import Popen, call
+from subprocess import call
+from taggerdriver import TaggerDriver, TaggerDriverException
+from taggerdriver import BATCH_SIZE, TIMEOUT
+from tokenizer import tokenize
+import logging
 
 """
 Module for natural language processing tasks.
@@ -94,6 +98,26 @@ class NaturalLanguageProcessor(object):
         "eo": "unitok_and_sentences -l other",
     })
 
+    # pipelines replaced by built-in tokenizer and sentence splitter
+    # (which runs in-process, see tokenizer module)
+    BUILTIN_TOKENIZER_PIPELINES = frozenset([
+        "unitok_and_sentences -l other",
+        "",
+    ])
+
+    # number of pipeline instances running at once (each on one batch
+    # of the prevertical); only pipelines which can't use more cores
+    # and which are slow enough are worth sharding
+    SHARDS = defaultdict(lambda: 1, {
+        "en": 8,
+        "de": 4,
+        "fr": 4,
+        "ru": 4,
+        "cs": 4,
+        "it": 4,
+        "nl": 2,
+    })
+
     ## unitok languages names
     #UNITOK_LANGUAGES = defaultdict(lambda: 'other', (
     #    ('en', 'english'),
@@ -125,12 +149,30 @@ class NaturalLanguageProcessor(object):
     #  magic methods
     # ------------------------------------------------------------------------
 
-    def __init__(self, lang=''):
+    def __init__(self, lang='', shards=None, pipeline=None, cache=None,
+            batch_size=BATCH_SIZE, timeout=TIMEOUT):
         """ Initalization of the processor
 
         :lang: unicode (alpha-2 code of the language)
+        :shards: int [optional]
+            number of pipeline instances running at once,
+            if not set, it's taken from SHARDS
+        :pipeline: unicode [optional]
+            shell command to use instead of the language pipeline
+        :cache: TaggerCache [optional]
+            cache of tagged paragraphs (only uncached ones are sent
+            to the pipeline)
+        :batch_size: int [optional]
+            approximate size of batches fed to the pipeline (in bytes)
+        :timeout: int [optional]
+            maximal time of processing one batch (in seconds)
         """
         self._lang = lang
+        self._shards = shards or self.SHARDS[lang]
+        self._pipeline = pipeline
+        self._cache = cache
+        self._batch_size = batch_size
+        self._timeout = timeout
 
     def __enter__(self):
         return self
@@ -154,6 +196,28 @@ class NaturalLanguageProcessor(object):
     def get_language(self):
         return self._lang
 
+    def get_pipeline(self):
+        """Returns shell command of the language pipeline
+        """
+        if self._pipeline is not None:
+            return self._pipeline
+        return self.PIPELINES[self.get_language()]
+
+    def uses_builtin_tokenizer(self):
+        """Returns True if built-in tokenizer is used instead of the pipeline
+        """
+        return self.get_pipeline() in self.BUILTIN_TOKENIZER_PIPELINES
+
+    def get_cache(self):
+        """Returns cache of tagged paragraphs (or None)
+        """
+        return self._cache
+
+    def get_shards(self):
+        """Returns number of pipeline instances running at once
+        """
+        return self._shards
+
     #def get_unitok_language(self):
     #    """Returns name of language in form which is needed by unitok
     #    """
@@ -184,34 +248,120 @@ class NaturalLanguageProcessor(object):
     #  natural language processing
     # ------------------------------------------------------------------------
 
-    def create_vertical_file(self, prevertical_path, vertical_path):
+    def create_vertical_file(self, prevertical_path, vertical_path,
+            input_filter=None, output_filter=None):
         """ Creates a vertical file.
 
         Performes tokenization of prevertical and for some languages
         also morfologization (adding morfological tag and lemma/lempos)
 
+        Prevertical is split on document boundaries into batches which are
+        processed by several pipeline processes at once (see TaggerDriver).
+        Failed or hung batches are processed again and the outputs are merged
+        in the original order.
+
+        Filters are applied inline on the streams (when feeding and reading
+        the pipelines), so they don't need any extra pass through the file.
+
         :prevertical_path: unicode
             path to prevertical file
         :vertical_path: unicode
             where to store result vertical file
+        :input_filter: function [optional]
+            generator of encoded lines applied on prevertical lines
+        :output_filter: function [optional]
+            generator of encoded lines applied on vertical lines
         """
-        language = self.get_language()
-        pipeline = self.PIPELINES[language]
         try:
             # handle case of input_path == output_path
             tmp_output_path = vertical_path + '.tmp'
-            command = '{pipeline} <{inp} >{outp}'\
-                .format(pipeline=pipeline,
-                        inp=prevertical_path,
-                        outp=tmp_output_path)
-            task = Popen(command, shell=True)
-            task.wait()
-            if task.returncode != 0:
-                raise LanguageProcessorException('verticalization pipeline failed')
+            with open(prevertical_path, 'rb') as prevertical_file:
+                lines = self.process_stream(prevertical_file, input_filter,
+                    output_filter)
+                with open(tmp_output_path, 'wb') as vertical_file:
+                    vertical_file.writelines(lines)
             call(('mv', tmp_output_path, vertical_path))
+        except (IOError, OSError):
+            raise LanguageProcessorException(
+                'OSError during verticalization')
+
+    def process_stream(self, lines, input_filter=None, output_filter=None):
+        """ Processes stream of prevertical lines by the language pipeline
+
+        Lines are fed to the pipeline processes from other threads, while
+        their outputs are read and yielded, so all stages connected to the
+        input and output streams run at once. Only a limited number of batches
+        is read ahead, so the stream is never buffered in memory as a whole.
+
+        :lines: iterable of encoded lines of prevertical
+        :input_filter: function [optional]
+            generator of encoded lines applied on prevertical lines
+        :output_filter: function [optional]
+            generator of encoded lines applied on vertical lines
+        :returns: generator of encoded lines of vertical
+        """
+        if self.uses_builtin_tokenizer():
+            # in-process tokenization is faster than any cache lookup
+            if input_filter:
+                lines = input_filter(lines)
+            output_lines = tokenize(lines)
+            if output_filter:
+                output_lines = output_filter(output_lines)
+            for line in output_lines:
+                yield line
+            return
+
+        input_filter, output_filter = self._add_cache_filters(input_filter,
+            output_filter)
+        if input_filter:
+            lines = input_filter(lines)
+        driver = TaggerDriver(self.get_pipeline(), self.get_shards(),
+            batch_size=self._batch_size, timeout=self._timeout)
+        pipe = driver.process(lines)
+        output_lines = output_filter(pipe) if output_filter else pipe
+        try:
+            for line in output_lines:
+                yield line
+        except TaggerDriverException as exc:
+            raise LanguageProcessorException(exc.message)
         except OSError:
             raise LanguageProcessorException(
                 'OSError during verticalization')
+        finally:
+            # stop the pipelines even if the output is not consumed to the end
+            pipe.close()
+        self._log_cache_statistics()
+
+    def _add_cache_filters(self, input_filter=None, output_filter=None):
+        """Chains filters of the cache (if any) next to the pipeline
+
+        :returns: (input filter, output filter)
+        """
+        cache = self.get_cache()
+        if cache is None:
+            return input_filter, output_filter
+        pipeline = self.get_pipeline()
+
+        def cached_input_filter(lines):
+            if input_filter:
+                lines = input_filter(lines)
+            return cache.input_filter(pipeline, lines)
+
+        def cached_output_filter(lines):
+            lines = cache.output_filter(lines)
+            if output_filter:
+                lines = output_filter(lines)
+            return lines
+
+        return cached_input_filter, cached_output_filter
+
+    def _log_cache_statistics(self):
+        cache = self.get_cache()
+        if cache is not None:
+            logging.info('Tagger cache: {hits} hits, {misses} misses'
+                ' (hit rate {rate:.1%}).'.format(hits=cache.hits,
+                    misses=cache.misses, rate=cache.hit_rate()))
+
 #        if language == 'cs':
 #            # for czech language, use unitok + desamb
 #            self.tokenize(prevertical_path, vertical_path)
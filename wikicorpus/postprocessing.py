@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module with the chain of post-processing filters of vertical.
+
+Filters are generators of encoded lines (or chunks of whole lines) chained
+on the output stream of the language pipeline, so all of them run while the
+vertical is created, i.e. in one read of the tagged stream and one write of
+the vertical, instead of rewriting the vertical by each of them. Which
+filters are chained is configurable (see corpus-config.yaml), their order is
+always the order of FILTERS:
+
+    term-tags       moves term tags misplaced by TreeTagger (see
+                    treetaggerhack module, only for English)
+    desamb-hacks    removes desamb hacks (see remove_desamb_hacks)
+    number-lemmas   uses actual numbers as lemmata (see use_number_lemmas)
+    terms           infers occurences of terms linked in the same document
+                    (only for English, it includes desamb-hacks and
+                    number-lemmas, since lemmata are read the same way)
+    stats           counts documents and tokens of the measured stage
+"""
+
+from __future__ import unicode_literals
+from collections import deque
+from registry.tagsets import TAGSETS
+from verticaldocument import Token, TOKEN_COLUMNS, COLUMN_SEPARATOR
+from verticalreader import read_vertical, TOKEN, DESAMB_HACK
+
+# names of filters
+TERM_TAGS = 'term-tags'
+DESAMB_HACKS = 'desamb-hacks'
+NUMBER_LEMMAS = 'number-lemmas'
+TERMS = 'terms'
+STATS = 'stats'
+
+# all filters in the order of the chain
+FILTERS = (TERM_TAGS, DESAMB_HACKS, NUMBER_LEMMAS, TERMS, STATS)
+
+# filters applied only on verticals of some languages
+LANGUAGES = {
+    TERM_TAGS: ('en',),
+    TERMS: ('en',),
+}
+
+# filters which are done by another filter of the chain as well
+INCLUDED_IN = {
+    DESAMB_HACKS: TERMS,
+    NUMBER_LEMMAS: TERMS,
+}
+
+
+def parse_filters(names):
+    """Returns names of filters given by comma-separated string
+
+    :names: unicode (e.g. 'term-tags,terms,stats')
+    :returns: list of unicode
+    """
+    filters = [name.strip() for name in names.split(',') if name.strip()]
+    for name in filters:
+        if name not in FILTERS:
+            raise ValueError('unknown post-processing filter: {name}'
+                ' (use some of {names})'.format(name=name,
+                    names=', '.join(FILTERS)))
+    return filters
+
+
+def select_filters(names, language):
+    """Returns names of filters which are chained for given language
+
+    Filters are returned in the order of the chain, filters of other
+    languages and filters done by other filters of the chain are skipped.
+
+    :names: iterable of names of wanted filters
+    :language: unicode (alpha-2 code of the language of vertical)
+    :returns: list of unicode
+    """
+    names = set(names)
+    selected = [name for name in FILTERS if name in names
+        and language in LANGUAGES.get(name, (language,))]
+    return [name for name in selected
+        if INCLUDED_IN.get(name) not in selected]
+
+
+def chain(lines, filters):
+    """Applies filters on stream of vertical
+
+    :lines: iterable of encoded lines of vertical
+    :filters: list of functions (generators of lines applied on lines)
+    :returns: iterable of encoded lines (or chunks of whole lines)
+    """
+    for vertical_filter in filters:
+        lines = vertical_filter(lines)
+    return lines
+
+
+# -----------------------------------------------------------------------------
+#  filters
+# -----------------------------------------------------------------------------
+
+def remove_desamb_hacks(lines):
+    """Removes desamb hacks from vertical
+
+    Desamb splits sentences by a hack (<s hack="1">), which is removed
+    together with the last 3 lines before it (<g/>, ., </s>), the same way as
+    by terms inference (see read_document). Empty lines are removed as well.
+
+    :lines: iterable of encoded lines of vertical
+    :returns: generator of encoded lines
+    """
+    last_lines = deque()
+    for event, line in read_vertical(lines):
+        if event == DESAMB_HACK:
+            last_lines.clear()
+            continue
+        if line.isspace() or not line:
+            continue
+        last_lines.append(line)
+        if len(last_lines) > 3:
+            yield last_lines.popleft()
+    for line in last_lines:
+        yield line
+
+
+def use_number_lemmas(lines, tagset=TAGSETS.TREETAGGER):
+    """Uses actual numbers instead of number lemmata (e.g. @card@)
+
+    Tokens are formatted the same way as by terms inference (see Token),
+    lines without number lemma are not touched.
+
+    :lines: iterable of encoded lines of vertical
+    :tagset: [registry.Tagset]
+    :returns: generator of encoded lines
+    """
+    lemma_column, tag_column, number_lemma = TOKEN_COLUMNS[tagset]
+    columns = max(lemma_column, tag_column)
+    for event, line in read_vertical(lines):
+        if event == TOKEN and number_lemma in line\
+                and line.count(COLUMN_SEPARATOR) >= columns:
+            yield str(Token(line.rstrip(b'\n'), tagset)) + b'\n'
+        else:
+            yield line
@@ -4,6 +4,8 @@
 from __future__ import unicode_literals
 from copy import deepcopy
 from lxml import etree
+from utils.bloomfilter import BloomFilter
+from utils.downloader import human_readable_size
 from utils.progressbar import ProgressBar
 from utils.xml_utils import qualified_name
 from wikicorpus import WikiCorpus, CorpusException
@@ -60,17 +62,19 @@ class SampleWikiCorpus(WikiCorpus):
     #  corpus building methods
     # ------------------------------------------------------------------------
 
-    def download_dump(self, force=False):
+    def download_dump(self, force=False, connections=None):
         """ Downloads dump of Wikipedia
 
         :force: Boolean
             if True, it downloads dump even if some dump with
             target name is already downloaded
+        :connections: int [optional]
+            number of concurrent connections (segments) for downloading
         """
         # since this is a sample dump, we will download parent (full) dump
-        self.get_parent_corpus().download_dump(force)
+        self.get_parent_corpus().download_dump(force, connections)
 
-    def create_sample_dump(self, articles=None):
+    def create_sample_dump(self, articles=None, compact_titles=False):
         """ Creates smaller sample dump from large dump of given language
 
         :articles: list/set of unicodes [optional]
@@ -78,6 +82,11 @@ class SampleWikiCorpus(WikiCorpus):
             is arbitrary, if there are too many of them, some will be ommited,
             if there are too few, smaller dump will be created and message
             will be displayed.
+        :compact_titles: Boolean
+            if True, titles are kept in a Bloom filter instead of a set
+            (useful for millions of titles); :articles: then has to be
+            iterable repeatedly (e.g. list or TitlesFile), because pages
+            passing the filter are verified by another pass through it
         """
         # TODO: check that all items of articles are unicodes, not just str
 
@@ -91,7 +100,17 @@ class SampleWikiCorpus(WikiCorpus):
         namespace = parent.get_namespace()
 
         # articles specified
-        if articles:
+        if articles and compact_titles:
+            specific_sample = True
+            titles_filter = BloomFilter(sum(1 for _ in articles))
+            titles_filter.update(articles)
+            logging.info('Titles filter of {size} created.'.format(
+                size=human_readable_size(titles_filter.size_in_bytes())))
+            # titles of pages found in the dump (both verified and not yet
+            # verified ones) and page nodes waiting for verification
+            found_titles = set()
+            candidates = {}
+        elif articles:
             specific_sample = True
             articles = set(articles)
         else:
@@ -111,13 +130,10 @@ class SampleWikiCorpus(WikiCorpus):
             skip = True
             pages = 0
             last_title = None
-            if specific_sample:
-                # in case of specific sample, it's easily possible
-                # that we will need to go through the whole dump
-                # -> meassure progress as a ratio of processed part
-                progressbar = ProgressBar(parent.get_dump_length())
-            else:
-                progressbar = ProgressBar(self.sample_size())
+            # NOTE: position in compressed parent dump can't be found out
+            # (and uncompressed length is not known), so the progress is
+            # meassured by found pages even for specific samples
+            progressbar = ProgressBar(self.sample_size())
             for event, elem in context:
                 if elem.tag == REDIRECT_TAG:
                     # ignore redirect pages
@@ -133,9 +149,14 @@ class SampleWikiCorpus(WikiCorpus):
                     if skip:
                         skip = False
                         continue
-                    # if articles are not specified, take any article,
-                    # if they are specified, check if this is wanted article
-                    if not specific_sample or last_title in articles:
+                    if compact_titles and specific_sample:
+                        wanted = last_title in titles_filter\
+                            and last_title not in found_titles
+                    else:
+                        # if articles are not specified, take any article,
+                        # if they are specified, check if this is wanted one
+                        wanted = not specific_sample or last_title in articles
+                    if wanted:
                         # build page node with title and text subelements
                         page_node = etree.Element('page')
                         title_node = etree.SubElement(page_node, 'title')
@@ -146,15 +167,19 @@ class SampleWikiCorpus(WikiCorpus):
                         # append this node to sample articles
                         sample_root.append(page_node)
                         pages += 1
-                        if specific_sample:
+                        if compact_titles and specific_sample:
+                            found_titles.add(last_title)
+                            candidates[last_title] = page_node
+                            if pages == self.sample_size():
+                                # sample might be full, remove false positives
+                                pages -= self._remove_false_positives(
+                                    articles, candidates, sample_root)
+                        elif specific_sample:
                             articles.remove(last_title)
                         if pages == self.sample_size():
                             break
                     # progress update
-                    if specific_sample:
-                        progressbar.update(dump_file.tell())
-                    else:
-                        progressbar.update(pages)
+                    progressbar.update(pages)
                 # cleanup
                 elem.clear()
                 #while elem.getprevious() is not None:
@@ -165,11 +190,20 @@ class SampleWikiCorpus(WikiCorpus):
             del context
             progressbar.finish()
 
+        if compact_titles and specific_sample:
+            pages -= self._remove_false_positives(articles, candidates,
+                sample_root)
+
         # check if sample is of required size
         if pages < self.sample_size():
             logging.warning('Failed to create sample of {n} pages.'.format(
                 n=self.sample_size()))
-            if articles:
+            if compact_titles and specific_sample:
+                # listing millions of missing titles wouldn't be helpful
+                # (duplicate titles are not counted)
+                logging.warning('{n} articles not found.'.format(
+                    n=max(0, titles_filter.distinct_count() - pages)))
+            elif articles:
                 logging.warning('Following articles not found:' +
                     '\n'.join(['- ' + title for title in articles]))
 
@@ -182,6 +216,39 @@ class SampleWikiCorpus(WikiCorpus):
         logging.info('Sample of {pages} pages created at: {path}'.format(
             pages=pages, path=sample_path))
 
+    # ------------------------------------------------------------------------
+    #  private methods
+    # ------------------------------------------------------------------------
+
+    def _remove_false_positives(self, articles, candidates, sample_root):
+        """Verifies candidate pages against exact list of titles
+
+        Candidates which are not in :articles: (false positives of the titles
+        filter) are removed from the sample. Verified pages are removed from
+        :candidates: dictionary.
+
+        :articles: iterable of unicodes (exact list of wanted titles)
+        :candidates: dict (title -> page node) of unverified pages
+        :sample_root: root element of the sample
+
+        :returns: number of removed pages
+        """
+        if not candidates:
+            return 0
+        for title in articles:
+            if title in candidates:
+                del candidates[title]
+                if not candidates:
+                    return 0
+        # all remaining candidates are false positives
+        # NOTE: their titles stay in found titles, so they are not checked
+        # again if they appear in the dump once more
+        removed = len(candidates)
+        for page_node in candidates.itervalues():
+            sample_root.remove(page_node)
+        candidates.clear()
+        return removed
+
     # ------------------------------------------------------------------------
     #  magic methods
     # ------------------------------------------------------------------------
@@ -191,6 +258,32 @@ class SampleWikiCorpus(WikiCorpus):
             .format(lang=self.language(), size=self.sample_size())
 
 
+# ---------------------------------------------------------------------------
+#  Titles list
+# ---------------------------------------------------------------------------
+
+class TitlesFile(object):
+
+    """Repeatedly iterable list of titles stored in a file (one per line)
+
+    Titles are read lazily, so even a list of millions of titles doesn't have
+    to be loaded into memory.
+    """
+
+    def __init__(self, path):
+        """
+        :path: unicode (path to UTF-8 encoded file with one title per line)
+        """
+        self._path = path
+
+    def __iter__(self):
+        with open(self._path) as titles_file:
+            for line in titles_file:
+                title = line.decode('utf-8').strip()
+                if title:
+                    yield title
+
+
 # ---------------------------------------------------------------------------
 #  Exceptions
 # ---------------------------------------------------------------------------
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for building corpora of several languages at once.
+
+Each language is a job consisting of stages (downloading, preverticalization,
+verticalization, ...) which are run one after another as separate processes.
+Stages of different languages run concurrently as long as they fit into the
+global budget of cores and memory. Cost of each job is estimated from the
+size of its dump; jobs with the largest remaining cost are started first and
+smaller ones are packed into the remaining cores and memory. If the largest
+job doesn't fit, only stages estimated to finish before the job could start
+are packed, so it isn't postponed by smaller jobs forever.
+"""
+
+from __future__ import unicode_literals
+from nlp import NaturalLanguageProcessor
+from setup import project_path
+import logging
+import re
+import subprocess
+import sys
+import time
+
+# stages in the order of processing
+STAGES = ('download', 'prevertical', 'vertical', 'terms-inference', 'compile')
+
+# estimated processing time of stages (seconds per MB of compressed dump
+# and one core)
+STAGE_COSTS = {
+    'download': 0.2,
+    'prevertical': 2.0,
+    'vertical': 12.0,
+    'terms-inference': 3.0,
+    'compile': 2.0,
+}
+
+# estimated memory of stages in bytes: (base, per byte of compressed dump)
+STAGE_MEMORY = {
+    'download': (100 * 2 ** 20, 0),
+    'prevertical': (500 * 2 ** 20, 0),
+    'vertical': (200 * 2 ** 20, 0),
+    'terms-inference': (500 * 2 ** 20, 0.5),
+    'compile': (1024 * 2 ** 20, 1.0),
+}
+
+# options of stages which run the previous stage in the same process
+# (downloading with preverticalization, preverticalization with
+# verticalization), such stages are merged into one
+MERGING_OPTIONS = {
+    'prevertical': ('--overlap', 'download'),
+    'vertical': ('--stream', 'prevertical'),
+}
+
+# memory of one pipeline process during verticalization (in bytes)
+PIPELINE_MEMORY = 1024 * 2 ** 20
+
+# size assumed for dumps of unknown size (in bytes)
+DEFAULT_DUMP_SIZE = 100 * 2 ** 20
+
+# interval of checking finished stages (in seconds)
+POLL_INTERVAL = 1.0
+
+# units of memory sizes
+SIZE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMGT]?)B?$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+
+def parse_size(size):
+    """Parses size with optional unit (e.g. '64G') to number of bytes
+
+    :size: unicode
+    :returns: int
+    """
+    match = SIZE_PATTERN.match(size.strip())
+    if not match:
+        raise ValueError('invalid size: {size}'.format(size=size))
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+class Stage(object):
+
+    """One stage of a job (run as a separate process)"""
+
+    def __init__(self, name, options, cores, memory, cost):
+        """
+        :name: unicode (one of STAGES)
+        :options: list of command line options of wikicorpora.py
+        :cores: int (number of cores used by the stage)
+        :memory: int (estimated memory in bytes)
+        :cost: float (estimated time in seconds)
+        """
+        self.name = name
+        self.options = options
+        self.cores = cores
+        self.memory = memory
+        self.cost = cost
+
+    def merge(self, previous):
+        """Returns stage running the previous stage in the same process
+
+        Both stages run at once, so their memory is summed.
+
+        :previous: Stage
+        """
+        return Stage(self.name, previous.options + self.options,
+            max(self.cores, previous.cores), self.memory + previous.memory,
+            max(self.cost, previous.cost))
+
+
+class Job(object):
+
+    """Building of the corpus of one language"""
+
+    def __init__(self, language, stages):
+        """
+        :language: unicode
+        :stages: list of Stage objects (in the order of processing)
+        """
+        self.language = language
+        self.stages = list(stages)
+        self.failed = False
+
+    def remaining_cost(self):
+        return sum(stage.cost for stage in self.stages)
+
+    def __unicode__(self):
+        return '{lang}-wiki'.format(lang=self.language)
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
+class Scheduler(object):
+
+    """Scheduler of jobs within a global budget of cores and memory
+
+    Usage:
+
+        scheduler = Scheduler(cores=16, memory=parse_size('64G'))
+        scheduler.add_job('en', ['prevertical', 'vertical'], en_dump_size)
+        scheduler.add_job('cs', ['prevertical', 'vertical'], cs_dump_size)
+        failed_languages = scheduler.run()
+    """
+
+    def __init__(self, cores, memory, command=None,
+            poll_interval=POLL_INTERVAL):
+        """
+        :cores: int (number of cores available to all stages)
+        :memory: int (memory available to all stages in bytes)
+        :command: function (job, stage) -> list of arguments [optional]
+            command of a stage, by default wikicorpora.py is called with
+            language and options of the stage
+        :poll_interval: float (interval of checking finished stages)
+        """
+        self._cores = cores
+        self._memory = memory
+        self._command = command or self._wikicorpora_command
+        self._poll_interval = poll_interval
+        self._jobs = []
+
+    def add_job(self, language, stages, dump_size=None, options=None):
+        """Adds job of given language
+
+        :language: unicode
+        :stages: list of names of stages to run (subset of STAGES)
+        :dump_size: int [optional] (size of compressed dump in bytes)
+        :options: dict [optional]
+            additional command line options for each stage (--shards of
+            verticalization is limited by the budget, stages with an option
+            of MERGING_OPTIONS are merged with the previous stage)
+        """
+        options = options or {}
+        size = dump_size or DEFAULT_DUMP_SIZE
+        job_stages = []
+        for name in STAGES:
+            if name not in stages:
+                continue
+            cores = 1
+            stage_options = list(options.get(name, []))
+            if name == 'vertical':
+                shards = None
+                if '--shards' in stage_options:
+                    i = stage_options.index('--shards')
+                    shards = int(stage_options[i + 1])
+                    del stage_options[i:i + 2]
+                cores = self._vertical_cores(language, shards)
+                stage_options += ['--shards', unicode(cores)]
+            elif name == 'terms-inference' and '--processes' in stage_options:
+                processes = stage_options.index('--processes') + 1
+                cores = min(int(stage_options[processes]), self._cores)
+                stage_options[processes] = unicode(cores)
+            base_memory, relative_memory = STAGE_MEMORY[name]
+            memory = int(base_memory + relative_memory * size)
+            if name == 'vertical':
+                memory += cores * PIPELINE_MEMORY
+            cost = STAGE_COSTS[name] * size / 2 ** 20 / cores
+            stage = Stage(name, stage_options, cores, memory, cost)
+            option, previous = MERGING_OPTIONS.get(name, (None, None))
+            if option in stage_options and job_stages\
+                    and job_stages[-1].name == previous:
+                stage = stage.merge(job_stages.pop())
+            job_stages.append(stage)
+        self._jobs.append(Job(language, job_stages))
+
+    def _vertical_cores(self, language, shards=None):
+        with NaturalLanguageProcessor(language) as lp:
+            if lp.uses_builtin_tokenizer():
+                return 1
+            return max(1, min(shards or lp.get_shards(), self._cores))
+
+    def run(self):
+        """Runs all jobs
+
+        :returns: list of languages whose jobs failed
+        """
+        free_cores = self._cores
+        free_memory = self._memory
+        # running stages: process -> (job, stage, estimated end)
+        running = {}
+        waiting = [job for job in self._jobs if job.stages]
+        while waiting or running:
+            # start the most expensive jobs which fit into the budget
+            waiting.sort(key=lambda job: job.remaining_cost(), reverse=True)
+            now = time.time()
+            # estimated start of the most expensive job which doesn't fit
+            blocked_start = None
+            for job in list(waiting):
+                stage = job.stages[0]
+                fits = stage.cores <= free_cores\
+                    and stage.memory <= free_memory
+                if blocked_start is not None:
+                    if not fits or now + stage.cost > blocked_start:
+                        # it would postpone the blocked job
+                        continue
+                elif not fits and running:
+                    blocked_start = self._estimate_start(stage, free_cores,
+                        free_memory, running.values())
+                    continue
+                if not fits:
+                    # stage exceeds the whole budget, let it run alone
+                    logging.warning('Stage {stage} of {job} exceeds the'
+                        ' budget.'.format(stage=stage.name, job=job))
+                process = self._start(job, stage)
+                running[process] = (job, stage, now + stage.cost)
+                waiting.remove(job)
+                free_cores -= stage.cores
+                free_memory -= stage.memory
+            # wait for any stage to finish
+            finished = []
+            while not finished:
+                time.sleep(self._poll_interval)
+                finished = [process for process in running
+                    if process.poll() is not None]
+            for process in finished:
+                job, stage, _ = running.pop(process)
+                free_cores += stage.cores
+                free_memory += stage.memory
+                job.stages.pop(0)
+                if process.returncode != 0:
+                    job.failed = True
+                    logging.error('Stage {stage} of {job} failed.'.format(
+                        stage=stage.name, job=job))
+                elif job.stages:
+                    waiting.append(job)
+                else:
+                    logging.info('{job} finished.'.format(job=job))
+        return [job.language for job in self._jobs if job.failed]
+
+    def _estimate_start(self, stage, free_cores, free_memory, running):
+        """Returns estimated time when the stage fits into the budget
+
+        :running: list of running stages (job, stage, estimated end)
+        """
+        end = None
+        for _, running_stage, end in sorted(running, key=lambda item: item[2]):
+            free_cores += running_stage.cores
+            free_memory += running_stage.memory
+            if stage.cores <= free_cores and stage.memory <= free_memory:
+                break
+        return end
+
+    def _start(self, job, stage):
+        logging.info('Starting stage {stage} of {job} ({cores} cores,'
+            ' {memory} MB).'.format(stage=stage.name, job=job,
+                cores=stage.cores, memory=stage.memory // 2 ** 20))
+        return subprocess.Popen(self._command(job, stage))
+
+    def _wikicorpora_command(self, job, stage):
+        return [sys.executable, project_path('wikicorpora.py'),
+            job.language] + stage.options
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for persistent cache of tagged paragraphs.
+
+Most paragraphs are identical across rebuilds of the same corpus (and across
+its samples), so the vertical created by a language pipeline for a paragraph
+can be reused. The cache is applied as a pair of stream filters around the
+pipeline:
+  1) input filter replaces the content of each cached paragraph by a single
+     <cached key="..."/> tag and precedes the content of each other paragraph
+     by a <cache key="..."/> tag
+  2) the pipeline passes the tags through and tags only uncached paragraphs
+  3) output filter replaces <cached/> tags by the stored verticals and stores
+     verticals which follow <cache/> tags (up to the end of the paragraph)
+The filters can run in different threads. Verticals of cached paragraphs are
+read by the input filter already (and spooled to temporary files until the
+output filter gets to them), so they can't be evicted meanwhile, not even by
+other processes sharing the cache. Repetitions of recently sent paragraphs
+are marked as cached too, since the output filter stores the first occurence
+before it gets to them (it keeps the vertical until the last repetition).
+"""
+
+from __future__ import unicode_literals
+from collections import deque
+from contextlib import contextmanager
+import hashlib
+import logging
+import re
+import sqlite3
+import tempfile
+import threading
+
+# lines delimiting paragraphs (in prevertical and vertical)
+PARAGRAPH_START = (b'<p>', b'<p ')
+PARAGRAPH_END = b'</p>'
+
+# tags inserted into the pipeline input
+CACHED_TAG = b'<cached key="%s"/>\n'
+CACHE_TAG = b'<cache key="%s"/>\n'
+MARKER_PATTERN = re.compile(br'^<(cached?) key="([0-9a-f]+)"/>')
+
+# number of writes after which changes are committed
+COMMIT_INTERVAL = 1000
+
+# number of stored verticals after which the cache is fitted to its size
+EVICTION_INTERVAL = 10000
+
+# number of recently sent (not yet stored) paragraphs whose repetitions are
+# marked as cached as well (they are stored before the output gets to them)
+RECENT_MISSES = 100000
+
+# maximal time of waiting for the database locked by another process
+# (in seconds)
+BUSY_TIMEOUT = 60
+
+# size of temporary files of spooled verticals (in bytes), files whose
+# verticals were all output are removed
+SPOOL_SIZE = 64 * 1024 * 1024
+
+
+class TaggerCache(object):
+
+    """Persistent key-value store of verticals of paragraphs
+
+    Paragraphs are keyed by SHA-1 hash of the pipeline command and the text
+    of the paragraph. If total size of stored verticals exceeds the maximal
+    size, least recently used ones are evicted (every EVICTION_INTERVAL
+    stored verticals and when the cache is closed).
+
+    The database can be shared by several processes (e.g. scheduled builds
+    of several languages or workers). Writes are buffered and committed by
+    COMMIT_INTERVAL in short transactions, so no lock is held while paragraphs
+    are tagged, and processes wait for each other's transactions up to
+    BUSY_TIMEOUT seconds (the database has to be on a filesystem with working
+    locks then). Errors of the database are raised as TaggerCacheException.
+
+    Instance of this class can be used in with-statement as follows:
+
+        with TaggerCache(path) as cache:
+            <use cache>
+    """
+
+    def __init__(self, path, max_size=0):
+        """
+        :path: unicode (path to the database file)
+        :max_size: int (maximal size of verticals in bytes, 0 = unlimited)
+        """
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._connection = None
+        with self._database():
+            # filters can run in another thread than the one which opened
+            # cache
+            self._connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT,
+                check_same_thread=False)
+            self._connection.text_factory = str
+            self._connection.execute('CREATE TABLE IF NOT EXISTS paragraphs ('
+                'key TEXT PRIMARY KEY, vertical BLOB, size INTEGER,'
+                ' used INTEGER)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS'
+                ' paragraphs_used ON paragraphs (used)')
+            self._connection.commit()
+            self._clock = self._connection.execute(
+                'SELECT COALESCE(MAX(used), 0) FROM paragraphs').fetchone()[0]
+        # buffered writes: key -> (vertical, use) and key -> use
+        self._stored = {}
+        self._used = {}
+        self._stores = 0
+        # verticals of paragraphs marked as cached, in the order of the
+        # stream: (key, (spool, offset, length)) or (key, None) for
+        # repetitions of recent misses
+        self._marked = deque()
+        # spool files: [file, size], the last one is written
+        self._spools = deque()
+        # verticals of recent misses which are repeated: key -> [vertical,
+        # number of not yet output repetitions]
+        self._repetitions = {}
+        self._recent_misses = deque()
+        self._recent_misses_set = set()
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self._database() as connection:
+            self._flush()
+            return connection.execute(
+                'SELECT COUNT(*) FROM paragraphs').fetchone()[0]
+
+    # ------------------------------------------------------------------------
+    #  store access
+    # ------------------------------------------------------------------------
+
+    def get_key(self, pipeline, paragraph):
+        """Returns key (hexadecimal str) of (encoded) paragraph processed by
+        given pipeline
+        """
+        return hashlib.sha1(pipeline.encode('utf-8') + b'\0' + paragraph)\
+            .hexdigest()
+
+    def contains(self, key):
+        """Returns True if vertical for given key is stored
+        """
+        with self._database() as connection:
+            return key in self._stored or connection.execute(
+                'SELECT 1 FROM paragraphs WHERE key = ?', (key,))\
+                .fetchone() is not None
+
+    def lookup(self, key):
+        """Returns stored vertical for given key (or None) and marks it used
+        """
+        with self._database():
+            return self._lookup(key)
+
+    def store(self, key, vertical):
+        """Stores vertical (encoded) for given key
+        """
+        with self._database():
+            self._store(key, vertical)
+
+    def hit_rate(self):
+        """Returns ratio of cached paragraphs to all processed paragraphs
+        """
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def evict(self):
+        """Removes least recently used verticals until the cache fits size
+        """
+        with self._database():
+            self._flush()
+            self._evict()
+
+    def close(self):
+        """Evicts verticals over the maximal size and closes the cache
+        """
+        if self._connection is None:
+            return
+        self.evict()
+        for spool, _ in self._spools:
+            spool.close()
+        self._spools.clear()
+        self._marked.clear()
+        self._repetitions.clear()
+        self._connection.close()
+        self._connection = None
+
+    @contextmanager
+    def _database(self):
+        """Locks the cache, raises errors of the database as
+        TaggerCacheException
+        """
+        with self._lock:
+            try:
+                yield self._connection
+            except sqlite3.Error as exc:
+                if self._connection is not None:
+                    self._connection.rollback()
+                raise TaggerCacheException('Tagger cache failed: {error}'
+                    .format(error=exc))
+
+    def _lookup(self, key):
+        """Returns vertical and marks it used (the cache has to be locked)
+        """
+        if key in self._stored:
+            vertical = self._stored[key][0]
+        else:
+            row = self._connection.execute(
+                'SELECT vertical FROM paragraphs WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            vertical = bytes(row[0])
+        self._clock += 1
+        self._used[key] = self._clock
+        self._written()
+        return vertical
+
+    def _store(self, key, vertical):
+        """Stores vertical (the cache has to be locked)
+        """
+        self._clock += 1
+        self._stored[key] = (vertical, self._clock)
+        self._used.pop(key, None)
+        if key in self._repetitions:
+            self._repetitions[key][0] = vertical
+        # later repetitions are looked up (or tagged again if another process
+        # evicts the vertical meanwhile)
+        self._recent_misses_set.discard(key)
+        self._written()
+        self._stores += 1
+        if self._stores % EVICTION_INTERVAL == 0:
+            self._flush()
+            self._evict()
+
+    def _written(self):
+        if len(self._stored) + len(self._used) >= COMMIT_INTERVAL:
+            self._flush()
+
+    def _flush(self):
+        """Writes buffered changes in one transaction (the cache has to be
+        locked)
+        """
+        if not self._stored and not self._used:
+            return
+        self._connection.executemany('INSERT OR REPLACE INTO paragraphs'
+            ' (key, vertical, size, used) VALUES (?, ?, ?, ?)',
+            [(key, sqlite3.Binary(vertical), len(vertical), used)
+                for key, (vertical, used) in self._stored.iteritems()])
+        self._connection.executemany(
+            'UPDATE paragraphs SET used = ? WHERE key = ?',
+            [(used, key) for key, used in self._used.iteritems()])
+        self._connection.commit()
+        self._stored.clear()
+        self._used.clear()
+
+    def _evict(self):
+        """Evicts verticals (the cache has to be locked and flushed)
+        """
+        if not self._max_size:
+            return
+        total_size = self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM paragraphs').fetchone()[0]
+        if total_size <= self._max_size:
+            return
+        # find the oldest use which has to be kept
+        removed = 0
+        threshold = None
+        for used, size in self._connection.execute(
+                'SELECT used, size FROM paragraphs ORDER BY used'):
+            if total_size - removed <= self._max_size:
+                threshold = used
+                break
+            removed += size
+        if threshold is None:
+            self._connection.execute('DELETE FROM paragraphs')
+        else:
+            self._connection.execute(
+                'DELETE FROM paragraphs WHERE used < ?', (threshold,))
+        self._connection.commit()
+        logging.info('Evicted {size} bytes from tagger cache.'.format(
+            size=removed))
+
+    # ------------------------------------------------------------------------
+    #  stream filters
+    # ------------------------------------------------------------------------
+
+    def input_filter(self, pipeline, lines):
+        """Replaces content of cached paragraphs by <cached/> tags
+
+        :pipeline: unicode (command of the pipeline which processes lines)
+        :lines: iterable of encoded lines of prevertical (or chunks of them)
+        :returns: generator of encoded lines
+        """
+        paragraph = None
+        for chunk in lines:
+            for line in chunk.splitlines(True):
+                if paragraph is None:
+                    yield line
+                    if line.startswith(PARAGRAPH_START):
+                        paragraph = []
+                elif line.startswith(PARAGRAPH_END):
+                    for cached_line in self._mark_paragraph(pipeline,
+                            b''.join(paragraph)):
+                        yield cached_line
+                    yield line
+                    paragraph = None
+                else:
+                    paragraph.append(line)
+        if paragraph:
+            # unterminated paragraph (can't be cached)
+            for line in paragraph:
+                yield line
+
+    def _mark_paragraph(self, pipeline, paragraph):
+        if not paragraph.strip():
+            return [paragraph] if paragraph else []
+        key = self.get_key(pipeline, paragraph)
+        with self._database():
+            vertical = self._lookup(key)
+            if vertical is not None:
+                self._marked.append((key, self._spool(vertical)))
+            elif key in self._recent_misses_set:
+                # the output filter keeps the vertical when it stores it
+                self._repetitions.setdefault(key, [None, 0])[1] += 1
+                self._marked.append((key, None))
+            else:
+                self.misses += 1
+                self._recent_misses.append(key)
+                self._recent_misses_set.add(key)
+                if len(self._recent_misses) > RECENT_MISSES:
+                    self._recent_misses_set.discard(
+                        self._recent_misses.popleft())
+                return [CACHE_TAG % key, paragraph]
+        self.hits += 1
+        return [CACHED_TAG % key]
+
+    def _spool(self, vertical):
+        """Writes vertical to spool file (the cache has to be locked)
+
+        :returns: (spool, offset, length)
+        """
+        if not self._spools or self._spools[-1][1] >= SPOOL_SIZE:
+            self._spools.append([tempfile.TemporaryFile(), 0])
+        spool = self._spools[-1]
+        spool[0].seek(spool[1])
+        spool[0].write(vertical)
+        spool[1] += len(vertical)
+        return spool, spool[1] - len(vertical), len(vertical)
+
+    def _unspool(self, position):
+        """Reads vertical from spool file (the cache has to be locked)
+
+        Spool files are read in the order of writing, so the file is removed
+        after its last vertical is read (if it's not written anymore).
+        """
+        spool, offset, length = position
+        spool[0].seek(offset)
+        vertical = spool[0].read(length)
+        if offset + length == spool[1] and spool is not self._spools[-1]:
+            spool[0].close()
+            self._spools.popleft()
+        return vertical
+
+    def _get_marked(self, key):
+        """Returns vertical of paragraph marked as cached (in stream order)
+        """
+        with self._database():
+            if not self._marked or self._marked[0][0] != key:
+                raise TaggerCacheException('Paragraph {key} was not marked'
+                    ' as cached.'.format(key=key))
+            _, position = self._marked.popleft()
+            if position is not None:
+                return self._unspool(position)
+            repetition = self._repetitions[key]
+            repetition[1] -= 1
+            if not repetition[1]:
+                del self._repetitions[key]
+            if repetition[0] is None:
+                raise TaggerCacheException('Paragraph {key} is missing in'
+                    ' tagger cache.'.format(key=key))
+            self._clock += 1
+            self._used[key] = self._clock
+            self._written()
+            return repetition[0]
+
+    def output_filter(self, lines):
+        """Replaces <cached/> tags by stored verticals, stores new ones
+
+        :lines: iterable of encoded lines of vertical
+        :returns: generator of encoded lines
+        """
+        key = None
+        vertical = []
+        for line in lines:
+            match = MARKER_PATTERN.match(line)
+            if match:
+                tag, key = match.groups()
+                vertical = []
+                if tag == b'cached':
+                    yield self._get_marked(key)
+                    key = None
+                continue
+            if key is not None:
+                if line.startswith(PARAGRAPH_END):
+                    self.store(key, b''.join(vertical))
+                    key = None
+                else:
+                    vertical.append(line)
+            yield line
+
+
+# ----------------------------------------------------------------------------
+#  Exceptions
+# ----------------------------------------------------------------------------
+
+class TaggerCacheException(Exception):
+    """ Class for reprezentation of exception raised by tagger cache
+    """
+    pass
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for driving several language pipeline processes at once.
+
+Input stream is split on document boundaries into batches, which are
+processed by a pool of workers. Each worker runs one pipeline process per
+batch, feeds the batch to its stdin from another thread and spools its stdout
+to a temporary file. Process which doesn't finish its batch in time is killed
+and the batch is processed again. Outputs are yielded in the original order,
+line by line from the spooled files.
+
+Memory is bounded: only a limited number of batches can be read ahead
+of the consumer of the output (the reading of input blocks otherwise) and
+outputs of the pipeline are never held in memory as a whole.
+"""
+
+from __future__ import unicode_literals
+from Queue import Queue
+from subprocess import Popen, PIPE
+import errno
+import logging
+import os
+import signal
+import tempfile
+import threading
+import time
+
+# approximate size of one batch (in bytes)
+BATCH_SIZE = 32 * 1024 * 1024
+
+# maximal time of processing one batch (in seconds)
+TIMEOUT = 1800
+
+# number of attempts to process one batch
+ATTEMPTS = 3
+
+# line (or chunk of lines) which ends a document
+DOCUMENT_END = b'</doc>\n'
+
+
+class TaggerDriver(object):
+
+    """Driver of several pipeline processes fed by batches of documents
+
+    Usage:
+
+        driver = TaggerDriver('/opt/TreeTagger/tools/tt-english.sh', 8)
+        for line in driver.process(prevertical_lines):
+            <use line of vertical>
+    """
+
+    def __init__(self, pipeline, processes=1, batch_size=BATCH_SIZE,
+            timeout=TIMEOUT, attempts=ATTEMPTS):
+        """
+        :pipeline: unicode (shell command of the pipeline)
+        :processes: int (number of pipeline processes running at once)
+        :batch_size: int (approximate size of one batch in bytes)
+        :timeout: int (maximal time of processing one batch in seconds)
+        :attempts: int (number of attempts to process one batch)
+        """
+        self._pipeline = pipeline
+        self._processes = processes
+        self._batch_size = batch_size
+        self._timeout = timeout
+        self._attempts = attempts
+        self._statistics = [ProcessStatistics() for _ in range(processes)]
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def get_statistics(self):
+        """Returns list of statistics (ProcessStatistics) of all workers
+        """
+        return self._statistics
+
+    def process(self, lines):
+        """Processes lines by the pipeline processes
+
+        :lines: iterable of encoded lines of prevertical (or chunks of them)
+        :returns: generator of encoded lines of vertical (in original order)
+        """
+        self._stopped = False
+        # batches waiting for a worker
+        batches = Queue(maxsize=self._processes)
+        # batches which can be read before the consumer gets their outputs
+        window = threading.Semaphore(2 * self._processes)
+        results = {}
+        state = {'total': None, 'error': None}
+        condition = threading.Condition()
+
+        def fail(exc):
+            with condition:
+                if state['error'] is None:
+                    state['error'] = exc
+                condition.notify_all()
+
+        def read():
+            count = 0
+            try:
+                for batch in self._split(lines):
+                    window.acquire()
+                    if self._stopped:
+                        return
+                    batches.put((count, batch))
+                    count += 1
+            except Exception as exc:
+                fail(exc)
+            finally:
+                for _ in range(self._processes):
+                    batches.put(None)
+                with condition:
+                    state['total'] = count
+                    condition.notify_all()
+
+        def work(statistics):
+            while True:
+                item = batches.get()
+                if item is None:
+                    return
+                index, batch = item
+                if self._stopped:
+                    continue
+                try:
+                    output = self._process_batch(index, batch, statistics)
+                except Exception as exc:
+                    fail(exc)
+                    continue
+                with condition:
+                    if self._stopped:
+                        output.close()
+                    else:
+                        results[index] = output
+                    condition.notify_all()
+
+        threads = [threading.Thread(target=read)] + [
+            threading.Thread(target=work, args=(statistics,))
+            for statistics in self._statistics]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            index = 0
+            while True:
+                with condition:
+                    while index not in results and state['error'] is None\
+                            and state['total'] != index:
+                        # (timeout makes the wait interruptible)
+                        condition.wait(1)
+                    if state['error'] is not None:
+                        raise state['error']
+                    if index not in results:
+                        # all batches processed
+                        break
+                    output = results.pop(index)
+                window.release()
+                index += 1
+                with output:
+                    for line in output:
+                        yield line
+        finally:
+            self.stop()
+            # unblock reader (if it waits for the window)
+            for _ in range(2 * self._processes):
+                window.release()
+            for thread in threads[1:]:
+                thread.join()
+            # outputs which were not consumed
+            for output in results.values():
+                output.close()
+        self.log_statistics()
+
+    def stop(self):
+        """Stops processing (kills all running pipeline processes)
+        """
+        self._stopped = True
+        with self._lock:
+            for task in self._running:
+                self._kill(task)
+
+    def log_statistics(self):
+        """Logs throughput of all workers
+        """
+        for i, statistics in enumerate(self._statistics):
+            if statistics.batches:
+                logging.info('Pipeline process {i}: {s}'.format(
+                    i=i, s=statistics))
+
+    def _split(self, lines):
+        """Splits lines to batches of whole documents
+
+        :returns: generator of lists of encoded lines (or chunks)
+        """
+        batch = []
+        size = 0
+        for line in lines:
+            batch.append(line)
+            size += len(line)
+            if size >= self._batch_size and line.endswith(DOCUMENT_END):
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+    def _process_batch(self, index, batch, statistics):
+        """Processes batch (with restarts after failures and timeouts)
+
+        :returns: file object of the spooled output of the pipeline (it's
+            removed when closed)
+        """
+        for attempt in range(self._attempts):
+            if self._stopped:
+                return tempfile.TemporaryFile()
+            started = time.time()
+            output, returncode, timed_out = self._run_pipeline(batch)
+            statistics.add_time(time.time() - started)
+            if returncode == 0 and not timed_out:
+                output.seek(0, os.SEEK_END)
+                statistics.add_batch(sum(len(line) for line in batch),
+                    output.tell())
+                output.seek(0)
+                return output
+            output.close()
+            if self._stopped:
+                return tempfile.TemporaryFile()
+            statistics.add_restart()
+            logging.warning('Batch {i} failed ({reason}, attempt {n}).'
+                .format(i=index, n=attempt + 1, reason='timeout'
+                    if timed_out else 'exit status {s}'.format(s=returncode)))
+        raise TaggerDriverException('verticalization pipeline failed'
+            ' for batch {i}'.format(i=index))
+
+    def _run_pipeline(self, batch):
+        """Runs one pipeline process on the batch
+
+        :returns: (file object of the output, return code, True if the
+            process timed out)
+        """
+        # the pipeline writes directly to the spool file (it's removed when
+        # it's closed)
+        output = tempfile.TemporaryFile()
+        try:
+            # own process group, so the whole pipeline can be killed at once
+            task = Popen(self._pipeline, shell=True, stdin=PIPE,
+                stdout=output, preexec_fn=os.setsid)
+        except Exception:
+            output.close()
+            raise
+        with self._lock:
+            self._running.add(task)
+            if self._stopped:
+                # stopped while the process was being started
+                self._kill(task)
+        timed_out = []
+        feeding_errors = []
+
+        def kill_after_timeout():
+            timed_out.append(True)
+            self._kill(task)
+
+        def feed():
+            try:
+                for line in batch:
+                    task.stdin.write(line)
+            except IOError as exc:
+                # pipeline ended prematurely (its failure is reported)
+                if exc.errno != errno.EPIPE:
+                    feeding_errors.append(exc)
+            finally:
+                try:
+                    task.stdin.close()
+                except IOError:
+                    pass
+
+        timer = threading.Timer(self._timeout, kill_after_timeout)
+        timer.start()
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+        try:
+            task.wait()
+            feeder.join()
+        finally:
+            timer.cancel()
+            with self._lock:
+                self._running.discard(task)
+        if feeding_errors:
+            output.close()
+            raise feeding_errors[0]
+        return output, task.returncode, bool(timed_out)
+
+    def _kill(self, task):
+        try:
+            os.killpg(task.pid, signal.SIGKILL)
+        except OSError:
+            # already finished
+            pass
+
+
+class ProcessStatistics(object):
+
+    """Statistics of pipeline processes run by one worker"""
+
+    def __init__(self):
+        self.batches = 0
+        self.restarts = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_batch(self, input_bytes, output_bytes):
+        with self._lock:
+            self.batches += 1
+            self.input_bytes += input_bytes
+            self.output_bytes += output_bytes
+
+    def add_restart(self):
+        with self._lock:
+            self.restarts += 1
+
+    def add_time(self, seconds):
+        with self._lock:
+            self.seconds += seconds
+
+    def throughput(self):
+        """Returns processed input bytes per second
+        """
+        return self.input_bytes / self.seconds if self.seconds else 0.0
+
+    def __unicode__(self):
+        return '{batches} batches, {mb:.1f} MB in {s:.0f} s ({mbps:.2f} MB/s),'\
+            ' {restarts} restarts'.format(batches=self.batches,
+                mb=self.input_bytes / 1e6, s=self.seconds,
+                mbps=self.throughput() / 1e6, restarts=self.restarts)
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
+# ----------------------------------------------------------------------------
+#  Exceptions
+# ----------------------------------------------------------------------------
+
+class TaggerDriverException(Exception):
+    """ Class for reprezentation of exception raised by tagger driver
+    """
+    pass
@@ -2,6 +2,74 @@
 # encoding: utf-8
 
 from __future__ import unicode_literals
+from array import array
+from bisect import bisect_left
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+# id of lemma which is not in the lemma table (it can't continue any term)
+NO_LEMMA = -1
+
+# node of the trie which doesn't exist (failed search)
+NO_NODE = -1
+
+# the root node of the trie
+ROOT = 0
+
+# format of files of mapped tries (see TermsTrie.save)
+FILE_MAGIC = b'WCTERMS1'
+HEADER = struct.Struct(b'<8s6q')
+INT = b'<i'
+OFFSET = b'<q'
+# typecodes of arrays of the formats (longs are 64-bit on supported platforms)
+TYPECODES = {INT: b'i', OFFSET: b'l'}
+
+# number of items packed at once if an array can't be written directly
+PACKED_ITEMS = 65536
+
+
+class LemmaTable(object):
+
+    """Table of interned lemmata (lemma <-> integer id)
+
+    Tries compare integer ids only. Each trie has its own table by default,
+    so lemmata of a document are released together with its trie; a table
+    can be shared by tries of the same lemmata (ids are never removed).
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._lemmata = []
+
+    def __len__(self):
+        return len(self._lemmata)
+
+    def intern(self, lemma):
+        """Returns id of the lemma (it's added to the table if it's new)
+        """
+        lemma_id = self._ids.get(lemma)
+        if lemma_id is None:
+            lemma_id = len(self._lemmata)
+            self._ids[lemma] = lemma_id
+            self._lemmata.append(lemma)
+        return lemma_id
+
+    def get_id(self, lemma):
+        """Returns id of the lemma (NO_LEMMA if it's not in the table)
+        """
+        return self._ids.get(lemma, NO_LEMMA)
+
+    def get_lemma(self, lemma_id):
+        return self._lemmata[lemma_id]
+
+
+def lemma_hash(encoded_lemma):
+    """Returns hash of encoded lemma (the same in all processes)
+    """
+    return zlib.crc32(encoded_lemma) & 0xffffffff
 
 
 class TermsTrie(object):
@@ -17,13 +85,39 @@ class TermsTrie(object):
         |           +-> END -> "white"
         +-> white ->|
                     +-> cube +-> END -> "white cubes"
+
+    Lemmata are represented by integer ids (see LemmaTable). Nodes are
+    numbered in breadth-first order and children of each node are stored
+    in one array sorted by lemma ids, so the whole trie consists of two
+    integer arrays:
+        _child_start[node] .. _child_start[node + 1] is the range of children
+            of the node
+        _child_lemmas[i] is the lemma id of the i-th child (which is node i + 1)
+    and a (sparse) dict of names of terms ending in nodes. A child is found
+    by binary search. The trie is (re)built from added terms before the
+    first search.
     """
 
-    _TERM_END = 0
+    def __init__(self, lemmas=None):
+        """
+        :lemmas: LemmaTable [optional] (table of lemma ids shared with other
+            tries, a new one is created by default)
+        """
+        self._lemmas = lemmas if lemmas is not None else LemmaTable()
+        # added terms: canonical form (tuple of lemma ids) -> name
+        self._forms = {}
+        self._child_start = array(b'i', [0, 0])
+        self._child_lemmas = array(b'i')
+        self._term_names = {}
+        self._built = True
+        self._automaton = None
+        self._current = ROOT
 
-    def __init__(self):
-        self._trie = {}
-        self._current = self._trie
+    def __len__(self):
+        """Returns number of nodes
+        """
+        self._build()
+        return len(self._child_lemmas) + 1
 
     def add(self, name, canonical_form):
         """Add new term to termtrie
@@ -31,13 +125,69 @@ class TermsTrie(object):
         :name: [unicode] name of the term
         :canonical_form: [list<unicode>] list of lemmata
         """
-        node = self._trie
-        for lemma in canonical_form:
-            # step down one level in trie; create empty subtrie
-            # if it hasn't existed before
-            node = node.setdefault(lemma, {})
+        form = tuple(self._lemmas.intern(lemma) for lemma in canonical_form)
         # TODO: hlasit problem 2 kanonickych forem s ruznymy nazvy
-        node[TermsTrie._TERM_END] = name
+        self._forms[form] = name
+        self._built = False
+        self._automaton = None
+
+    def _build(self):
+        """Builds arrays of the trie from added terms
+        """
+        if self._built:
+            return
+        child_start = array(b'i')
+        child_lemmas = array(b'i')
+        term_names = {}
+        # nodes waiting for their children (in breadth-first order):
+        # (depth, sorted canonical forms starting by the path to the node)
+        nodes = [(0, sorted(self._forms))]
+        for node, (depth, forms) in enumerate(nodes):
+            child_start.append(len(child_lemmas))
+            child_forms = None
+            for form in forms:
+                if len(form) == depth:
+                    term_names[node] = self._forms[form]
+                    continue
+                lemma_id = form[depth]
+                if not child_lemmas or child_forms is None\
+                        or child_lemmas[-1] != lemma_id:
+                    # (forms are sorted, so forms of a child are adjacent)
+                    child_lemmas.append(lemma_id)
+                    child_forms = []
+                    nodes.append((depth + 1, child_forms))
+                child_forms.append(form)
+            nodes[node] = None
+        child_start.append(len(child_lemmas))
+        self._child_start = child_start
+        self._child_lemmas = child_lemmas
+        self._term_names = term_names
+        self._built = True
+
+    def child(self, node, lemma_id):
+        """Returns child of the node for given lemma id (or NO_NODE)
+        """
+        low = self._child_start[node]
+        high = self._child_start[node + 1]
+        i = bisect_left(self._child_lemmas, lemma_id, low, high)
+        if i < high and self._child_lemmas[i] == lemma_id:
+            return i + 1
+        return NO_NODE
+
+    def children(self, node):
+        """Returns list of (lemma id, child) of the node
+        """
+        self._build()
+        return [(self._child_lemmas[i], i + 1) for i in
+            range(self._child_start[node], self._child_start[node + 1])]
+
+    def term(self, node):
+        """Returns name of the term ending in the node (or None)
+        """
+        return self._term_names.get(node)
+
+    def get_lemma_id(self, lemma):
+        return self._lemmas.get_id(lemma)
 
     def get(self, canonical_form):
         """Returns term if there is one with given canonical form (else None)
@@ -56,7 +206,8 @@ class TermsTrie(object):
 
         Continue by TermsTrie.search_continue...
         """
-        self._current = self._trie
+        self._build()
+        self._current = ROOT
         if first_lemma is not None:
             return self.search_continue(first_lemma)
 
@@ -65,22 +216,389 @@ class TermsTrie(object):
 
         :return: True if given lemma was possible next step, False otherwise
         """
-        if self._current is None:
+        if self._current == NO_NODE:
             # TODO: specializovanejsi vyjimka?
             raise Exception('no search to continue in (use search_start())')
-        if lemma in self._current:
-            self._current = self._current[lemma]
-            return True
+        lemma_id = self._lemmas.get_id(lemma)
+        if lemma_id != NO_LEMMA:
+            self._current = self.child(self._current, lemma_id)
         else:
-            self._current = None
-            return False
+            self._current = NO_NODE
+        return self._current != NO_NODE
 
     def search_result(self):
         """Returns current search results
 
         :return: term name if search was succesful, None otherwise
         """
-        if self._current is None:
+        if self._current == NO_NODE:
             return None
         # if there is the end of a term, return the term (None otherwise)
-        return self._current.get(TermsTrie._TERM_END, None)
+        return self._term_names.get(self._current)
+
+    def get_automaton(self):
+        """Returns Aho-Corasick automaton of all added terms
+
+        (automaton is built again after new terms are added)
+        """
+        if self._automaton is None:
+            self._build()
+            self._automaton = TermsAutomaton(self)
+        return self._automaton
+
+    def save(self, path):
+        """Stores the trie with its automaton to a file (see MappedTermsTrie)
+
+        File consists of a header and of following arrays of little-endian
+        integers (and blobs of UTF-8 strings):
+            lemma offsets (to the lemma blob, n_lemmas + 1)
+            lemma hash table (ids of lemmata by lemma_hash, open addressing)
+            child start (n_nodes + 1), child lemmas (n_nodes - 1)
+            node terms (index of term ending in the node or -1, n_nodes)
+            term offsets (to the names blob, n_terms + 1)
+            depth, failure and dictionary links of states (n_nodes each)
+            lemma blob, names blob
+        Only lemmata of this trie are stored (the table can be shared with
+        other tries).
+
+        :path: unicode
+        """
+        automaton = self.get_automaton()
+        lemma_ids = sorted(set(self._child_lemmas))
+        encoded_lemmata = [self._lemmas.get_lemma(lemma_id).encode('utf-8')
+            for lemma_id in lemma_ids]
+        # lemma ids are renumbered to 0..n_lemmas-1
+        renumbered = dict((lemma_id, i) for i, lemma_id in enumerate(lemma_ids))
+        hash_size = 1
+        while hash_size < 2 * len(lemma_ids) + 1:
+            hash_size *= 2
+        hash_slots = array(b'i', [-1]) * hash_size
+        for i, encoded in enumerate(encoded_lemmata):
+            slot = lemma_hash(encoded) & (hash_size - 1)
+            while hash_slots[slot] != -1:
+                slot = (slot + 1) & (hash_size - 1)
+            hash_slots[slot] = i
+        size = len(self)
+        node_terms = array(b'i', [-1]) * size
+        names = []
+        for node in sorted(self._term_names):
+            node_terms[node] = len(names)
+            names.append(self._term_names[node].encode('utf-8'))
+        sections = [
+            (_offsets(encoded_lemmata), OFFSET),
+            (hash_slots, INT),
+            (self._child_start, INT),
+            (array(b'i', (renumbered[lemma_id]
+                for lemma_id in self._child_lemmas)), INT),
+            (node_terms, INT),
+            (_offsets(names), OFFSET),
+            (automaton._depth, INT),
+            (automaton._fail, INT),
+            (automaton._output, INT),
+        ]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as trie_file:
+            trie_file.write(HEADER.pack(FILE_MAGIC, len(lemma_ids), hash_size,
+                size, len(names), 0, 0))
+            for values, item_format in sections:
+                write_array(trie_file, values, item_format)
+            trie_file.writelines(encoded_lemmata)
+            trie_file.writelines(names)
+        os.rename(tmp_path, path)
+
+
+def _offsets(strings):
+    """Returns list of offsets of strings concatenated to a blob
+    """
+    offsets = [0]
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+    return offsets
+
+
+class MappedTermsTrie(TermsTrie):
+
+    """Immutable trie stored in a file (see TermsTrie.save)
+
+    The file is memory-mapped and read only on access, so it isn't loaded
+    into memory and its pages are shared by all processes which map it.
+    Instance can be used in with-statement as follows:
+
+        with MappedTermsTrie(path) as trie:
+            <use trie>
+    """
+
+    def __init__(self, path):
+        """
+        :path: unicode (path to the file created by TermsTrie.save)
+        """
+        with open(path, 'rb') as trie_file:
+            self._map = mmap.mmap(trie_file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+        magic, n_lemmas, hash_size, size, n_terms, _, _ = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != FILE_MAGIC:
+            raise ValueError('{path} is not a file of terms trie'.format(
+                path=path))
+        position = [HEADER.size]
+
+        def section(length, item_format=INT):
+            mapped = MappedArray(self._map, position[0], length, item_format)
+            position[0] += length * mapped.itemsize
+            return mapped
+
+        lemma_offsets = section(n_lemmas + 1, OFFSET)
+        hash_slots = section(hash_size)
+        self._child_start = section(size + 1)
+        self._child_lemmas = section(size - 1)
+        node_terms = section(size)
+        term_offsets = section(n_terms + 1, OFFSET)
+        depth = section(size)
+        fail = section(size)
+        output = section(size)
+        lemma_blob = position[0]
+        names_blob = lemma_blob + lemma_offsets[n_lemmas]
+        self._lemmas = MappedLemmaTable(self._map, lemma_offsets, hash_slots,
+            lemma_blob)
+        self._term_names = MappedTermNames(self._map, node_terms,
+            term_offsets, names_blob)
+        self._forms = None
+        self._built = True
+        self._current = ROOT
+        self._automaton = TermsAutomaton(self, depth, fail, output)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def add(self, name, canonical_form):
+        raise TypeError('mapped terms trie is immutable')
+
+    def close(self):
+        self._map.close()
+
+
+def write_array(output_file, values, item_format=INT):
+    """Writes integers as an array of little-endian format (see MappedArray)
+
+    :output_file: file object (a real file, see array.tofile)
+    :values: array or iterable of int
+    :item_format: INT or OFFSET
+    """
+    typecode = TYPECODES[item_format]
+    if not isinstance(values, array) or values.typecode != typecode:
+        values = array(typecode, values)
+    if values.itemsize == struct.calcsize(item_format):
+        if sys.byteorder != 'little':
+            values = array(typecode, values)
+            values.byteswap()
+        values.tofile(output_file)
+        return
+    # (platforms with longs of other size)
+    for start in range(0, len(values), PACKED_ITEMS):
+        packed = values[start:start + PACKED_ITEMS]
+        output_file.write(struct.pack(item_format[:1]
+            + str(len(packed)).encode() + item_format[1:], *packed))
+
+
+class MappedArray(object):
+
+    """Read-only array of integers stored in a buffer"""
+
+    def __init__(self, buffer, offset, length, item_format=INT):
+        self._buffer = buffer
+        self._offset = offset
+        self._length = length
+        self._struct = struct.Struct(item_format)
+        self.itemsize = self._struct.size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._length:
+            raise IndexError('mapped array index out of range')
+        return self._struct.unpack_from(self._buffer,
+            self._offset + index * self.itemsize)[0]
+
+
+class MappedLemmaTable(object):
+
+    """Read-only lemma table stored in a buffer (see TermsTrie.save)"""
+
+    def __init__(self, buffer, offsets, hash_slots, blob):
+        self._buffer = buffer
+        self._offsets = offsets
+        self._hash_slots = hash_slots
+        self._blob = blob
+        self._mask = len(hash_slots) - 1
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def get_id(self, lemma):
+        encoded = lemma.encode('utf-8')
+        slot = lemma_hash(encoded) & self._mask
+        while True:
+            lemma_id = self._hash_slots[slot]
+            if lemma_id == -1:
+                return NO_LEMMA
+            if self._get_encoded(lemma_id) == encoded:
+                return lemma_id
+            slot = (slot + 1) & self._mask
+
+    def get_lemma(self, lemma_id):
+        return self._get_encoded(lemma_id).decode('utf-8')
+
+    def _get_encoded(self, lemma_id):
+        return self._buffer[self._blob + self._offsets[lemma_id]:
+            self._blob + self._offsets[lemma_id + 1]]
+
+
+class MappedTermNames(object):
+
+    """Read-only names of terms ending in nodes (see TermsTrie.save)"""
+
+    def __init__(self, buffer, node_terms, offsets, blob):
+        self._buffer = buffer
+        self._node_terms = node_terms
+        self._offsets = offsets
+        self._blob = blob
+
+    def get(self, node, default=None):
+        term = self._node_terms[node]
+        if term == -1:
+            return default
+        return self._buffer[self._blob + self._offsets[term]:
+            self._blob + self._offsets[term + 1]].decode('utf-8')
+
+
+class TermsAutomaton(object):
+
+    """Aho-Corasick automaton for finding terms in a sequence of lemmata
+
+    States are nodes of the trie extended by failure links (the longest proper
+    suffix of the state which is a state as well) and dictionary links (the
+    longest proper suffix which is the end of a term). The whole sequence is
+    scanned once and all occurences of all terms are found, as opposed to
+    restarting the walk of the trie at every position.
+    """
+
+    def __init__(self, trie, depth=None, fail=None, output=None):
+        """
+        :trie: TermsTrie
+        :depth: sequence of ints [optional]
+        :fail: sequence of ints [optional]
+        :output: sequence of ints [optional]
+            already computed depths, failure and dictionary links of states
+            (see MappedTermsTrie), they are computed if not given
+        """
+        self._trie = trie
+        if depth is not None:
+            self._depth = depth
+            self._fail = fail
+            self._output = output
+            return
+        size = len(trie)
+        # depths, failure and dictionary links of states (nodes of the trie)
+        self._depth = array(b'i', [0]) * size
+        self._fail = array(b'i', [ROOT]) * size
+        self._output = array(b'i', [ROOT]) * size
+        # nodes are numbered in breadth-first order, so failure links
+        # of states at lower depths are known
+        for state in xrange(size):
+            for lemma_id, child in trie.children(state):
+                self._depth[child] = self._depth[state] + 1
+                fail = self._next_state(self._fail[state], lemma_id)\
+                    if state != ROOT else ROOT
+                self._fail[child] = fail
+                self._output[child] = fail if trie.term(fail) is not None\
+                    else self._output[fail]
+
+    def _next_state(self, state, lemma_id):
+        """Returns state after reading lemma (following failure links)
+        """
+        if lemma_id == NO_LEMMA:
+            return ROOT
+        child = self._trie.child(state, lemma_id)
+        while child == NO_NODE and state != ROOT:
+            state = self._fail[state]
+            child = self._trie.child(state, lemma_id)
+        return child if child != NO_NODE else ROOT
+
+    def next_state(self, state, lemma):
+        """Returns state after reading lemma (the initial state is ROOT)
+
+        Depth of the state is the number of the last lemmata which can still
+        be a part of a term (see get_depth), so lemmata read earlier can't.
+        """
+        return self._next_state(state, self._trie.get_lemma_id(lemma))
+
+    def get_depth(self, state):
+        return self._depth[state]
+
+    def ending_terms(self, state):
+        """Returns list of (length, term name) of all terms ending in state
+        """
+        trie = self._trie
+        terms = []
+        # the state itself and its dictionary links
+        ending = state if trie.term(state) is not None else self._output[state]
+        while ending != ROOT:
+            terms.append((self._depth[ending], trie.term(ending)))
+            ending = self._output[ending]
+        return terms
+
+    def longest_terms(self, lemmata):
+        """Finds the longest term starting at each position
+
+        :lemmata: list of unicode
+        :returns: dict start position -> (length, term name)
+        """
+        longest = {}
+        state = ROOT
+        for position, lemma in enumerate(lemmata):
+            state = self.next_state(state, lemma)
+            for length, term in self.ending_terms(state):
+                start = position - length + 1
+                if length > longest.get(start, (0, None))[0]:
+                    longest[start] = (length, term)
+        return longest
+
+    def longest_matches(self, lemmata):
+        """Finds leftmost-longest occurences of terms
+
+        For each position, the longest term starting there is found. Then
+        occurences are taken from the left, skipping those overlapping with
+        already taken ones (the same as longest-matching at each position
+        which is not covered by a previous occurence).
+
+        :lemmata: list of unicode
+        :returns: list of (start position, length, term name)
+        """
+        return select_longest_matches(self.longest_terms(lemmata))
+
+
+def select_longest_matches(*longest_terms):
+    """Selects leftmost-longest occurences from the longest terms at starts
+
+    :longest_terms: dicts start -> (length, term) (see longest_terms);
+        of terms of the same length starting at the same position, the one
+        from the first dict is selected
+    :returns: list of (start position, length, term name)
+    """
+    longest = {}
+    for terms in longest_terms:
+        for start, (length, term) in terms.items():
+            if length > longest.get(start, (0, None))[0]:
+                longest[start] = (length, term)
+    matches = []
+    covered = 0
+    for start in sorted(longest):
+        if start >= covered:
+            length, term = longest[start]
+            matches.append((start, length, term))
+            covered = start + length
+    return matches
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for documentindex.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.documentindex import DocumentIndex, DocumentIndexWriter
+from wikicorpus.documentindex import build_document_index, get_index_path
+from wikicorpus.documentindex import read_byte_range
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestDocumentIndex(unittest.TestCase):
+
+    """Class of unit tests for documentindex.py module"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'wiki_xx.vert')
+        self.documents = [
+            b'<doc id="12" url="http://xx.wikipedia.org/wiki/\xc4\x8cesko"'
+                b' title="\xc4\x8cesko">\n<s>\n\xc4\x8cesko\tNP\n</s>\n'
+                b'</doc>\n',
+            b'<doc id="3" url="http://xx.wikipedia.org/wiki/Doctor_"Who""'
+                b' title="Doctor "Who"">\n<s>\ndoctor\tNN\n</s>\n</doc>\n',
+            b'<doc id="7" url="http://xx.wikipedia.org/wiki/A"'
+                b' title="A">\n</doc>\n',
+        ]
+        # documents are written by lines and by chunks of whole lines
+        lines = b''.join(self.documents[:2]).splitlines(True)\
+            + [self.documents[2]]
+        writer = DocumentIndexWriter(get_index_path(self.path))
+        with open(self.path, 'wb') as output_file:
+            output_file.writelines(writer.index(lines))
+        writer.save()
+        self.index = DocumentIndex(get_index_path(self.path))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def test_find(self):
+        """ Documents are found by their attributes and read by offsets
+        """
+        self.assertEqual(3, len(self.index))
+        self.assertEqual(0, self.index.find('title', 'Česko'))
+        self.assertEqual(1, self.index.find('id', '3'))
+        self.assertEqual(1, self.index.find('title', 'Doctor "Who"'))
+        self.assertEqual(2, self.index.find('url',
+            'http://xx.wikipedia.org/wiki/A'))
+        self.assertIsNone(self.index.find('id', '4'))
+        self.assertEqual('Česko', self.index.get_value(0, 'title'))
+        with open(self.path, 'rb') as input_file:
+            for number, document in enumerate(self.documents):
+                self.assertEqual(document,
+                    self.index.read_document(input_file, number))
+
+    def test_build_from_file(self):
+        """ Index built from an existing file is the same
+        """
+        index_path = os.path.join(self.directory, 'index')
+        build_document_index(self.path, index_path)
+        with DocumentIndex(index_path) as index:
+            self.assertEqual(
+                [self.index.get_range(number) for number in range(3)],
+                [index.get_range(number) for number in range(3)])
+            self.assertEqual(1, index.find('title', 'Doctor "Who"'))
+
+    def test_shard_ranges(self):
+        """ File is split into byte ranges of whole documents
+        """
+        for shards in range(1, 6):
+            ranges = self.index.shard_ranges(shards)
+            self.assertLessEqual(len(ranges), shards)
+            lines = [line for start, end in ranges
+                for line in read_byte_range(self.path, start, end)]
+            self.assertEqual(b''.join(self.documents), b''.join(lines))
+            for start, end in ranges:
+                self.assertTrue(next(read_byte_range(self.path, start, end))
+                    .startswith(b'<doc'))
+
+
+if __name__ == '__main__':
+    unittest.main()
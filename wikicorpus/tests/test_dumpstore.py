@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for dumpstore.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.dumpstore import DumpStore, DumpStoreException
+from wikicorpus import dumpstore
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestDumpStore(unittest.TestCase):
+
+    """Class of unit tests for dumpstore.py module"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = DumpStore(os.path.join(self.directory, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_dump(self, name, content):
+        """Creates dump file of a corpus, returns its path and checksum
+        """
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as dump_file:
+            dump_file.write(content)
+        return path, hashlib.md5(content).hexdigest()
+
+    def list_store(self):
+        return sorted(os.listdir(os.path.join(self.directory, 'store')))
+
+    def test_add_and_link(self):
+        """ Added dump is linked to other corpora by hardlinks
+        """
+        path, checksum = self.create_dump('en.xml.bz2', b'dump')
+        self.store.add(checksum, path)
+        self.assertTrue(self.store.contains(checksum))
+        entry_path = self.store.get_entry_path(checksum)
+        self.assertTrue(os.path.samefile(path, entry_path))
+        target_path = os.path.join(self.directory, 'en10.xml.bz2')
+        self.store.link(checksum, target_path)
+        self.assertTrue(os.path.samefile(entry_path, target_path))
+        self.assertEqual(3, os.stat(entry_path).st_nlink)
+        # no temporary files are left
+        self.assertEqual([checksum + '.xml.bz2', checksum + '.xml.bz2.lock'],
+            self.list_store())
+
+    def test_add_wrong_checksum(self):
+        """ Dump with wrong checksum isn't added
+        """
+        path, _ = self.create_dump('en.xml.bz2', b'dump')
+        with self.assertRaises(DumpStoreException):
+            self.store.add('0' * 32, path)
+        self.assertFalse(self.store.contains('0' * 32))
+        self.assertEqual(['0' * 32 + '.xml.bz2.lock'], self.list_store())
+
+    def test_add_verified(self):
+        """ Verified dump isn't hashed again, it can replace the entry
+        """
+        path, checksum = self.create_dump('en.xml.bz2', b'dump')
+        self.store.add(checksum, path)
+        new_path, _ = self.create_dump('en10.xml.bz2', b'dump')
+        self.store.add(checksum, new_path, verified=True)
+        self.assertFalse(os.path.samefile(new_path,
+            self.store.get_entry_path(checksum)))
+        original_hash_file = dumpstore.hash_file
+        dumpstore.hash_file = None
+        try:
+            self.store.add(checksum, new_path, verified=True, replace=True)
+        finally:
+            dumpstore.hash_file = original_hash_file
+        self.assertTrue(os.path.samefile(new_path,
+            self.store.get_entry_path(checksum)))
+
+    def test_fetch(self):
+        """ Dump is downloaded into the store only if it's missing
+        """
+        content = b'downloaded dump'
+        checksum = hashlib.md5(content).hexdigest()
+        downloads = []
+
+        def download(path):
+            downloads.append(path)
+            with open(path, 'wb') as dump_file:
+                dump_file.write(content)
+
+        for name in ('en.xml.bz2', 'en10.xml.bz2'):
+            target_path = os.path.join(self.directory, name)
+            self.store.fetch(checksum, target_path, download)
+            with open(target_path, 'rb') as dump_file:
+                self.assertEqual(content, dump_file.read())
+        self.assertEqual([self.store.get_entry_path(checksum)], downloads)
+        # forced download replaces the entry
+        self.store.fetch(checksum, target_path, download, force=True)
+        self.assertEqual(2, len(downloads))
+        self.assertTrue(os.path.samefile(target_path,
+            self.store.get_entry_path(checksum)))
+
+    def test_eviction_under_quota(self):
+        """ Only least recently used entries without links are evicted
+        """
+        self.store = DumpStore(os.path.join(self.directory, 'store'),
+            quota=25)
+        checksums = []
+        for i, name in enumerate(('cs', 'sk', 'de', 'en')):
+            path, checksum = self.create_dump(name, name * 5)
+            self.store.add(checksum, path)
+            os.utime(self.store.get_entry_path(checksum), (i, i))
+            checksums.append(checksum)
+        # cs and de are not used by any corpus
+        os.remove(os.path.join(self.directory, 'cs'))
+        os.remove(os.path.join(self.directory, 'de'))
+        self.store.evict(keep=[checksums[3]])
+        # evicting cs (unlinked) frees 10 bytes, sk (linked) frees nothing,
+        # so de has to be evicted as well
+        self.assertEqual([False, True, False, True],
+            [self.store.contains(checksum) for checksum in checksums])
+        # linked entries are kept even if the store doesn't fit the quota
+        self.store = DumpStore(os.path.join(self.directory, 'store'),
+            quota=1)
+        self.store.evict()
+        self.assertEqual([False, True, False, True],
+            [self.store.contains(checksum) for checksum in checksums])
+
+    def test_link_across_devices(self):
+        """ Entry is copied if it can't be hardlinked (not symlinked)
+        """
+        path, checksum = self.create_dump('en.xml.bz2', b'dump')
+        self.store.add(checksum, path)
+        target_path = os.path.join(self.directory, 'en10.xml.bz2')
+        original_link = os.link
+
+        def link(source, target):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        os.link = link
+        try:
+            self.store.link(checksum, target_path)
+        finally:
+            os.link = original_link
+        self.assertFalse(os.path.islink(target_path))
+        self.assertFalse(os.path.samefile(path, target_path))
+        with open(target_path, 'rb') as dump_file:
+            self.assertEqual(b'dump', dump_file.read())
+        # evicted entry doesn't break the copy
+        os.remove(path)
+        DumpStore(os.path.join(self.directory, 'store'), quota=1).evict()
+        self.assertFalse(self.store.contains(checksum))
+        with open(target_path, 'rb') as dump_file:
+            self.assertEqual(b'dump', dump_file.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for instrumentation.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.instrumentation import measured_stage, read_report
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+
+class Corpus(object):
+
+    """Corpus with measured stages"""
+
+    def __init__(self, directory):
+        self._measurement = None
+        self.directory = directory
+
+    def get_corpus_name(self):
+        return 'wiki_xx'
+
+    def get_report_path(self):
+        return os.path.join(self.directory, 'report.jsonl')
+
+    def get_input_path(self):
+        return os.path.join(self.directory, 'input')
+
+    def get_output_path(self):
+        return os.path.join(self.directory, 'output')
+
+    @measured_stage('process', inputs=('get_input_path',),
+        outputs=('get_output_path',))
+    def process(self, lines):
+        with open(self.get_output_path(), 'w') as output_file:
+            output_file.writelines(self._measurement.count(lines))
+        self.inner_stage()
+        subprocess.call(['true'])
+
+    @measured_stage('inner_stage')
+    def inner_stage(self):
+        pass
+
+    @measured_stage('failing_stage')
+    def failing_stage(self):
+        raise ValueError('failure')
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    """Class of unit tests for instrumentation.py module"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.corpus = Corpus(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_stage_record(self):
+        """ Stage records its input, output and counts to the report
+        """
+        with open(self.corpus.get_input_path(), 'w') as input_file:
+            input_file.write(b'x' * 100)
+        lines = [b'<doc id="1">\n', b'<s>\n', b'Hello\n', b'world\n',
+            b'</s>\n', b'</doc>\n', b'<doc id="2">\nOne\nTwo\nThree\n</doc>\n']
+        self.corpus.process(lines)
+        records = read_report(self.corpus.get_report_path())
+        # inner stage is a part of the outer one
+        self.assertEqual(1, len(records))
+        record = records[0]
+        self.assertEqual('process', record['stage'])
+        self.assertEqual('ok', record['status'])
+        self.assertEqual('wiki_xx', record['corpus'])
+        self.assertEqual(100, record['input_bytes'])
+        self.assertEqual(len(b''.join(lines)), record['output_bytes'])
+        self.assertEqual(2, record['documents'])
+        self.assertEqual(5, record['tokens'])
+        self.assertGreater(record['peak_rss_bytes'], 0)
+        self.assertGreaterEqual(record['wall_seconds'], 0)
+        self.assertGreaterEqual(record['children_seconds'], 0)
+
+    def test_failed_stage(self):
+        """ Failed stage is recorded as well
+        """
+        with self.assertRaises(ValueError):
+            self.corpus.failing_stage()
+        records = read_report(self.corpus.get_report_path())
+        self.assertEqual(['failed'], [record['status'] for record in records])
+        self.assertIsNone(records[0]['documents'])
+        self.assertIsNone(self.corpus._measurement)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for nlp.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.nlp import NaturalLanguageProcessor
+from wikicorpus.nlp import LanguageProcessorException
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestNaturalLanguageProcessor(unittest.TestCase):
+
+    """Class of unit tests for nlp.py module"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.prevertical_path = os.path.join(self.directory, 'wiki.prevert')
+        self.vertical_path = os.path.join(self.directory, 'wiki.vert')
+        self.prevertical = ''.join(
+            '<doc id="{i}">\n<p>\nText {i}.\n</p>\n</doc>\n'.format(i=i)
+            for i in range(1, 21))
+        with open(self.prevertical_path, 'w') as prevertical_file:
+            prevertical_file.write(self.prevertical)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sharded_pipeline(self):
+        """ Shards are processed and merged in the original order
+        """
+        with NaturalLanguageProcessor('en', shards=3, pipeline='cat',
+                batch_size=100) as lp:
+            lp.create_vertical_file(self.prevertical_path, self.vertical_path)
+        with open(self.vertical_path) as vertical_file:
+            self.assertEqual(self.prevertical, vertical_file.read())
+        self.assertEqual(['wiki.prevert', 'wiki.vert'],
+            sorted(os.listdir(self.directory)))
+
+    def test_failed_shard_is_retried(self):
+        """ Failed shard is processed again
+        """
+        # pipeline fails when it's run for the first time
+        marker_path = os.path.join(self.directory, 'failed')
+        pipeline = 'if [ -e {m} ]; then cat; else touch {m}; false; fi'\
+            .format(m=marker_path)
+        with NaturalLanguageProcessor('en', shards=4, pipeline=pipeline,
+                batch_size=100) as lp:
+            lp.create_vertical_file(self.prevertical_path, self.vertical_path)
+        with open(self.vertical_path) as vertical_file:
+            self.assertEqual(self.prevertical, vertical_file.read())
+
+    def test_failing_pipeline(self):
+        """ Pipeline failing repeatedly results in exception
+        """
+        with NaturalLanguageProcessor('en', shards=2, pipeline='false') as lp:
+            with self.assertRaises(LanguageProcessorException):
+                lp.create_vertical_file(self.prevertical_path,
+                    self.vertical_path)
+
+    def test_filters(self):
+        """ Input and output filters are applied on the streams
+        """
+        def upper(lines):
+            for line in lines:
+                yield line.upper()
+
+        def drop_paragraphs(lines):
+            for line in lines:
+                if not line.startswith((b'<P>', b'</P>')):
+                    yield line
+
+        expected = ''.join(line.upper() + '\n'
+            for line in self.prevertical.splitlines()
+            if not line.startswith(('<p>', '</p>')))
+        for shards in (1, 3):
+            with NaturalLanguageProcessor('en', shards=shards,
+                    pipeline='cat', batch_size=100) as lp:
+                lp.create_vertical_file(self.prevertical_path,
+                    self.vertical_path, input_filter=upper,
+                    output_filter=drop_paragraphs)
+            with open(self.vertical_path) as vertical_file:
+                self.assertEqual(expected, vertical_file.read())
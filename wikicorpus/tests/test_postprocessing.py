@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for postprocessing.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.postprocessing import parse_filters, select_filters, chain
+from wikicorpus.postprocessing import remove_desamb_hacks, use_number_lemmas
+from wikicorpus.verticaldocument import VerticalDocument
+from registry.tagsets import get_tagset_by_name
+from functools import partial
+import os
+import unittest
+import yaml
+
+# absolute path to this file
+BASE = os.path.abspath(os.path.dirname(__file__))
+
+
+class TestPostprocessing(unittest.TestCase):
+
+    """Class of unit tests for postprocessing.py module"""
+
+    # test samples file
+    POSTPROCESSING_SAMPLES_FILE = os.path.join(BASE,
+        'test-samples-vertical-postprocessing.yaml')
+
+    def test_filters_of_samples(self):
+        """ Chained filters give the same vertical as VerticalDocument
+        """
+        with open(self.POSTPROCESSING_SAMPLES_FILE) as samples_file:
+            samples = yaml.load(samples_file)
+        for sample in samples:
+            tagset = get_tagset_by_name(sample['tagset'])
+            lines = sample['vertical'].encode('utf-8').splitlines(True)
+            filters = [remove_desamb_hacks,
+                partial(use_number_lemmas, tagset=tagset)]
+            self.assertEqual(sample['result'].encode('utf-8'),
+                b''.join(chain(lines, filters)), sample['label'])
+            self.assertEqual(str(VerticalDocument(lines, tagset)),
+                b''.join(chain(lines, filters)), sample['label'])
+
+    def test_select_filters(self):
+        """ Filters are selected in the order of the chain
+        """
+        self.assertEqual(['term-tags', 'number-lemmas', 'stats'],
+            select_filters(['stats', 'number-lemmas', 'term-tags'], 'en'))
+        # filters of other languages are skipped
+        self.assertEqual(['number-lemmas', 'stats'],
+            select_filters(['stats', 'number-lemmas', 'term-tags'], 'cs'))
+        # terms inference removes desamb hacks and uses number lemmas itself
+        self.assertEqual(['terms'],
+            select_filters(['desamb-hacks', 'number-lemmas', 'terms'], 'en'))
+        self.assertEqual(['desamb-hacks'],
+            select_filters(['desamb-hacks', 'terms'], 'cs'))
+
+    def test_parse_filters(self):
+        """ Filters are given by comma-separated names
+        """
+        self.assertEqual(['term-tags', 'terms'],
+            parse_filters('term-tags, terms'))
+        self.assertEqual([], parse_filters(''))
+        with self.assertRaises(ValueError):
+            parse_filters('term-tags,tags')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for scheduler.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.scheduler import Scheduler, parse_size
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestScheduler(unittest.TestCase):
+
+    """Class of unit tests for scheduler.py module"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'log')
+        self.started = []
+        self.options = {}
+        # durations of stages (in seconds)
+        self.durations = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def command(self, job, stage):
+        """Command of a stage which only records its start and end"""
+        self.started.append((job.language, stage.name))
+        self.options[job.language, stage.name] = stage.options
+        status = 1 if job.language == 'xx' else 0
+        duration = self.durations.get((job.language, stage.name), 0.3)
+        return ['sh', '-c', 'echo start {lang} {stage} >> {log};'
+            ' sleep {duration}; echo end {lang} {stage} >> {log};'
+            ' exit {status}'.format(lang=job.language, stage=stage.name,
+                log=self.log_path, duration=duration, status=status)]
+
+    def read_log(self):
+        with open(self.log_path) as log_file:
+            return [line.split() for line in log_file]
+
+    def test_budget(self):
+        """ Largest jobs start first and stages fit into the budget
+        """
+        scheduler = Scheduler(cores=3, memory=parse_size('100G'),
+            command=self.command, poll_interval=0.05)
+        scheduler.add_job('sk', ['prevertical', 'vertical'], 10 * 2 ** 20)
+        # uses 3 cores for verticalization
+        scheduler.add_job('en', ['prevertical', 'vertical'], 1000 * 2 ** 20)
+        scheduler.add_job('cs', ['prevertical', 'vertical'], 100 * 2 ** 20)
+        self.assertEqual([], scheduler.run())
+        self.assertEqual(('en', 'prevertical'), self.started[0])
+        log = self.read_log()
+        # check used cores at every moment
+        cores = {'sk': 1, 'cs': 3, 'en': 3}
+        used = 0
+        for event, language, stage in log:
+            stage_cores = cores[language] if stage == 'vertical' else 1
+            used += stage_cores if event == 'start' else -stage_cores
+            self.assertTrue(used <= 3)
+        self.assertEqual(12, len(log))
+
+    def test_memory_budget(self):
+        """ Stages which don't fit into memory wait for each other
+        """
+        scheduler = Scheduler(cores=4, memory=parse_size('900M'),
+            command=self.command, poll_interval=0.05)
+        for language in ('sk', 'cs'):
+            scheduler.add_job(language, ['prevertical'], 2 ** 20)
+        scheduler.run()
+        self.assertEqual(['start', 'end', 'start', 'end'],
+            [event for event, _, _ in self.read_log()])
+
+    def test_blocked_job(self):
+        """ Job which doesn't fit isn't postponed by smaller jobs which would
+        finish after it could start
+        """
+        scheduler = Scheduler(cores=2, memory=parse_size('100G'),
+            command=self.command, poll_interval=0.05)
+        scheduler.add_job('en', ['prevertical', 'vertical'], 2000 * 2 ** 20,
+            options={'vertical': ['--shards', '2']})
+        scheduler.add_job('cs', ['prevertical', 'terms-inference'],
+            3000 * 2 ** 20)
+        # estimated to finish after prevertical of cs
+        scheduler.add_job('sk', ['prevertical'], 3500 * 2 ** 20)
+        self.durations['cs', 'prevertical'] = 1.0
+        self.assertEqual([], scheduler.run())
+        self.assertEqual([('en', 'prevertical'), ('cs', 'prevertical'),
+            ('en', 'vertical')], self.started[:3])
+
+    def test_failed_job(self):
+        """ Remaining stages of a failed job are not run
+        """
+        scheduler = Scheduler(cores=2, memory=parse_size('100G'),
+            command=self.command, poll_interval=0.05)
+        scheduler.add_job('xx', ['prevertical', 'vertical'])
+        scheduler.add_job('sk', ['prevertical', 'vertical'])
+        self.assertEqual(['xx'], scheduler.run())
+        stages = [(language, stage) for event, language, stage
+            in self.read_log() if event == 'start']
+        self.assertNotIn(('xx', 'vertical'), stages)
+        self.assertIn(('sk', 'vertical'), stages)
+
+    def test_forwarded_options(self):
+        """ Shards are limited by the budget, overlapped and streamed stages
+        run in one process
+        """
+        scheduler = Scheduler(cores=3, memory=parse_size('100G'),
+            command=self.command, poll_interval=0.05)
+        scheduler.add_job('en', ['download', 'prevertical', 'vertical'],
+            options={'download': ['--soft-download'],
+                'prevertical': ['--prevertical', '--overlap'],
+                'vertical': ['--vertical', '--shards', '2']})
+        scheduler.add_job('cs', ['download', 'prevertical', 'vertical'],
+            options={'download': ['--soft-download'],
+                'prevertical': ['--prevertical'],
+                'vertical': ['--vertical', '--shards', '8', '--stream']})
+        self.assertEqual([], scheduler.run())
+        self.assertEqual(['--soft-download', '--prevertical', '--overlap'],
+            self.options['en', 'prevertical'])
+        self.assertEqual(['--vertical', '--shards', '2'],
+            self.options['en', 'vertical'])
+        self.assertEqual(['--prevertical', '--vertical', '--stream',
+            '--shards', '3'], self.options['cs', 'vertical'])
+        self.assertEqual(set([('en', 'prevertical'), ('en', 'vertical'),
+            ('cs', 'download'), ('cs', 'vertical')]), set(self.started))
+
+    def test_parse_size(self):
+        """ Parsing sizes with units
+        """
+        self.assertEqual(64 * 2 ** 30, parse_size('64G'))
+        self.assertEqual(512 * 2 ** 20, parse_size('512MB'))
+        self.assertEqual(1000, parse_size('1000'))
+        with self.assertRaises(ValueError):
+            parse_size('lots')
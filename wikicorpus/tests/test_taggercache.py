@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for taggercache.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.nlp import NaturalLanguageProcessor
+from wikicorpus.taggercache import TaggerCache, TaggerCacheException
+from wikicorpus import taggercache
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+
+class TestTaggerCache(unittest.TestCase):
+
+    """Class of unit tests for taggercache.py module"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.directory, 'cache.db')
+        self.prevertical_path = os.path.join(self.directory, 'wiki.prevert')
+        self.vertical_path = os.path.join(self.directory, 'wiki.vert')
+        self.input_log_path = os.path.join(self.directory, 'input.log')
+        # 10 distinct paragraphs + 20 identical ones
+        self.prevertical = ''.join(
+            '<doc id="{i}">\n<p heading="1">\nTitle {t}\n</p>\n'
+            '<p>\nSame text.\n</p>\n</doc>\n'.format(i=i, t=i % 10)
+            for i in range(1, 21))
+        with open(self.prevertical_path, 'w') as prevertical_file:
+            prevertical_file.write(self.prevertical)
+        # "tagger" which records its input
+        self.pipeline = 'tee -a {log} | sed "s/^\\([A-Z]\\)/tagged \\1/"'\
+            .format(log=self.input_log_path)
+        self.expected = ''.join('tagged ' + line if line[0].isupper()
+            else line for line in self.prevertical.splitlines(True))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_vertical(self, cache, shards=1):
+        with NaturalLanguageProcessor('en', shards=shards,
+                pipeline=self.pipeline, cache=cache) as lp:
+            lp.create_vertical_file(self.prevertical_path, self.vertical_path)
+        with open(self.vertical_path) as vertical_file:
+            return vertical_file.read()
+
+    def test_only_misses_are_tagged(self):
+        """ Cached paragraphs are not sent to the pipeline again
+        """
+        with TaggerCache(self.cache_path) as cache:
+            self.assertEqual(self.expected, self.create_vertical(cache))
+            self.assertEqual((29, 11), (cache.hits, cache.misses))
+            self.assertEqual(11, len(cache))
+        os.remove(self.input_log_path)
+        for shards in (1, 3):
+            with TaggerCache(self.cache_path) as cache:
+                self.assertEqual(self.expected,
+                    self.create_vertical(cache, shards))
+                self.assertEqual(1.0, cache.hit_rate())
+        with open(self.input_log_path) as input_log:
+            self.assertNotIn('text', input_log.read())
+
+    def test_pipeline_is_part_of_key(self):
+        """ Paragraphs tagged by another pipeline are not reused
+        """
+        with TaggerCache(self.cache_path) as cache:
+            self.create_vertical(cache)
+            self.pipeline = 'cat'
+            self.assertEqual(self.prevertical, self.create_vertical(cache))
+            self.assertEqual(22, len(cache))
+
+    def test_eviction(self):
+        """ Least recently used paragraphs are evicted over maximal size
+        """
+        with TaggerCache(self.cache_path, max_size=30) as cache:
+            self.create_vertical(cache)
+        with TaggerCache(self.cache_path) as cache:
+            self.assertTrue(0 < len(cache) < 11)
+            # the most recently used paragraph is kept
+            self.assertTrue(cache.contains(cache.get_key(self.pipeline,
+                b'Same text.\n')))
+
+    def test_eviction_while_tagging(self):
+        """ Paragraphs marked as cached are output even if they are evicted
+        (by another process) before the output filter gets to them
+        """
+        with TaggerCache(self.cache_path) as cache:
+            self.create_vertical(cache)
+        with TaggerCache(self.cache_path) as cache:
+            lines = self.prevertical.splitlines(True)
+            marked = list(cache.input_filter(self.pipeline, lines))
+            self.assertEqual(40, sum(line.startswith(b'<cached ')
+                for line in marked))
+            with TaggerCache(self.cache_path, max_size=1):
+                pass
+            self.assertEqual(0, len(cache))
+            output = b''.join(cache.output_filter(
+                b''.join(marked).splitlines(True)))
+            self.assertEqual(self.expected, output)
+
+    def test_shared_database(self):
+        """ Cache waits for transactions of other processes, errors of the
+        database are raised as TaggerCacheException
+        """
+        other = sqlite3.connect(self.cache_path, isolation_level=None,
+            check_same_thread=False)
+        with TaggerCache(self.cache_path) as cache:
+            other.execute('BEGIN IMMEDIATE')
+            timer = threading.Timer(0.5, other.execute, ('COMMIT',))
+            timer.start()
+            cache.store('a', b'vertical')
+            cache.evict()
+            timer.join()
+            self.assertTrue(cache.contains('a'))
+            other.execute('BEGIN IMMEDIATE')
+            busy_timeout = taggercache.BUSY_TIMEOUT
+            taggercache.BUSY_TIMEOUT = 0.1
+            try:
+                with self.assertRaises(TaggerCacheException):
+                    with TaggerCache(self.cache_path) as locked_cache:
+                        locked_cache.store('b', b'vertical')
+            finally:
+                taggercache.BUSY_TIMEOUT = busy_timeout
+                other.execute('COMMIT')
+        other.close()
+        with self.assertRaises(TaggerCacheException):
+            TaggerCache(self.directory)
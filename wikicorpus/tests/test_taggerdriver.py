@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for taggerdriver.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.taggerdriver import TaggerDriver, TaggerDriverException
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TestTaggerDriver(unittest.TestCase):
+
+    """Class of unit tests for taggerdriver.py module"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.lines = [line.encode('utf-8') for i in range(1, 201)
+            for line in ('<doc id="{i}">\n'.format(i=i), 'Text {i}.\n'.format(
+                i=i), '</doc>\n')]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_order_of_batches(self):
+        """ Outputs of batches processed at once are kept in order
+        """
+        # later batches are processed faster than the earlier ones
+        pipeline = 'sleep 0.0$((RANDOM % 5)); tr a-z A-Z'
+        driver = TaggerDriver(pipeline, processes=4, batch_size=200)
+        output = list(driver.process(iter(self.lines)))
+        self.assertEqual([line.upper() for line in self.lines], output)
+        statistics = driver.get_statistics()
+        # all processes were used
+        self.assertEqual(4, len(statistics))
+        self.assertTrue(all(s.batches > 0 and s.throughput() > 0
+            for s in statistics))
+
+    def test_timeout(self):
+        """ Hung pipeline process is killed and its batch processed again
+        """
+        marker_path = os.path.join(self.directory, 'hung')
+        # (mkdir is atomic, so only one process hangs)
+        pipeline = 'if mkdir {m} 2>/dev/null; then sleep 60; else cat; fi'\
+            .format(m=marker_path)
+        driver = TaggerDriver(pipeline, processes=2, batch_size=1000,
+            timeout=1)
+        started = time.time()
+        output = list(driver.process(iter(self.lines)))
+        self.assertEqual(self.lines, output)
+        self.assertLess(time.time() - started, 30)
+        self.assertEqual(1, sum(s.restarts for s in driver.get_statistics()))
+
+    def test_failing_pipeline(self):
+        """ Batch failing in all attempts results in exception
+        """
+        driver = TaggerDriver('false', processes=2, batch_size=1000)
+        with self.assertRaises(TaggerDriverException):
+            list(driver.process(iter(self.lines)))
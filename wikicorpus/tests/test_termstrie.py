@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for termstrie.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.termstrie import TermsTrie, LemmaTable, MappedTermsTrie
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestTermsTrie(unittest.TestCase):
+
+    """Class of unit tests for termstrie.py module"""
+
+    def setUp(self):
+        self.lemmas = LemmaTable()
+        self.trie = TermsTrie(self.lemmas)
+        self.trie.add('Blue_square', ['blue', 'square'])
+        self.trie.add('Blue_triangle', ['blue', 'triangle'])
+        self.trie.add('White', ['white'])
+        self.trie.add('White_cube', ['white', 'cube'])
+
+    def test_get(self):
+        """ Terms are found by their canonical forms
+        """
+        self.assertEqual('Blue_triangle', self.trie.get(['blue', 'triangle']))
+        self.assertEqual('White', self.trie.get(['white']))
+        self.assertIsNone(self.trie.get(['blue']))
+        self.assertIsNone(self.trie.get(['blue', 'cube']))
+        self.assertIsNone(self.trie.get(['red']))
+        # root, 2 nodes of the first level and 3 nodes of the second one
+        self.assertEqual(6, len(self.trie))
+        # lemmata are interned
+        self.assertEqual(5, len(self.lemmas))
+
+    def test_lemma_tables(self):
+        """ Tries have their own lemma tables unless a table is shared
+        """
+        trie = TermsTrie()
+        trie.add('Red', ['red'])
+        self.assertEqual('Red', trie.get(['red']))
+        self.assertIsNone(self.trie.get(['red']))
+        self.assertEqual(5, len(self.lemmas))
+        TermsTrie(self.lemmas).add('Red', ['red'])
+        self.assertEqual(6, len(self.lemmas))
+
+    def test_multistep_search(self):
+        """ Search can continue lemma by lemma
+        """
+        self.assertTrue(self.trie.search_start('white'))
+        self.assertEqual('White', self.trie.search_result())
+        self.assertTrue(self.trie.search_continue('cube'))
+        self.assertEqual('White_cube', self.trie.search_result())
+        self.assertFalse(self.trie.search_continue('cube'))
+        self.assertIsNone(self.trie.search_result())
+
+    def test_terms_added_after_search(self):
+        """ Trie is rebuilt after new terms are added
+        """
+        self.assertIsNone(self.trie.get(['red']))
+        self.trie.add('Red', ['red'])
+        self.assertEqual('Red', self.trie.get(['red']))
+        self.assertEqual('White_cube', self.trie.get(['white', 'cube']))
+
+    def test_longest_matches(self):
+        """ Automaton finds leftmost-longest occurences of terms
+        """
+        self.trie.add('Cube_blue', ['cube', 'blue'])
+        lemmata = 'a white cube blue square white blue blue triangle'.split()
+        self.assertEqual([
+                (1, 2, 'White_cube'),
+                (3, 2, 'Blue_square'),
+                (5, 1, 'White'),
+                (7, 2, 'Blue_triangle'),
+            ], self.trie.get_automaton().longest_matches(lemmata))
+
+    def test_mapped_trie(self):
+        """ Trie saved to a file is mapped with the same terms and automaton
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'terms')
+            self.trie.add('Bílý_čtverec', ['bílý', 'čtverec'])
+            self.trie.save(path)
+            lemmata = 'bílý čtverec white cube blue blue triangle'.split()
+            with MappedTermsTrie(path) as mapped:
+                self.assertEqual(len(self.trie), len(mapped))
+                self.assertEqual('Blue_triangle',
+                    mapped.get(['blue', 'triangle']))
+                self.assertEqual('Bílý_čtverec',
+                    mapped.get(['bílý', 'čtverec']))
+                self.assertIsNone(mapped.get(['blue']))
+                self.assertIsNone(mapped.get(['red']))
+                self.assertEqual(
+                    self.trie.get_automaton().longest_matches(lemmata),
+                    mapped.get_automaton().longest_matches(lemmata))
+                with self.assertRaises(TypeError):
+                    mapped.add('Red', ['red'])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for tokenizer.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.nlp import NaturalLanguageProcessor
+from wikicorpus.tokenizer import tokenize
+import os
+import unittest
+import yaml
+
+# absolute path to this file
+BASE = os.path.abspath(os.path.dirname(__file__))
+
+
+class TestTokenizer(unittest.TestCase):
+
+    """Class of unit tests for tokenizer.py module"""
+
+    # test samples file
+    SAMPLES_FILE = os.path.join(BASE, 'test-samples-tokenizer.yaml')
+
+    # show diffs of arbitrary length
+    maxDiff = None
+    # show both my message and standard message
+    longMessage = True
+
+    def test_samples(self):
+        """ Tests for tokenization using a file of samples
+        """
+        with open(TestTokenizer.SAMPLES_FILE) as samples_file:
+            samples = yaml.load(samples_file)
+        for sample in samples:
+            prevertical = unicode(sample['prevertical']).encode('utf-8')
+            vertical = b''.join(tokenize(prevertical.splitlines(True)))
+            self.assertEqual(unicode(sample['vertical']),
+                vertical.decode('utf-8'), sample['label'])
+
+    def test_only_newlines_end_lines(self):
+        """ Other line boundaries (U+2028, form feed) are whitespace, they
+        don't separate structural tags
+        """
+        prevertical = '<p>\nJedna{0}<p>veta.\n</p>\n'
+        for separator in ('\u2028', '\x0c', '\x1e'):
+            self.assertEqual(b''.join(tokenize(
+                    [prevertical.format(' ').encode('utf-8')])),
+                b''.join(tokenize(
+                    [prevertical.format(separator).encode('utf-8')])),
+                repr(separator))
+
+    def test_builtin_pipelines(self):
+        """ Built-in tokenizer is used instead of unitok for "other" languages
+        """
+        with NaturalLanguageProcessor('sk') as lp:
+            self.assertTrue(lp.uses_builtin_tokenizer())
+            vertical = b''.join(lp.process_stream(
+                [b'<doc>\n<p>\nJedna veta.\n</p>\n</doc>\n']))
+        self.assertEqual(b'<doc>\n<p>\n<s>\nJedna\nveta\n<g/>\n.\n</s>\n'
+            b'</p>\n</doc>\n', vertical)
+        with NaturalLanguageProcessor('en') as lp:
+            self.assertFalse(lp.uses_builtin_tokenizer())
@@ -5,7 +5,9 @@
 """
 
 from __future__ import unicode_literals
-from wikicorpus.verticaldocument import VerticalDocument
+from wikicorpus.termstrie import TermsTrie
+from wikicorpus.verticaldocument import VerticalDocument, collect_terms
+from wikicorpus.verticaldocument import infere_terms_in_stream
 from registry.tagsets import get_tagset_by_name
 import os
 import unittest
@@ -47,6 +49,30 @@ class TestVerticalDocument(unittest.TestCase):
         """
         self._test_samples(TestVerticalDocument.INFERENCE_SAMPLES_FILE, True)
 
+    def test_corpus_terms_inference(self):
+        """ Terms linked in other documents are inferred with uncertainty 2
+        """
+        other_document = ('<doc id="1">\n<term wuri="Blue_sky">\nblue\tJJ\tblue'
+            '\nskies\tNNS\tsky\n</term>\n<term wuri="Sky">\nsky\tNN\tsky'
+            '\n</term>\n</doc>\n')
+        terms = list(collect_terms(other_document.encode('utf-8')
+            .splitlines(True)))
+        self.assertEqual([('Blue_sky', ['blue', 'sky']), ('Sky', ['sky'])],
+            terms)
+        dictionary = TermsTrie()
+        for name, canonical_form in terms:
+            dictionary.add(name, canonical_form)
+        document = VerticalDocument('\n'.join(['<doc id="2">', '<p>',
+            '<term wuri="Heaven">', 'sky\tNN\tsky', '</term>',
+            'blue\tJJ\tblue', 'sky\tNN\tsky', 'sky\tNN\tsky', '</p>',
+            '</doc>']), terms_inference=True, terms_dictionary=dictionary)
+        self.assertEqual('\n'.join(['<doc id="2">', '<p>',
+            '<term wuri="Heaven">', 'sky\tNN\tsky', '</term>',
+            '<term wuri="Blue_sky" uncertainty="2">', 'blue\tJJ\tblue',
+            'sky\tNN\tsky', '</term>',
+            '<term wuri="Heaven" uncertainty="1">', 'sky\tNN\tsky', '</term>',
+            '</p>', '</doc>']), unicode(document).strip())
+
     def _test_samples(self, samples_file_name, terms_inference=True):
         """ Helper method for testing VerticalDocument using a file of samples
         """
@@ -66,3 +92,20 @@ class TestVerticalDocument(unittest.TestCase):
                 terms_inference=terms_inference)
             self.assertEqual(result, unicode(vertical_document).strip(),
                 msg='failed test case "{label}"'.format(label=label))
+            # encoded lines give the same encoded document
+            encoded_document = VerticalDocument(
+                vert_text.encode('utf-8').split(b'\n'),
+                tagset=tagset,
+                terms_inference=terms_inference)
+            self.assertEqual(result.encode('utf-8'),
+                str(encoded_document).strip(),
+                msg='failed test case "{label}" (encoded)'.format(
+                    label=label))
+            if terms_inference:
+                # streaming inference gives the same document
+                encoded_lines = vert_text.encode('utf-8').splitlines(True)
+                self.assertEqual(result.encode('utf-8'), b''.join(
+                        infere_terms_in_stream(lambda: encoded_lines,
+                            tagset)).strip(),
+                    msg='failed test case "{label}" (streaming)'.format(
+                        label=label))
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for verticalreader.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.verticalreader import read_vertical, classify, get_term_wuri
+from wikicorpus.verticalreader import TOKEN, DOC_START, DOC_END, P_START
+from wikicorpus.verticalreader import P_END, S_START, S_END, TERM_START
+from wikicorpus.verticalreader import TERM_END, AREA_START, AREA_END, GLUE
+from wikicorpus.verticalreader import DESAMB_HACK, TAG
+import unittest
+
+
+class TestVerticalReader(unittest.TestCase):
+
+    """Class of unit tests for verticalreader.py module"""
+
+    def test_read_vertical(self):
+        """ Encoded lines are classified to events
+        """
+        lines = [b'<doc id="1" title="\xc4\x8cesko">\n', b'<p heading="1">\n',
+            b'<s>\n', b'<term wuri="Czech_Republic">\n',
+            b'\xc4\x8cesko\tNP\t\xc4\x8cesko\n', b'</term>\n', b'<g/>\n',
+            b'.\tSENT\t.\n', b'</s>\n', b'</p>\n', b'<math>\n', b'</math>\n',
+            b'<s hack="1">\n', b'<table>\n', b'</doc>\n']
+        self.assertEqual([DOC_START, P_START, S_START, TERM_START, TOKEN,
+                TERM_END, GLUE, TOKEN, S_END, P_END, AREA_START, AREA_END,
+                DESAMB_HACK, TAG, DOC_END],
+            [event for event, _ in read_vertical(lines)])
+        self.assertEqual(lines, [line for _, line in read_vertical(lines)])
+
+    def test_unicode_lines(self):
+        """ Unicode lines (without line ends) are classified the same way
+        """
+        self.assertEqual(TERM_START,
+            classify('<term wuri="Česko" uncertainty="1">'))
+        self.assertEqual(AREA_END, classify('</code>'))
+        self.assertEqual(TOKEN, classify('Česko\tNP\tČesko'))
+        self.assertEqual(TAG, classify('<'))
+
+    def test_term_wuri(self):
+        """ Wuri is read from term start tags
+        """
+        self.assertEqual('Czech_Republic',
+            get_term_wuri('<term wuri="Czech_Republic" uncertainty="1">'))
+        self.assertIsNone(get_term_wuri('<p>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
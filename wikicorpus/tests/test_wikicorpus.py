@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for wikicorpus.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.wikicorpus import WikiCorpus, CorpusException, infere_terms
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestWikiCorpus(unittest.TestCase):
+
+    """Class of unit tests for wikicorpus.py module"""
+
+    def test_infere_terms_skips_lines_outside_documents(self):
+        """ Batch of documents can start by a blank line
+        """
+        document = (b'<doc id="1">\n<term wuri="Sky">\nsky\tNN\tsky\n'
+            b'</term>\n<g/>\nsky\tNN\tsky\n</doc>\n')
+        lines = (b'\n' + document + b'\n' + document).splitlines(True)
+        output = list(infere_terms(lines))
+        self.assertEqual(2, len(output))
+        self.assertEqual(output[0], output[1])
+        self.assertEqual(2, output[0].count(b'<term '))
+
+    def test_errors_of_dump_processing_are_propagated(self):
+        """ Only missing dump is reported by _open_dump, errors of its
+        processing are propagated
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            corpus = WikiCorpus('en')
+            dump_path = os.path.join(directory, 'dump.xml')
+            corpus.get_dump_path = lambda: dump_path
+            corpus.is_dump_compressed = lambda: False
+            with self.assertRaises(CorpusException):
+                with corpus._open_dump():
+                    pass
+            open(dump_path, 'w').close()
+            with self.assertRaises(IOError):
+                with corpus._open_dump():
+                    raise IOError(errno.ENOSPC, 'No space left on device')
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
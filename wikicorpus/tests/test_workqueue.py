@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# encoding=utf-8
+
+"""Unit tests for workqueue.py module
+"""
+
+from __future__ import unicode_literals
+from wikicorpus.workqueue import WorkQueue, Worker, WorkQueueException
+from wikicorpus.workqueue import write_atomically
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+def upper_handler(queue, crash_marker=None):
+    """Handler of tasks uppercasing the input (crashing on the first task
+    if crash marker is given)
+    """
+    def handle(task):
+        if crash_marker:
+            try:
+                # (mkdir is atomic, so only one worker crashes)
+                os.mkdir(crash_marker)
+                os._exit(1)
+            except OSError:
+                pass
+        if task.get('fail'):
+            raise ValueError('invalid task')
+        with open(queue.get_data_path(task['input'])) as input_file:
+            write_atomically(queue.get_data_path(task['output']),
+                (line.upper() for line in input_file))
+    return handle
+
+
+def run_worker(path, lease, crash_marker=None):
+    queue = WorkQueue(path, lease=lease)
+    Worker(queue, upper_handler(queue, crash_marker),
+        poll_interval=0.1).run(idle_timeout=2)
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    """Class of unit tests for workqueue.py module"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'queue')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def publish(self, queue, count, **options):
+        task_ids = []
+        for i in range(count):
+            task_id = 'task-{i:03d}'.format(i=i)
+            with open(queue.get_data_path(task_id + '.in'), 'w') as data:
+                data.write(b'shard {i}\n'.format(i=i))
+            queue.publish(task_id, dict(options, input=task_id + '.in',
+                output=task_id + '.out'))
+            task_ids.append(task_id)
+        return task_ids
+
+    def read_output(self, queue, task_id):
+        with open(queue.get_data_path(task_id + '.out')) as output_file:
+            return output_file.read()
+
+    def test_claim_and_complete(self):
+        """ Each task is claimed only once, in order of identifiers
+        """
+        queue = WorkQueue(self.path)
+        task_ids = self.publish(queue, 2)
+        first = queue.claim()
+        second = queue.claim()
+        self.assertEqual(task_ids, [first['id'], second['id']])
+        self.assertIsNone(queue.claim())
+        self.assertEqual('claimed', queue.get_state(first['id']))
+        queue.complete(first['id'])
+        self.assertEqual('done', queue.get_state(first['id']))
+
+    def test_requeue_expired_lease(self):
+        """ Task of a silent worker is requeued after its lease expires
+        """
+        queue = WorkQueue(self.path, lease=60)
+        task_id = self.publish(queue, 1)[0]
+        queue.claim()
+        self.assertEqual(0, queue.requeue_expired())
+        # lease renewed long ago
+        claimed_path = os.path.join(self.path, 'claimed', task_id + '.json')
+        os.utime(claimed_path, (time.time() - 120, time.time() - 120))
+        self.assertEqual(1, queue.requeue_expired())
+        self.assertEqual('pending', queue.get_state(task_id))
+        self.assertEqual(task_id, queue.claim()['id'])
+
+    def test_failed_task(self):
+        """ Failure of a task is reported to the publisher
+        """
+        queue = WorkQueue(self.path)
+        task_ids = self.publish(queue, 1, fail=True)
+        worker = Worker(queue, upper_handler(queue), poll_interval=0.1)
+        with self.assertRaises(WorkQueueException):
+            queue.wait(task_ids, worker, poll_interval=0.1)
+
+    def test_task_being_moved(self):
+        """ Task which isn't found while it's being moved is not missing,
+        unless it isn't found repeatedly
+        """
+        queue = WorkQueue(self.path)
+        task_ids = self.publish(queue, 1)
+        states = [None, None, 'done']
+        queue.get_state = lambda task_id: states.pop(0)
+        queue.wait(task_ids, poll_interval=0.01)
+        self.assertEqual([], states)
+        del queue.get_state
+        with self.assertRaises(WorkQueueException):
+            queue.wait(['unknown-task'], poll_interval=0.01)
+
+    def test_local_worker_processes(self):
+        """ Tasks are processed by several worker processes, task of a crashed
+        worker is processed by another one
+        """
+        queue = WorkQueue(self.path, lease=1)
+        task_ids = self.publish(queue, 20)
+        crash_marker = os.path.join(self.directory, 'crashed')
+        workers = [multiprocessing.Process(target=run_worker,
+            args=(self.path, 1, crash_marker)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        queue.wait(task_ids, poll_interval=0.1)
+        for worker in workers:
+            worker.join()
+        self.assertTrue(os.path.exists(crash_marker))
+        self.assertEqual([1, 0, 0, 0], sorted(
+            (worker.exitcode for worker in workers), reverse=True))
+        for i, task_id in enumerate(task_ids):
+            self.assertEqual(b'SHARD {i}\n'.format(i=i),
+                self.read_output(queue, task_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
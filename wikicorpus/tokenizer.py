@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module with built-in tokenizer and sentence splitter.
+
+It creates the same vertical format as "unitok_and_sentences -l other":
+one token per line, <g/> between tokens which are not separated by
+whitespace and sentences enclosed in <s> and </s>. SGML tags of prevertical
+are kept on separate lines. Sentences never cross structures (documents,
+paragraphs).
+
+It runs in-process (no subprocess is needed), so it can be used in any worker
+and on machines without external tokenizers.
+"""
+
+from __future__ import unicode_literals
+import re
+
+# tokens and tags in a line of prevertical
+TOKEN_PATTERN = re.compile(r'''
+    (?P<tag><[^<>]+>)
+    | (?P<number>\d+(?:[.,:]\d+)*)
+    | (?P<word>\w+(?:['’-]\w+)*)
+    | (?P<end>[.!?…]+)
+    | (?P<punctuation>([^\w\s<])\6*)
+    | (?P<other><)
+    ''', re.UNICODE | re.VERBOSE)
+
+# whitespace between tokens
+SPACE_PATTERN = re.compile(r'\s', re.UNICODE)
+
+# structures which sentences can't cross
+STRUCTURE_PATTERN = re.compile(r'^</?(doc|p|head|table|list)[\s>]')
+
+# tokens ending a sentence
+SENTENCE_END_PATTERN = re.compile(r'^[.!?…]+$', re.UNICODE)
+
+# tokens which can follow the end of a sentence (still within the sentence)
+CLOSING_PATTERN = re.compile(r'^[)\]}"\'»”’]+$', re.UNICODE)
+
+GLUE = '<g/>'
+SENTENCE_START = '<s>'
+SENTENCE_END = '</s>'
+
+
+def tokenize(lines):
+    """Creates vertical from prevertical
+
+    :lines: iterable of encoded lines of prevertical (or chunks of them)
+    :returns: generator of encoded lines of vertical
+    """
+    tokenizer = Tokenizer()
+    for chunk in lines:
+        # (unicode.splitlines would split on other line boundaries as well,
+        # e.g. U+2028 or form feed)
+        chunk_lines = chunk.split(b'\n')
+        if chunk.endswith(b'\n'):
+            chunk_lines.pop()
+        for line in chunk_lines:
+            line = line.rstrip(b'\r').decode('utf-8')
+            for vertical_line in tokenizer.tokenize_line(line):
+                yield vertical_line.encode('utf-8') + b'\n'
+    for vertical_line in tokenizer.close():
+        yield vertical_line.encode('utf-8') + b'\n'
+
+
+class Tokenizer(object):
+
+    """Stateful tokenizer of prevertical lines (sentences can span lines)"""
+
+    def __init__(self):
+        self._in_sentence = False
+        # previous token ended a sentence (if it's not followed by lowercase)
+        self._sentence_end = False
+        # previous token (or None after whitespace or structure)
+        self._previous = None
+        self._before_previous = None
+
+    def tokenize_line(self, line):
+        """Tokenizes one line of prevertical
+
+        :line: unicode
+        :returns: list of lines of vertical (unicode)
+        """
+        output = []
+        stripped = line.strip()
+        if STRUCTURE_PATTERN.match(stripped):
+            # structural tag (on its own line)
+            output.extend(self.close())
+            output.append(stripped)
+            return output
+        position = 0
+        for match in TOKEN_PATTERN.finditer(line):
+            if SPACE_PATTERN.search(line, position, match.start()):
+                self._previous = None
+            position = match.end()
+            token = match.group()
+            if match.lastgroup == 'tag':
+                if not token.startswith('</'):
+                    # opening tag belongs to the following sentence
+                    if self._sentence_end:
+                        self._end_sentence(output)
+                    if not self._in_sentence:
+                        self._start_sentence(output)
+                output.append(token)
+                continue
+            if self._sentence_end:
+                if CLOSING_PATTERN.match(token):
+                    self._append_token(output, token)
+                    continue
+                self._sentence_end = False
+                if not token[0].islower():
+                    self._end_sentence(output)
+            if not self._in_sentence:
+                self._start_sentence(output)
+            self._append_token(output, token)
+            if SENTENCE_END_PATTERN.match(token) and not self._is_initial():
+                self._sentence_end = True
+        # line break is a whitespace
+        self._previous = None
+        return output
+
+    def close(self):
+        """Ends current sentence (if any)
+
+        :returns: list of lines of vertical (unicode)
+        """
+        output = []
+        self._end_sentence(output)
+        return output
+
+    def _append_token(self, output, token):
+        if self._previous is not None:
+            output.append(GLUE)
+        output.append(token)
+        self._before_previous = self._previous
+        self._previous = token
+
+    def _is_initial(self):
+        """Returns True if the last dot follows an initial (e.g. "J. Smith")
+        """
+        before = self._before_previous
+        return self._previous == '.' and before is not None\
+            and len(before) == 1 and before.isupper()
+
+    def _start_sentence(self, output):
+        output.append(SENTENCE_START)
+        self._in_sentence = True
+        self._previous = None
+
+    def _end_sentence(self, output):
+        if self._in_sentence:
+            output.append(SENTENCE_END)
+        self._in_sentence = False
+        self._sentence_end = False
+        self._previous = None
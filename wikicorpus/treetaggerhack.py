@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module with workaround of TreeTagger bug concerning term tags.
+
+TreeTagger misplaces <term> and </term> tags, so following hack is needed:
+  1) replace each </term> in prevertical by (token) __TERM_END__
+     (see mark_term_ends)
+  2) let TreeTagger create vertical
+  3) move <term> and </term> to correct positions using __TERM_END__ tokens
+     (see correct_terms)
+
+Both steps are generators of lines, so they can be used on streams.
+"""
+
+from __future__ import unicode_literals
+from verticalreader import read_vertical
+from verticalreader import TOKEN, TERM_START, TERM_END, S_START
+
+# token marking the end of a term
+TERM_END_MARK = b'__TERM_END__'
+
+# term end tag (in prevertical and vertical)
+TERM_END_TAG = b'</term>'
+
+
+def mark_term_ends(lines):
+    """Replaces all </term> tags by __TERM_END__ tokens
+
+    :lines: iterable of encoded lines of prevertical
+    :returns: generator of encoded lines
+    """
+    marked_term_end = b' ' + TERM_END_MARK
+    for line in lines:
+        yield line.replace(TERM_END_TAG, marked_term_end)
+
+
+def correct_terms(lines):
+    """Moves term tags in vertical created by TreeTagger to correct positions
+
+    Lines are classified by the vertical reader as bytes (names of tags are
+    ASCII), so they don't have to be decoded.
+
+    :lines: iterable of encoded lines of vertical
+    :returns: generator of encoded lines
+    """
+    term_end_line = TERM_END_TAG + b'\n'
+    last_term_line = None
+    open_term = False
+    for event, line in read_vertical(lines):
+        if event == TERM_START:
+            last_term_line = line
+        elif event == TERM_END:
+            # ignore
+            continue
+        elif event == S_START:
+            yield line
+            if last_term_line:
+                yield last_term_line
+                last_term_line = None
+                open_term = True
+        elif event == TOKEN and open_term\
+                and line.startswith(TERM_END_MARK):
+            yield term_end_line
+            open_term = False
+        elif event != TOKEN:
+            yield line
+        else:
+            if last_term_line:
+                yield last_term_line
+                last_term_line = None
+                open_term = True
+            yield line
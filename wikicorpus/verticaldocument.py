@@ -3,7 +3,12 @@
 
 from __future__ import unicode_literals
 from registry.tagsets import TAGSETS
-from termstrie import TermsTrie
+from collections import deque
+from termstrie import TermsTrie, ROOT
+from verticalreader import classify, read_vertical
+from verticalreader import TOKEN, P_END, TERM_START, TERM_END, DESAMB_HACK
+from verticalreader import UNTOUCHABLE_STARTS, UNTOUCHABLE_ENDS
+from verticalreader import SENTENCE_EVENTS
 import re
 
 # -----------------------------------------------------------------------------
@@ -53,7 +58,17 @@ TERM_TAG = re.compile(r"""
 #        $
 #        """, re.VERBOSE)
 
-UNTOUCHABLE_AREA_TAGS = {'term', 'math', 'code'}
+# columns of tokens of tagsets: (lemma column, tag column, number lemma)
+# (number lemma is replaced by the actual number)
+# (byte strings are used with both encoded and unicode lines)
+TOKEN_COLUMNS = {
+    TAGSETS.DESAMB: (1, 2, b'#num#'),
+    TAGSETS.TREETAGGER: (2, 1, b'@card@'),
+}
+COLUMN_SEPARATOR = b'\t'
+
+# lemma of a token which hasn't been parsed yet
+UNPARSED = object()
 
 
 # -----------------------------------------------------------------------------
@@ -62,63 +77,94 @@ UNTOUCHABLE_AREA_TAGS = {'term', 'math', 'code'}
 
 class Token(object):
 
-    """Token representation"""
+    """Token representation
+
+    Token keeps only its original line, columns are split when they are
+    needed (most tokens are only written back). The lemma is parsed on the
+    first request and cached. The line can be encoded, then only the
+    requested columns are decoded and str() of the token doesn't decode
+    the line at all.
+    """
+
+    __slots__ = ('_line', '_tagset', '_lemmas', '_lemma')
 
-    def __init__(self, line, tagset):
+    def __init__(self, line, tagset, lemmas=None):
         """
-        :line: [unicode] one line (one token) of vertical file
+        :line: [unicode or str] one line (one token) of vertical file
         :tagset: [registry.Tagset] tagset of the vertical
+        :lemmas: [dict] table of interned lemmata (optional, e.g. shared by
+            tokens of one document)
         """
-        parts = line.split('\t')
-        self._word = parts[0]
-        self._lemma = None
-        self._tag = None
+        self._line = line
         self._tagset = tagset
-        if tagset == TAGSETS.DESAMB:
-            # desamb: 2nd column is lemma, 3rd is tag
-            self._lemma = parts[1]
-            self._tag = parts[2]
-            # for numbers, use actual numbers as the lemma
-            if self._lemma.startswith('#num#'):
-                self._lemma = self._word + self._lemma[5:]
-        elif tagset == TAGSETS.TREETAGGER:
-            # treetagger: 2nd column is tag, 3rd is lemma
-            self._tag = parts[1]
-            self._lemma = parts[2]
-            # for numbers, use actual numbers as the lemma
-            if self._lemma.startswith('@card@'):
-                self._lemma = self._word + self._lemma[6:]
+        self._lemmas = lemmas
+        self._lemma = UNPARSED
 
     def get_word(self):
-        return self._word
+        return decode(self._line.split(COLUMN_SEPARATOR, 1)[0])
 
     def get_tag(self, default=None):
-        return self._tag if self._tag is not None else default
+        columns = TOKEN_COLUMNS.get(self._tagset)
+        if columns is None:
+            return default
+        return decode(self._line.split(COLUMN_SEPARATOR)[columns[1]])
 
     def get_lemma(self, word_fallback=True):
         """Returns lemma of the token
 
         :word_fallback: [Bool] if True and lemma is missing, use word instead
         """
+        if self._lemma is UNPARSED:
+            self._lemma = self._parse_lemma()
         if self._lemma is None and word_fallback:
-            return self._word
+            return self.get_word()
         return self._lemma
 
+    def _parse_lemma(self):
+        columns = TOKEN_COLUMNS.get(self._tagset)
+        if columns is None:
+            return None
+        lemma = decode(self._get_lemma_column(
+            self._line.split(COLUMN_SEPARATOR), columns))
+        if self._lemmas is not None:
+            lemma = self._lemmas.setdefault(lemma, lemma)
+        return lemma
+
+    def _get_lemma_column(self, parts, columns):
+        lemma_column, _, number_lemma = columns
+        lemma = parts[lemma_column]
+        # for numbers, use actual numbers as the lemma
+        if lemma.startswith(number_lemma):
+            lemma = parts[0] + lemma[len(number_lemma):]
+        return lemma
+
+    def _format(self):
+        """Returns the token as one line (of the same type as the original)
+        """
+        columns = TOKEN_COLUMNS.get(self._tagset)
+        if columns is None:
+            return self._line.split(COLUMN_SEPARATOR, 1)[0]
+        lemma_column, tag_column, number_lemma = columns
+        # the original line, unless there are additional columns
+        # or a number lemma
+        if self._line.count(COLUMN_SEPARATOR) == 2\
+                and number_lemma not in self._line:
+            return self._line
+        parts = self._line.split(COLUMN_SEPARATOR)
+        formatted = [parts[0], None, None]
+        formatted[lemma_column] = self._get_lemma_column(parts, columns)
+        formatted[tag_column] = parts[tag_column]
+        return COLUMN_SEPARATOR.join(formatted)
+
+    def __str__(self):
+        """Returns encoded representation of the token (as one line)
+        """
+        return encode(self._format())
+
     def __unicode__(self):
         """Returns unicode representation of the token (as one line)
         """
-        if self._tagset == TAGSETS.DESAMB:
-            return '{word}\t{lemma}\t{tag}'.format(
-                word=self.get_word(),
-                lemma=self.get_lemma(),
-                tag=self.get_tag())
-        elif self._tagset == TAGSETS.TREETAGGER:
-            return '{word}\t{tag}\t{lemma}'.format(
-                word=self.get_word(),
-                tag=self.get_tag(),
-                lemma=self.get_lemma())
-        else:
-            return self.get_word()
+        return decode(self._format())
 
 
 # -----------------------------------------------------------------------------
@@ -128,20 +174,20 @@ class Token(object):
 """
 Poznamka o algoritmu k odvozeni vyskytu pojmu:
 
-    Inference vyskytu pojmu je zalozena na longest-matching pomoci trie
-    se slozitost O(n), kde n je delka textu. Prochazime cely vstupni text
-    a v kazdem bode hledame vyskyt pojmu. Protoze trie umoznuje hledani
-    ukoncit, kdyz uz se nejedna o prefix zadneho pojmu, a soucet vsech delek
-    vsech vyskytu pojmu v textu je nejvyse rovna delce celeho textu (pokud
-    by byl slozen ze samych pojmu), je slozitost vypoctu O(n + 2n) = O(n).
+    Inference vyskytu pojmu je zalozena na automatu Aho-Corasick nad
+    posloupnostmi lemmat pojmu dokumentu (viz TermsAutomaton). Text je
+    rozdelen na useky hranicemi odstavcu (</p>), pojmu (<term>) a dalsich
+    nedotknutelnych oblasti (<math>, <code>); SGML znacky uvnitr useku se
+    preskakuji a do delky vyskytu se nepocitaji. Kazdy usek se projde jen
+    jednou a pro kazdou pozici se najde nejdelsi pojem, ktery na ni zacina.
+    Pak se zleva vyberou nejdelsi neprekryvajici se vyskyty (leftmost-longest).
 
-    Alternativa by bylo sestupne hledani v m hashovacich tabulkach pro ruzne
-    delky pojmu s horsi asymptotickou casovou slozitosti O(n * m), kde n je
-    delka textu a m delka nejdelsiho pojmu (v poctu slov).
+    Puvodni hledani v trii z kazde pozice textu melo slozitost O(n * k), kde
+    n je delka textu a k delka nejdelsiho pojmu (v poctu slov). Automat ma
+    slozitost O(n + z), kde z je pocet vsech vyskytu pojmu v textu.
 
-    Urcite ale existuji i efektivnejsi zpusoby, takze muze stat za to vyzkouset
-    neco dalsiho. Asymptotickeho zrychleni oproti O(n) uz vsak samozrejme
-    dosahnout nelze.
+    Dokument v pameti (VerticalDocument) i proud radku dokumentu
+    (infere_terms_in_stream) prochazi stejna trida TermsInference.
 """
 
 
@@ -149,17 +195,24 @@ class VerticalDocument(object):
 
     """Class for in-memory representation of one document in vertical format"""
 
-    def __init__(self, lines, tagset=TAGSETS.TREETAGGER, terms_inference=False):
+    def __init__(self, lines, tagset=TAGSETS.TREETAGGER, terms_inference=False,
+            terms_dictionary=None):
         """
-        :lines: [list<unicode>] OR unicode
+        :lines: [list<unicode>] OR unicode OR [list<str>] OR str
+            (lines can be encoded, then the document is kept encoded and only
+            inspected fields are decoded)
         :tagset: [registry.Tagset]
+        :terms_dictionary: [TermsTrie] terms of the whole corpus (optional,
+            see collect_terms); their occurences are inferred as well, with
+            lower certainty than terms linked in the document itself
         """
         # check :lines: is unicode or list of unicode
-        if isinstance(lines, unicode):
+        if isinstance(lines, basestring):
             # if it's unicode, slit it to list of lines
-            lines = lines.split('\n')
+            lines = lines.split(b'\n')
         elif not isinstance(lines, list):
             raise ValueError(':lines: should be unicode or list of unicodes')
+        self._encoded = bool(lines) and isinstance(lines[0], str)
 
         # building representation of vertical (store lines, tranform tokens to
         # Token objects) and trie of all terms in text
@@ -168,141 +221,345 @@ class VerticalDocument(object):
         assert tagset in [TAGSETS.BASIC, TAGSETS.DESAMB, TAGSETS.TREETAGGER]
         self._tagset = tagset
 
-        self._lines = []
         self._termstrie = TermsTrie()
-        reading_term = False
-        term_canonical_form = None
-        for line in lines:
-            line = line.strip()
-            # skip empty lines
-            if not line:
-                continue
-
-            # if it's sgml tag, leave it as a string,
-            # but if it's a token, use Token class to represent it
-            if is_sgml_tag(line):
-
-                # remove desamb hacks
-                if line.startswith('<s hack'):
-                    # remove last 3 lines: <g/>, ., </s>
-                    del self._lines[-3:]
-                    continue
-
-                # ignore sentence tags, if inside <term> (they are incorrect)
-                if reading_term and re.search(r'^</?s', line):
-                    continue
-
-                self._lines.append(line)
-
-                # try to match a term sgml tag
-                match = TERM_TAG.match(line)
-                if match:
-                    # term reading start
-                    term_wuri = match.group('wuri')
-                    term_canonical_form = []
-                    reading_term = True
-
-                if line == '</term>':
-                    # term reading finished
-                    self._termstrie.add(term_wuri, term_canonical_form)
-                    reading_term = False
-            else:
-                # use Token class to represent tokens
-                token = Token(line, self._tagset)
-                self._lines.append(token)
-                # if reading a term, remember the lemma
-                if reading_term:
-                    term_canonical_form.append(token.get_lemma(True))
+        self._terms_dictionary = terms_dictionary
+        # lemmata interned by tokens of the document
+        self._lines = list(read_document(lines, tagset, self._termstrie,
+            lemmas={}))
 
         # apply terms inference
         if terms_inference:
             self._terms_occurences_inference()
 
     def __str__(self):
-        return unicode(self).encode('utf-8')
+        # NOTE: some lines are Tokens and some are strings
+        return b'\n'.join(map(format_line, self._lines)) + b'\n'
 
     def __unicode__(self):
-        # NOTE: some lines are Tokens and some are strings
-        return '\n'.join(map(unicode, self._lines)) + '\n'
+        return '\n'.join(decode(line) if not isinstance(line, Token)
+            else unicode(line) for line in self._lines) + '\n'
 
     def get(self, index):
         """Returns line (Token or sgml tag in unicode) on given index
         """
         return self._lines[index]
 
-    def _longest_matching_term(self, pos):
-        """Returns longest matching term and its length from given position
+    def _terms_occurences_inference(self):
+        """Infers occurences of terms in the whole document (see
+        TermsInference)
+        """
+        inference = TermsInference(get_automatons(self._termstrie,
+            self._terms_dictionary), encoded=self._encoded)
+        new_lines = []
+        for line in self._lines:
+            new_lines.extend(inference.push(line))
+        new_lines.extend(inference.close())
+        self._lines = new_lines
+
+
+def read_document(lines, tagset, termstrie, lemmas=None):
+    """Reads lines of one document (see VerticalDocument)
+
+    Lines are stripped, empty lines, desamb hacks and sentence tags inside
+    terms are removed, tokens are represented by Tokens and terms linked
+    in the document are added to the trie.
+
+    :lines: iterable of unicode or encoded lines
+    :tagset: [registry.Tagset]
+    :termstrie: [TermsTrie]
+    :lemmas: [dict] table of interned lemmata of tokens (optional)
+    :returns: generator of Tokens and tags
+    """
+    reading_term = False
+    term_canonical_form = None
+    # lines are yielded with a delay of 3 lines, because a desamb hack
+    # removes the last 3 lines before it
+    last_lines = deque()
+    for event, line in read_vertical(line.strip() for line in lines):
+        # skip empty lines
+        if not line:
+            continue
+
+        # if it's sgml tag, leave it as a string,
+        # but if it's a token, use Token class to represent it
+        if event != TOKEN:
+
+            # remove desamb hacks
+            if event == DESAMB_HACK:
+                # remove last 3 lines: <g/>, ., </s>
+                last_lines.clear()
+                continue
+
+            # ignore sentence tags, if inside <term> (they are incorrect)
+            if reading_term and event in SENTENCE_EVENTS:
+                continue
+
+            last_lines.append(line)
+
+            # try to match a term sgml tag
+            match = TERM_TAG.match(line) if event == TERM_START else None
+            if match:
+                # term reading start
+                term_wuri = decode(match.group('wuri'))
+                term_canonical_form = []
+                reading_term = True
+
+            if event == TERM_END and reading_term:
+                # term reading finished
+                termstrie.add(term_wuri, term_canonical_form)
+                reading_term = False
+        else:
+            # use Token class to represent tokens
+            token = Token(line, tagset, lemmas)
+            last_lines.append(token)
+            # if reading a term, remember the lemma
+            if reading_term:
+                term_canonical_form.append(token.get_lemma(True))
+
+        if len(last_lines) > 3:
+            yield last_lines.popleft()
+    for line in last_lines:
+        yield line
+
+
+def get_automatons(termstrie, terms_dictionary=None):
+    """Returns automatons of terms of the document (and of the corpus)
+    """
+    automatons = [termstrie.get_automaton()]
+    if terms_dictionary is not None:
+        automatons.append(terms_dictionary.get_automaton())
+    return automatons
+
+
+# -----------------------------------------------------------------------------
+#  Streaming terms inference
+# -----------------------------------------------------------------------------
+
+class TermsInference(object):
 
-        :returns: (unicode, int) or (None, 0) if no term found
+    """Inference of terms occurences in a stream of lines of one document
+
+    Lines are pushed one by one and they are returned back (with new term
+    tags) as soon as no term can be inferred over them, i.e. only a window
+    of the last lemmata which can still be a part of a term is kept (it's
+    never longer than the longest term). Occurences are the same as if the
+    whole document was searched at once (see the note above VerticalDocument).
+    """
+
+    def __init__(self, automatons, encoded=False):
+        """
+        :automatons: list of TermsAutomaton (terms of the first one win over
+            terms of the same length of the others and they are inferred with
+            uncertainty 1, the others with uncertainty 2)
+        :encoded: Boolean (if True, new tags are encoded)
+        """
+        self._automatons = automatons
+        self._states = [ROOT] * len(automatons)
+        self._term_end = b'</term>' if encoded else '</term>'
+        self._encoded = encoded
+        # lines waiting for decision: (position of token or None, line)
+        self._pending = deque()
+        # positions of tokens in segments which can contain terms
+        self._position = 0
+        # tokens before this position can't be a part of a new occurence
+        self._frontier = 0
+        # occurences starting before this position were selected
+        self._selected = 0
+        self._covered = 0
+        # the longest term found at undecided starts:
+        # start -> (length, term name, uncertainty)
+        self._longest = {}
+        # selected occurences: start -> (term name, uncertainty) and ends
+        self._starts = {}
+        self._ends = set()
+        self._untouchable_area_reading = False
+        self._new_term_reading = False
+
+    def push(self, line):
+        """Adds next line of the document
+
+        :line: Token or tag
+        :returns: list of lines which are decided
         """
-        max_length = 0
-        current_length = 0
-        longest_term = None
-        self._termstrie.search_start()
-        while True:
-            try:
-                line = self.get(pos + current_length)
-                if is_sgml_tag(line):
-                    # break term search if there is a new paragraph or a term
-                    if line == '</p>' or line.startswith('<term '):
-                        break
-                    else:
-                        continue
-                lemma = self.get(pos + current_length).get_lemma()
-                if not self._termstrie.search_continue(lemma):
-                    break
-                found_term = self._termstrie.search_result()
-                if found_term:
-                    longest_term = found_term
-                    # TODO: prepsat jasneji
-                    max_length = current_length + 1
-            finally:
-                # go to next line, even if "continue" was called
-                current_length += 1
-                # check the end of the vertical
-                if pos + current_length >= len(self._lines):
-                    break
-        return (longest_term, max_length)
+        if isinstance(line, Token):
+            if self._untouchable_area_reading:
+                self._pending.append((None, line))
+            else:
+                self._pending.append((self._position, line))
+                self._read_lemma(line.get_lemma())
+        else:
+            # break term search if there is a new paragraph or a term
+            # (or other untouchable area)
+            event = classify(line)
+            if event in UNTOUCHABLE_STARTS:
+                self._untouchable_area_reading = True
+                self._break_segment()
+            elif event in UNTOUCHABLE_ENDS:
+                self._untouchable_area_reading = False
+                self._break_segment()
+            elif event == P_END:
+                self._break_segment()
+            self._pending.append((None, line))
+        return self._release()
+
+    def close(self):
+        """Ends the document
+
+        :returns: list of remaining lines
+        """
+        self._break_segment()
+        return self._release()
+
+    def _read_lemma(self, lemma):
+        position = self._position
+        frontier = position + 1
+        for i, automaton in enumerate(self._automatons):
+            state = automaton.next_state(self._states[i], lemma)
+            self._states[i] = state
+            for length, term in automaton.ending_terms(state):
+                start = position - length + 1
+                if length > self._longest.get(start, (0,))[0]:
+                    self._longest[start] = (length, term, 1 if i == 0 else 2)
+            frontier = min(frontier, position + 1 - automaton.get_depth(state))
+        self._position += 1
+        self._select(frontier)
+
+    def _break_segment(self):
+        """Terms can't continue over the current position
+        """
+        self._states = [ROOT] * len(self._automatons)
+        self._select(self._position)
 
-    def _terms_occurences_inference(self):
-        new_lines = []
-        new_term_rest_length = 0
-        new_term_reading = False
-        untouchable_area_reading = False
-        for i, line in enumerate(self._lines):
-            if is_sgml_tag(line):
+    def _select(self, frontier):
+        """Selects leftmost-longest occurences starting before frontier
+        """
+        while self._selected < frontier:
+            start = self._selected
+            match = self._longest.pop(start, None)
+            if match is not None and start >= self._covered:
+                length, term, uncertainty = match
+                self._starts[start] = (term, uncertainty)
+                self._ends.add(start + length - 1)
+                self._covered = start + length
+            self._selected += 1
+        self._frontier = frontier
+
+    def _release(self):
+        """Returns decided lines (with tags of new terms)
+        """
+        released = []
+        while self._pending:
+            position, line = self._pending[0]
+            if position is not None and position >= self._frontier:
+                break
+            self._pending.popleft()
+            if position is None:
                 # ignore sentence tags, if inside <term>
                 # (becaucse they are probably incorrect)
-                if not new_term_reading or not re.search(r'^</?s', line):
-                    new_lines.append(line)
-                # inside old terms, swith of new term search
-                for tag in UNTOUCHABLE_AREA_TAGS:
-                    if line.startswith('<%s' % tag):
-                        untouchable_area_reading = True
-                    elif line == ('</%s>' % tag):
-                        untouchable_area_reading = False
-            else:
-                if not new_term_reading and not untouchable_area_reading:
-                    term_wuri, term_length = self._longest_matching_term(i)
-                    if term_length > 0:
-                        term_tag = '<term wuri="{name}" uncertainty="1">'\
-                            .format(name=term_wuri)
-                        new_lines.append(term_tag)
-                        new_term_reading = True
-                        new_term_rest_length = term_length
-                new_lines.append(unicode(line))
-                if new_term_reading:
-                    new_term_rest_length -= 1
-                    if new_term_rest_length == 0:
-                        new_lines.append('</term>')
-                        new_term_reading = False
-        self._lines = new_lines
+                if isinstance(line, Token) or not self._new_term_reading\
+                        or classify(line) not in SENTENCE_EVENTS:
+                    released.append(line)
+                continue
+            if position in self._starts:
+                term, uncertainty = self._starts.pop(position)
+                term_tag = '<term wuri="{name}" uncertainty="{uncertainty}">'\
+                    .format(name=term, uncertainty=uncertainty)
+                released.append(encode(term_tag) if self._encoded
+                    else term_tag)
+                self._new_term_reading = True
+            released.append(line)
+            if position in self._ends:
+                self._ends.remove(position)
+                released.append(self._term_end)
+                self._new_term_reading = False
+        return released
+
+
+def infere_terms_in_stream(read_lines, tagset=TAGSETS.TREETAGGER,
+        terms_dictionary=None):
+    """Infers terms occurences in a document without keeping it in memory
+
+    The document is read twice, terms linked in the document are collected
+    by the first pass. The output is the same as of VerticalDocument with
+    terms inference, but only lines which are not decided yet are kept
+    (see TermsInference).
+
+    :read_lines: function returning iterable of lines of the document
+    :tagset: [registry.Tagset]
+    :terms_dictionary: [TermsTrie] terms of the whole corpus (optional)
+    :returns: generator of encoded lines (with line ends)
+    """
+    termstrie = TermsTrie()
+    for _ in read_document(read_lines(), tagset, termstrie):
+        pass
+    inference = TermsInference(get_automatons(termstrie, terms_dictionary),
+        encoded=True)
+    for line in read_document(read_lines(), tagset, TermsTrie()):
+        for output_line in inference.push(line):
+            yield format_line(output_line) + b'\n'
+    for output_line in inference.close():
+        yield format_line(output_line) + b'\n'
+
+
+# -----------------------------------------------------------------------------
+#  Terms of the whole corpus
+# -----------------------------------------------------------------------------
+
+def collect_terms(lines, tagset=TAGSETS.TREETAGGER):
+    """Collects canonical forms of all linked terms in vertical
+
+    Canonical forms are read the same way as by VerticalDocument (lemmata of
+    tokens inside <term> tags), so the terms can be stored to a terms
+    dictionary of the whole corpus (see TermsTrie.save).
+
+    :lines: iterable of encoded lines of vertical
+    :tagset: [registry.Tagset]
+    :returns: generator of (term name, list of lemmata)
+    """
+    term_wuri = None
+    term_canonical_form = None
+    for event, line in read_vertical(lines):
+        if term_wuri is None:
+            if event == TERM_START:
+                match = TERM_TAG.match(line.strip())
+                if match:
+                    term_wuri = decode(match.group('wuri'))
+                    term_canonical_form = []
+        elif event == TERM_END:
+            if term_canonical_form:
+                yield term_wuri, term_canonical_form
+            term_wuri = None
+        elif event == TOKEN:
+            line = line.strip()
+            if line:
+                term_canonical_form.append(
+                    Token(line, tagset).get_lemma(True))
 
 
 # -----------------------------------------------------------------------------
 #  Vertical File Line - utilities
 # -----------------------------------------------------------------------------
 
+def decode(line):
+    """Returns unicode line (encoded lines are decoded)
+    """
+    return line.decode('utf-8') if isinstance(line, str) else line
+
+
+def encode(line):
+    """Returns encoded line (unicode lines are encoded)
+    """
+    return line.encode('utf-8') if isinstance(line, unicode) else line
+
+
+def format_line(line):
+    """Returns encoded line of vertical
+
+    :line: unicode || str || Token
+    """
+    return str(line) if isinstance(line, Token) else encode(line)
+
+
 def is_sgml_tag(line):
     """Returns True if line is s sgml tag, False otherwise
 
@@ -312,4 +569,4 @@ def is_sgml_tag(line):
     # nevadi, ze to ma obcas False Positives)
     if isinstance(line, Token):
         return False
-    return line.startswith('<')
+    return classify(line) != TOKEN
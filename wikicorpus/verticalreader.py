@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for reading lines of vertical.
+
+Each line is classified once to an event (start or end of a document,
+paragraph, sentence, term or other untouchable area, glue, desamb hack, other
+tag or token), so all consumers of vertical (correction of TreeTagger output,
+terms inference) share one lexer instead of testing prefixes of lines on
+their own. Only ASCII names of tags are inspected, so lines can be either
+unicode or encoded (and they don't have to be decoded).
+
+    for event, line in read_vertical(lines):
+        if event == TERM_START:
+            wuri = get_term_wuri(line)
+"""
+
+from __future__ import unicode_literals
+import re
+
+# -----------------------------------------------------------------------------
+#  events
+# -----------------------------------------------------------------------------
+
+TOKEN = 0
+DOC_START = 1
+DOC_END = 2
+P_START = 3
+P_END = 4
+S_START = 5
+S_END = 6
+TERM_START = 7
+TERM_END = 8
+# other untouchable areas (see AREA_TAGS)
+AREA_START = 9
+AREA_END = 10
+GLUE = 11
+DESAMB_HACK = 12
+# any other tag
+TAG = 13
+
+# names of tags of untouchable areas other than terms
+AREA_TAGS = ('math', 'code')
+
+# events of start and end tags by tag names
+START_EVENTS = {'doc': DOC_START, 'p': P_START, 's': S_START,
+    'term': TERM_START, 'g': GLUE}
+END_EVENTS = {'doc': DOC_END, 'p': P_END, 's': S_END, 'term': TERM_END}
+for _name in AREA_TAGS:
+    START_EVENTS[_name] = AREA_START
+    END_EVENTS[_name] = AREA_END
+
+# events of the most common whole lines (with and without line end)
+LINE_EVENTS = {}
+for _name, _event in START_EVENTS.items():
+    LINE_EVENTS['<{name}>'.format(name=_name)] = _event
+for _name, _event in END_EVENTS.items():
+    LINE_EVENTS['</{name}>'.format(name=_name)] = _event
+LINE_EVENTS['<g/>'] = GLUE
+for _line, _event in LINE_EVENTS.items():
+    # (encoded lines are equal to ASCII unicode lines, so they are found too)
+    LINE_EVENTS[_line + '\n'] = _event
+
+# events which start and end untouchable areas (terms can't be inferred in)
+UNTOUCHABLE_STARTS = frozenset([TERM_START, AREA_START])
+UNTOUCHABLE_ENDS = frozenset([TERM_END, AREA_END])
+# events of sentence tags
+SENTENCE_EVENTS = frozenset([S_START, S_END])
+
+# -----------------------------------------------------------------------------
+#  regular expressions
+# -----------------------------------------------------------------------------
+
+# regex matching name of a tag (and slash of an end tag)
+TAG_NAME = re.compile(r'<(/?)([A-Za-z]+)')
+
+# regex matching wuri of a term tag
+TERM_WURI = re.compile(r'<term\s+wuri="(?P<wuri>.*?)"')
+
+# beginnings of lines (encoded, so encoded lines aren't decoded by comparison)
+TAG_START = b'<'
+DESAMB_HACK_START = b'<s hack'
+
+
+# -----------------------------------------------------------------------------
+#  reading
+# -----------------------------------------------------------------------------
+
+def classify(line):
+    """Returns event of one line of vertical
+
+    :line: unicode or str (with or without line end)
+    """
+    event = LINE_EVENTS.get(line)
+    if event is not None:
+        return event
+    if not line.startswith(TAG_START):
+        return TOKEN
+    if line.startswith(DESAMB_HACK_START):
+        return DESAMB_HACK
+    match = TAG_NAME.match(line)
+    if match is None:
+        return TAG
+    slash, name = match.groups()
+    return (END_EVENTS if slash else START_EVENTS).get(name, TAG)
+
+
+def read_vertical(lines):
+    """Classifies lines of vertical
+
+    :lines: iterable of lines (unicode or str)
+    :returns: generator of (event, line)
+    """
+    line_events = LINE_EVENTS
+    for line in lines:
+        event = line_events.get(line)
+        yield (event if event is not None else classify(line)), line
+
+
+def get_term_wuri(line):
+    """Returns wuri of term start tag (or None)
+    """
+    match = TERM_WURI.match(line)
+    return match.group('wuri') if match else None
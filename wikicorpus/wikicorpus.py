@@ -3,25 +3,53 @@
 
 from __future__ import unicode_literals
 from configuration.configuration import Configuration, ConfigurationException
+from collections import deque
 from contextlib import contextmanager
 from environment import environment
 from lxml import etree
+from categoryindex import CategoryIndex
+from documentindex import DocumentIndex, DocumentIndexWriter, KEYS
+from documentindex import build_document_index, get_index_path
+from dumpstore import DumpStore, DumpStoreException
+from instrumentation import measured_stage
 from nlp import NaturalLanguageProcessor, LanguageProcessorException
+from postprocessing import TERM_TAGS, DESAMB_HACKS, NUMBER_LEMMAS, TERMS, STATS
+from postprocessing import select_filters, chain
+from postprocessing import remove_desamb_hacks, use_number_lemmas
 from registry.tagsets import TAGSETS
 from registry.registry import store_registry
 from registry.registry import RegistryException
 from setup import project_path
+from taggercache import TaggerCache, TaggerCacheException
+from taggerdriver import DOCUMENT_END
 from subprocess import Popen, call
 from utils.downloader import download_large_file, get_online_file
+from utils.downloader import get_online_file_size
+from utils.bz2_utils import BZ2StreamReader
+from utils.downloader import download_stream, DownloadException
+from utils.downloader import set_bandwidth_limit
 #from utils.progressbar import ProgressBar
 from utils.system_utils import makedirs
+from utils.wiki_utils import term2wuri
 from utils.xml_utils import qualified_name
-from verticaldocument import VerticalDocument
+from termstrie import TermsTrie, MappedTermsTrie
+from treetaggerhack import mark_term_ends, correct_terms
+from verticaldocument import VerticalDocument, collect_terms
+from verticaldocument import infere_terms_in_stream
+from verticalreader import read_vertical, DOC_START, DOC_END
 from wikiextractor import parse_wikimarkup
+from wikiextractor import extract_categories, normalize_category
+from workqueue import WorkQueue, Worker, WorkQueueException
+from workqueue import IDLE_TIMEOUT, worker_name, write_atomically
 import errno
 import bz2
+import json
 import logging
+import multiprocessing
 import os
+import signal
+import sys
+import tempfile
 
 
 class WikiCorpus(object):
@@ -45,6 +73,24 @@ class WikiCorpus(object):
     # Wikipedia namespace number label for articles
     ARTICLE_NS = '0'
 
+    # Wikipedia namespace number label for categories
+    CATEGORY_NS = '14'
+
+    # canonical (English) name of the category namespace
+    CATEGORY_NS_NAME = 'Category'
+
+    # name of the state file of shared bandwidth limit (in verticals directory)
+    BANDWIDTH_STATE_NAME = '.bandwidth'
+
+    # approximate size of one task of distributed stages (in bytes)
+    SHARD_SIZE = 64 * 2 ** 20
+
+    # approximate size of one batch of terms inference processes (in bytes)
+    TERMS_BATCH_SIZE = 2 ** 20
+
+    # maximal number of documents of one subcorpus of a category definition
+    SUBCORPUS_QUERY_SIZE = 10000
+
     def __init__(self, language):
         """Initalization of WikiCorpus instance
 
@@ -56,6 +102,9 @@ class WikiCorpus(object):
         # load configuration
         self._configuration = Configuration(WikiCorpus.CORPUS_CONFIG_PATH)
 
+        # measurement of the running stage (see instrumentation module)
+        self._measurement = None
+
         # vertical info
         #self._tagset = None
         #self._structures = None  # always _BASIC_STRUCTURES
@@ -70,6 +119,37 @@ class WikiCorpus(object):
         return self._configuration.get('corpus-name').format(
             lang=self.language())
 
+    def get_categories_path(self):
+        """ Returns path to category index
+        """
+        return self._get_corpus_file_path('categories')
+
+    def get_category_titles(self, category, depth=0):
+        """Returns titles of all articles in given category
+
+        Category index has to be created during preverticalization.
+
+        :category: unicode (category name without namespace)
+        :depth: int (how deep to descend into subcategories, None = all)
+        """
+        index = self._load_category_index()
+        return self._get_titles(
+            index.documents(normalize_category(category), depth))
+
+    def _get_titles(self, doc_ids):
+        """Returns titles of documents with given ids (in the dump order)
+
+        :doc_ids: iterable of int
+        """
+        doc_ids = set(doc_ids)
+        titles = []
+        with open(self.get_titles_path()) as titles_file:
+            for line in titles_file:
+                doc_id, title = line.decode('utf-8').rstrip('\n').split('\t', 1)
+                if int(doc_id) in doc_ids:
+                    titles.append(title)
+        return titles
+
     def get_dump_path(self):
         """ Returns path to dump
         """
@@ -105,6 +185,22 @@ class WikiCorpus(object):
         else:
             return os.path.getsize(self.get_dump_path())
 
+    def get_dump_size(self):
+        """Returns size of the (compressed) dump in bytes
+
+        If the dump is not downloaded yet, size of the online dump is returned
+        (None if it's unknown).
+        """
+        if os.path.exists(self.get_dump_path()):
+            return os.path.getsize(self.get_dump_path())
+        dump_url = WikiCorpus.DUMP_URL_GENERAL.format(lang=self.language())
+        try:
+            return get_online_file_size(dump_url)
+        except (DownloadException, IOError) as exc:
+            logging.warning('Size of {url} is unknown: {exc}'.format(
+                url=dump_url, exc=exc))
+            return None
+
     def get_namespace(self):
         """Returns namespace of the wiki dump
         """
@@ -155,6 +251,31 @@ class WikiCorpus(object):
     #        self._tagset = get_registry_tagset(self.get_registry_path())
     #    return self._tagset
 
+    def get_titles_path(self):
+        """ Returns path to list of titles of all documents (by ids)
+        """
+        return self._get_corpus_file_path('titles')
+
+    def get_report_path(self):
+        """ Returns path to report of resources used by stages (JSON lines)
+        """
+        return self._get_corpus_file_path('report')
+
+    def get_terms_vertical_path(self):
+        """ Returns path to vertical with inferred terms
+        """
+        return self.get_vertical_path() + '.terms'
+
+    def get_terms_dictionary_path(self):
+        """ Returns path to dictionary of all terms linked in the corpus
+        """
+        return self._get_corpus_file_path('terms-dictionary')
+
+    def get_queue_path(self):
+        """ Returns path to directory of work queue of distributed stages
+        """
+        return self._get_corpus_file_path('queue')
+
     def get_url_prefix(self):
         """Returns url prefix for all articles in the corpus.
         """
@@ -222,12 +343,16 @@ class WikiCorpus(object):
     #  corpus building methods
     # ------------------------------------------------------------------------
 
-    def download_dump(self, force=False):
+    @measured_stage('download_dump', outputs=('get_dump_path',))
+    def download_dump(self, force=False, connections=None):
         """ Downloads dump of Wikipedia
 
         :force: Boolean
             if True, it downloads dump even if some dump with
             target name is already downloaded
+        :connections: int [optional]
+            number of concurrent connections (segments) for downloading,
+            if not set, it's taken from environment configuration
         """
         # select dump path
         dump_path = self.get_dump_path()
@@ -235,99 +360,338 @@ class WikiCorpus(object):
             logging.info('Dump {name} already exists.'.format(name=dump_path))
             return
 
-        # select dump url
-        dump_url = WikiCorpus.DUMP_URL_GENERAL.format(lang=self.language())
+        # select dump url and find MD5 checksum
+        dump_url, md5sum = self._find_dump_url()
 
-        logging.info('Started downloading {l}-wiki dump from {url}'
-            .format(l=self.language(), url=dump_url))
+        if connections is None:
+            connections = environment.download_connections()
 
-        # find MD5 checksum
-        md5_url = WikiCorpus.MD5_URL_GENERAL.format(lang=self.language())
-        md5sums = get_online_file(md5_url, lines=True)
-        for file_md5, file_name in map(lambda x: x.split(), md5sums):
-            if file_name.endswith(WikiCorpus.DUMP_ORIGINAL_NAME):
-                md5sum = file_md5
-                break
-        else:
-            logging.warning('no matching MD5 checksum for the dump found')
-            md5sum = None
+        def download(path):
+            logging.info('Started downloading {l}-wiki dump from {url}'
+                .format(l=self.language(), url=dump_url))
+            self._set_bandwidth_limit()
+            download_large_file(dump_url, path, md5sum=md5sum,
+                connections=connections)
 
-        # downloading
-        download_large_file(dump_url, dump_path, md5sum=md5sum)
+        # the same dump version might be already in shared dump store
+        # (otherwise it's downloaded directly into the store)
+        store = self._get_dump_store() if md5sum else None
+        try:
+            if store is None:
+                download(dump_path)
+            elif store.fetch(md5sum, dump_path, download, force=force):
+                store.evict(keep=[md5sum])
+            else:
+                logging.info('Dump {name} linked from dump store.'.format(
+                    name=dump_path))
+                return
+        except DownloadException as exc:
+            raise CorpusException('Downloading failed: ' + exc.message)
 
         logging.info('Downloading of {lang}-wiki dump finished'.format(
             lang=self.language(),
             path=dump_path))
 
-    def create_prevertical(self):
+    @measured_stage('create_prevertical', inputs=('get_dump_path',),
+        outputs=('get_prevertical_path',))
+    def create_prevertical(self, category_index=False, distributed=False):
         """ Parses dump (outer XML, inner Wiki Markup) and creates prevertical
+
+        :category_index: Boolean
+            if True, category memberships of all articles (and categories)
+            are recorded to category index during the same pass
+        :distributed: Boolean
+            if True, Wiki Markup of pages is parsed by workers of the work
+            queue (see run_worker), dump is still read by this process
+        """
+        logging.info('Preverticalization of {name} started...'.format(
+            name=self.get_corpus_name()))
+
+        with self._open_dump() as dump_file:
+            if distributed:
+                pages = (json.dumps(page) + b'\n' for page
+                    in self._iterate_pages(dump_file, category_index))
+                self._distribute('prevertical', pages,
+                    self.get_prevertical_path(), document_end=b'\n',
+                    count_tokens=False)
+            else:
+                self._preverticalize(dump_file, category_index)
+
+        logging.info('Prevertical of {name} created at: {path}'.format(
+            name=self.get_corpus_name(), path=self.get_prevertical_path()))
+
+    @measured_stage('download_and_create_prevertical',
+        outputs=('get_dump_path', 'get_prevertical_path'))
+    def download_and_create_prevertical(self, force=False,
+            category_index=False):
+        """ Downloads dump and creates prevertical at the same time
+
+        Downloaded data are stored to dump file and decompressed and parsed
+        meanwhile. If the download fails or the MD5 checksum is wrong, created
+        prevertical is removed. If the dump is already downloaded (and
+        :force: is False), only the prevertical is created.
+
+        :force: Boolean
+            if True, it downloads dump even if some dump with
+            target name is already downloaded
+        :category_index: Boolean
+            if True, category index is created as well
+        """
+        dump_path = self.get_dump_path()
+        if os.path.exists(dump_path) and not force:
+            logging.info('Dump {name} already exists.'.format(name=dump_path))
+            self.create_prevertical(category_index)
+            return
+
+        dump_url, md5sum = self._find_dump_url()
+        store = self._get_dump_store() if md5sum else None
+        if store and store.contains(md5sum) and not force:
+            store.link(md5sum, dump_path)
+            logging.info('Dump {name} linked from dump store.'.format(
+                name=dump_path))
+            self.create_prevertical(category_index)
+            return
+
+        logging.info('Started downloading and preverticalization of {l}-wiki'
+            ' dump from {url}'.format(l=self.language(), url=dump_url))
+        self._set_bandwidth_limit()
+        try:
+            with download_stream(dump_url, dump_path, md5sum) as stream:
+                self._preverticalize(BZ2StreamReader(stream), category_index)
+        except (DownloadException, etree.XMLSyntaxError, IOError) as exc:
+            # outputs created from invalid dump are invalid as well
+            prevertical_path = self.get_prevertical_path()
+            for path in (prevertical_path, get_index_path(prevertical_path),
+                    self.get_titles_path(), self.get_categories_path()):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise CorpusException('Downloading and preverticalization failed: '
+                + unicode(exc))
+        if store:
+            try:
+                # (checksum was verified by the download)
+                store.add(md5sum, dump_path, verified=True, replace=force)
+            except DumpStoreException as exc:
+                raise CorpusException('Adding dump to dump store failed: '
+                    + exc.message)
+            store.evict(keep=[md5sum])
+
+        logging.info('Prevertical of {name} created at: {path}'.format(
+            name=self.get_corpus_name(), path=self.get_prevertical_path()))
+
+    def _preverticalize(self, dump_file, category_index=False):
+        """ Parses dump from given file object and creates prevertical
+
+        :dump_file: file-like object with (uncompressed) dump
+        :category_index: Boolean (if True, category index is created as well)
         """
         prevertical_path = self.get_prevertical_path()
-        namespace = self.get_namespace()
+        with self._indexing(prevertical_path) as index,\
+                open(prevertical_path, 'w') as prevertical_file:
+            for parsed_doc in index(self._count(self._parse_dump(dump_file,
+                    category_index), tokens=False)):
+                prevertical_file.write(parsed_doc)
 
-        # create qualified names (= names with namespaces) for tags we need
-        TEXT_TAG = qualified_name('text', namespace)
-        TITLE_TAG = qualified_name('title', namespace)
-        REDIRECT_TAG = qualified_name('redirect', namespace)
-        NS_TAG = qualified_name('ns', namespace)
+    def _parse_dump(self, dump_file, category_index=False):
+        """ Parses dump from given file object
 
-        logging.info('Preverticalization of {name} started...'.format(
-            name=self.get_corpus_name()))
+        :dump_file: file-like object with (uncompressed) dump
+        :category_index: Boolean (if True, category index is created as well)
 
-        # iterate through xml and build a sample file
-        with open(prevertical_path, 'w') as prevertical_file:
-            with self._open_dump() as dump_file:
-                context = etree.iterparse(dump_file, events=('end',))
-                #progressbar = ProgressBar(self.get_dump_length())
-                last_title = None
-                id_number = 0
-                # skip first page in full (copressed) dump since it's Main Page
-                skip = True if self.is_dump_compressed() else False
-
-                # iterate through end-events
-                for event, elem in context:
-                    if elem.tag == REDIRECT_TAG:
-                        # ignore redirect pages
-                        skip = True
-                    elif elem.tag == NS_TAG:
-                        # ignore nonarticle pages (such as "Help:" etc.)
-                        if elem.text != WikiCorpus.ARTICLE_NS:
-                            skip = True
-                    elif elem.tag == TITLE_TAG:
-                        # remember the title
-                        last_title = elem.text
-                    elif elem.tag == TEXT_TAG:
-                        if skip:
-                            skip = False
-                            continue
-                        if not elem.text or not last_title:
-                            continue
-                        # new id
-                        id_number += 1
-                        parsed_doc = parse_wikimarkup(id_number, last_title,
-                            self.get_url_prefix(), elem.text) + '\n'
-                        prevertical_file.write(parsed_doc.encode('utf-8'))
-                        # approximate work done by positin in dump file
-                        #progressbar.update(dump_file.tell())
-
-                    # cleanup
-                    elem.clear()
-                    #while elem.getprevious() is not None:
-                    #    del elem.getparent()[0]
-                    for ancestor in elem.xpath('ancestor-or-self::*'):
-                        while ancestor.getprevious() is not None:
-                            del ancestor.getparent()[0]
-                del context
+        :returns: generator of parsed documents (encoded prevertical)
+        """
+        for id_number, title, text in self._iterate_pages(dump_file,
+                category_index):
+            yield self._parse_page(id_number, title, text)
+
+    def _parse_page(self, id_number, title, text):
+        """ Parses Wiki Markup of one page
+
+        :returns: str (encoded document of prevertical)
+        """
+        parsed_doc = parse_wikimarkup(id_number, title,
+            self.get_url_prefix(), text) + '\n'
+        return parsed_doc.encode('utf-8')
+
+    def _iterate_pages(self, dump_file, category_index=False):
+        """ Iterates through article pages of dump from given file object
+
+        :dump_file: file-like object with (uncompressed) dump
+        :category_index: Boolean (if True, category index is created as well)
+
+        :returns: generator of (id, title, text in Wiki Markup)
+        """
+        with self._writing_titles(category_index) as titles_file:
+            for page in self._iterate_dump_pages(dump_file, titles_file):
+                yield page
+
+    def _iterate_dump_pages(self, dump_file, titles_file=None):
+        """ Iterates through article pages (see _iterate_pages)
+
+        :titles_file: file object [optional]
+            if given, category index is created and titles of documents are
+            written to the file
+        """
+        category_index = titles_file is not None
+        if category_index:
+            # category namespace names are read from dump siteinfo
+            category_namespaces = [WikiCorpus.CATEGORY_NS_NAME]
+            categories = CategoryIndex()
+
+        # iterate through xml and yield parsed documents
+        # namespace is found out from the first start-ns event
+        context = etree.iterparse(dump_file, events=('start-ns', 'end'))
+        namespace = None
+        #progressbar = ProgressBar(self.get_dump_length())
+        last_title = None
+        last_ns = None
+        id_number = 0
+        # skip first page in full (copressed) dump since it's Main Page
+        skip = True if self.is_dump_compressed() else False
+
+        # iterate through end-events
+        for event, elem in context:
+            if event == 'start-ns':
+                prefix, uri = elem
+                if not prefix and namespace is None:
+                    namespace = uri
+                    # create qualified names (= names with namespaces)
+                    # for tags we need
+                    TEXT_TAG = qualified_name('text', namespace)
+                    TITLE_TAG = qualified_name('title', namespace)
+                    REDIRECT_TAG = qualified_name('redirect', namespace)
+                    NS_TAG = qualified_name('ns', namespace)
+                    NAMESPACE_TAG = qualified_name('namespace', namespace)
+                continue
+            if elem.tag == REDIRECT_TAG:
+                # ignore redirect pages
+                skip = True
+            elif elem.tag == NS_TAG:
+                last_ns = elem.text
+                # ignore nonarticle pages (such as "Help:" etc.)
+                if elem.text != WikiCorpus.ARTICLE_NS:
+                    skip = True
+            elif elem.tag == TITLE_TAG:
+                # remember the title
+                last_title = elem.text
+            elif elem.tag == TEXT_TAG:
+                if category_index and elem.text and last_title\
+                        and last_ns == WikiCorpus.CATEGORY_NS:
+                    # category page -> record its parent categories
+                    categories.add_subcategory(
+                        normalize_category(last_title.split(':', 1)[-1]),
+                        extract_categories(elem.text,
+                            category_namespaces))
+                if skip:
+                    skip = False
+                    continue
+                if not elem.text or not last_title:
+                    continue
+                # new id
+                id_number += 1
+                if category_index:
+                    categories.add_document(id_number,
+                        extract_categories(elem.text,
+                            category_namespaces))
+                    titles_file.write('{id}\t{title}\n'.format(
+                        id=id_number, title=last_title)
+                        .encode('utf-8'))
+                yield id_number, last_title, elem.text
+                # approximate work done by positin in dump file
+                #progressbar.update(dump_file.tell())
+            elif elem.tag == NAMESPACE_TAG and category_index:
+                # localized name of category namespace (in siteinfo)
+                if elem.get('key') == WikiCorpus.CATEGORY_NS\
+                        and elem.text\
+                        and elem.text not in category_namespaces:
+                    category_namespaces.append(elem.text)
+
+            # cleanup
+            elem.clear()
+            #while elem.getprevious() is not None:
+            #    del elem.getparent()[0]
+            for ancestor in elem.xpath('ancestor-or-self::*'):
+                while ancestor.getprevious() is not None:
+                    del ancestor.getparent()[0]
+        del context
         #progressbar.finish()
 
-        logging.info('Prevertical of {name} created at: {path}'.format(
-            name=self.get_corpus_name(), path=prevertical_path))
+        if category_index:
+            categories.save(self.get_categories_path())
+            logging.info('Category index of {name} ({n} categories) created'
+                ' at: {path}'.format(name=self.get_corpus_name(),
+                    n=len(categories), path=self.get_categories_path()))
+
+    def create_category_subcorpus(self, category, depth=0):
+        """Resolves category into list of titles and subcorpus definition
+
+        Uses category index created during preverticalization, so the dump
+        doesn't have to be scanned again. List of titles (usable for creating
+        sample) and subcorpus definition (for mksubc) are stored next to the
+        vertical. Large categories are defined as several subcorpora (see
+        SUBCORPUS_QUERY_SIZE).
 
-    def create_vertical(self):
+        :category: unicode (category name without namespace)
+        :depth: int (how deep to descend into subcategories, None = all)
+        """
+        category = normalize_category(category)
+        doc_ids = self._load_category_index().documents(category, depth)
+        # files are named after the corpus and the category
+        name = term2wuri(category)
+        base_path = os.path.join(self.get_uncompiled_corpus_path(),
+            '{corpus}.{name}'.format(corpus=self.get_corpus_name(), name=name))
+
+        # titles
+        titles = self._get_titles(doc_ids)
+        titles_path = '{base}.{ext}'.format(base=base_path,
+            ext=self._configuration.get('extensions', 'titles'))
+        with open(titles_path, 'w') as titles_file:
+            for title in titles:
+                titles_file.write((title + '\n').encode('utf-8'))
+
+        # subcorpus definition (split into subcorpora of at most
+        # SUBCORPUS_QUERY_SIZE documents, so queries stay small for mksubc)
+        definition_path = '{base}.{ext}'.format(base=base_path,
+            ext=self._configuration.get('extensions', 'subcorpus-definition'))
+        doc_ids = sorted(doc_ids)
+        size = WikiCorpus.SUBCORPUS_QUERY_SIZE
+        parts = [doc_ids[start:start + size]
+            for start in range(0, len(doc_ids), size)]
+        with open(definition_path, 'w') as definition_file:
+            for i, part in enumerate(parts):
+                definition = '={name}\ndoc\n{query}\n'.format(
+                    name=name if len(parts) == 1 else '{name}.{i}'.format(
+                        name=name, i=i + 1),
+                    query=' | '.join('id="{id}"'.format(id=doc_id)
+                        for doc_id in part))
+                definition_file.write(definition.encode('utf-8'))
+
+        logging.info('Category {category} resolved to {n} documents: {path}'
+            .format(category=category, n=len(doc_ids), path=definition_path))
+
+    @measured_stage('create_vertical', inputs=('get_prevertical_path',),
+        outputs=('get_vertical_path',))
+    def create_vertical(self, shards=None, distributed=False,
+            postprocessing=None, processes=1):
         """ Creates a vertical file.
 
         Performes tokenization of prevertical and for some languages
-        also morfologization (adding morfological tag and lemma/lempos)
+        also morfologization (adding morfological tag and lemma/lempos).
+        Post-processing filters are chained on the output of the language
+        pipeline, so the vertical is written only once (see postprocessing
+        module).
+
+        :shards: int [optional]
+            number of language pipeline instances running at once
+            (default is set for each language in NaturalLanguageProcessor)
+        :distributed: Boolean
+            if True, shards of prevertical are tagged by workers of the work
+            queue (see run_worker)
+        :postprocessing: list of unicode [optional]
+            names of post-processing filters (default is configured)
+        :processes: int
+            number of processes inferring terms (if terms are inferred by
+            post-processing)
 
         NOTE: Kvuli bugu v TreeTaggeru je potreba udelat nechutny hack:
           1) provest v prevertikalu nasledujici substituci:
@@ -335,11 +699,11 @@ class WikiCorpus(object):
           2) nechat TreeTagger vytvorit vertikal
           3) presunout <term> a </term> na spravne misto s pouzitim vlozene
                 znacky __TERM_END__
+          (kroky 1 a 3 jsou filtry na vstupu a vystupu pipeline, viz modul
+          treetaggerhack)
         """
         prevertical_path = self.get_prevertical_path()
-        marked_prevert_path = prevertical_path + '.tmp'
         vertical_path = self.get_vertical_path()
-        tmp_vertical_path =  vertical_path + '.tmp'
         # check if prevertical file already exists
         if not self.prevertical_file_exists():
             raise CorpusException('Verticalization failed: '
@@ -347,27 +711,25 @@ class WikiCorpus(object):
         logging.info('Verticalization of {name} started...'.format(
             name=self.get_corpus_name()))
         try:
-            if self.language() == 'en':
-                # ----------------------------------------------------------
-                # oprava bugu v treetaggeru, krok 1
-                self._mark_terms(prevertical_path, marked_prevert_path)
-                # ----------------------------------------------------------
-                # create vertical file
-                with NaturalLanguageProcessor(self.language()) as lp:
-                    lp.create_vertical_file(marked_prevert_path, tmp_vertical_path)
-                    #self._tagset = tags
-                    #self._structures = WikiCorpus._BASIC_STRUCTURES
-                # create registry file
-                self.create_registry()
-                # ----------------------------------------------------------
-                # oprava bugu v treetaggeru, krok 3
-                self._correct_terms(tmp_vertical_path, vertical_path)
-                call(('rm', marked_prevert_path, tmp_vertical_path))
-                # ----------------------------------------------------------
+            if distributed:
+                with open(prevertical_path, 'rb') as prevertical_file:
+                    self._distribute('vertical', prevertical_file,
+                        vertical_path, options={'shards': shards,
+                            'postprocessing': postprocessing})
             else:
-                with NaturalLanguageProcessor(self.language()) as lp:
-                    lp.create_vertical_file(prevertical_path, vertical_path)
-                self.create_registry()
+                # oprava bugu v treetaggeru, kroky 1 a 3 (inline na vstupu
+                # a vystupu pipeline)
+                with self._indexing(vertical_path) as index,\
+                        self._vertical_filters(index, postprocessing,
+                            processes) as (input_filter, output_filter),\
+                        self._open_tagger_cache() as cache,\
+                        NaturalLanguageProcessor(self.language(),
+                            shards=shards, cache=cache) as lp:
+                    lp.create_vertical_file(prevertical_path, vertical_path,
+                        input_filter=input_filter,
+                        output_filter=output_filter)
+            # create registry file
+            self.create_registry()
 
             logging.info('Vertical of {name} created at: {path}'.format(
                 name=self.get_corpus_name(),
@@ -376,80 +738,107 @@ class WikiCorpus(object):
             raise CorpusException('Verticalization failed: ' + exc.message)
         except LanguageProcessorException as exc:
             raise CorpusException('Verticalization failed: ' + exc.message)
+        except TaggerCacheException as exc:
+            raise CorpusException('Verticalization failed: ' + exc.message)
 
-    def _mark_terms(self, prevert_path, marked_prevert_path):
-        cmd = "sed 's/<\/term>/ __TERM_END__/g' {fr} > {to}".format(
-            fr=prevert_path, to=marked_prevert_path)
-        task = Popen(cmd, shell=True)
-        task.wait()
-        if task.returncode != 0:
-            raise CorpusException('sed error')
+    @measured_stage('create_vertical_from_dump', inputs=('get_dump_path',),
+        outputs=('get_vertical_path',))
+    def create_vertical_from_dump(self, category_index=False, shards=None,
+            postprocessing=None, processes=1):
+        """ Creates vertical directly from dump in one streaming pass
+
+        Parsing of the dump, the language pipeline and post-processing
+        filters (e.g. the TreeTagger term hack for English) are chained by
+        pipes and generators, so no prevertical or other intermediate file is
+        written. Batches of parsed documents are processed by several
+        pipeline processes at once.
+
+        :category_index: Boolean
+            if True, category index is created as well
+        :shards: int [optional]
+            number of language pipeline processes running at once
+            (default is set for each language in NaturalLanguageProcessor)
+        :postprocessing: list of unicode [optional]
+            names of post-processing filters (default is configured)
+        :processes: int
+            number of processes inferring terms (if terms are inferred by
+            post-processing)
+        """
+        vertical_path = self.get_vertical_path()
+        tmp_vertical_path = vertical_path + '.tmp'
+        logging.info('Streaming verticalization of {name} started...'.format(
+            name=self.get_corpus_name()))
+        try:
+            with self._indexing(vertical_path) as index,\
+                    self._vertical_filters(index, postprocessing,
+                        processes) as (input_filter, output_filter),\
+                    self._open_dump() as dump_file,\
+                    self._open_tagger_cache() as cache:
+                documents = self._parse_dump(dump_file, category_index)
+                with NaturalLanguageProcessor(self.language(),
+                        shards=shards, cache=cache) as lp:
+                    lines = lp.process_stream(documents, input_filter,
+                        output_filter)
+                    with open(tmp_vertical_path, 'w') as vertical_file:
+                        vertical_file.writelines(lines)
+                    os.rename(tmp_vertical_path, vertical_path)
+            self.create_registry()
+        except (ConfigurationException, LanguageProcessorException,
+                TaggerCacheException, etree.XMLSyntaxError, IOError) as exc:
+            raise CorpusException('Streaming verticalization failed: '
+                + unicode(exc))
+        finally:
+            if os.path.exists(tmp_vertical_path):
+                os.remove(tmp_vertical_path)
+
+        logging.info('Vertical of {name} created at: {path}'.format(
+            name=self.get_corpus_name(), path=vertical_path))
+
+    @measured_stage('create_terms_dictionary',
+        inputs=('get_vertical_path',), outputs=('get_terms_dictionary_path',))
+    def create_terms_dictionary(self):
+        """ Stores all terms linked anywhere in vertical to terms dictionary
+
+        The dictionary is an immutable trie (with its automaton) which is
+        memory-mapped by terms inference, so all processes and workers share
+        it read-only (see MappedTermsTrie).
+        """
+        logging.info('Terms dictionary of {name} started'.format(
+            name=self.get_corpus_name()))
+        trie = TermsTrie()
+        with open(self.get_vertical_path()) as vertical_file:
+            for name, canonical_form in collect_terms(vertical_file):
+                trie.add(name, canonical_form)
+        trie.save(self.get_terms_dictionary_path())
+        logging.info('Terms dictionary of {name} created at: {path}'.format(
+            name=self.get_corpus_name(),
+            path=self.get_terms_dictionary_path()))
 
-    def _correct_terms(self, input_path, output_path):
-        last_term_line = None
-        open_term = False
-        #state = 0  # = pocet radku spatne posunuteho termu
-        with open(input_path) as input_file:
-            with open(output_path, 'w') as output_file:
-                for encoded_line in input_file:
-                    line = encoded_line.decode('utf-8')
-
-                    if line.startswith('<term '):
-                        last_term_line = encoded_line
-                    elif line.startswith('</term>'):
-                            # ignore
-                            continue
-                    elif line.startswith('<s>'):
-                        output_file.write(encoded_line)
-                        if last_term_line:
-                            output_file.write(last_term_line)
-                            last_term_line = None
-                            open_term = True
-                    elif line.startswith('__TERM_END__') and open_term:
-                        output_file.write(str('</term>\n'))
-                        open_term = False
-                    elif line.startswith('<'):
-                        output_file.write(encoded_line)
-                    else:
-                        if last_term_line:
-                            output_file.write(last_term_line)
-                            last_term_line = None
-                            open_term = True
-                        output_file.write(encoded_line)
-
-                    # if state == 0 and line.startswith('<term '):
-                    #     last_term_line = encoded_line
-                    #     state += 1
-                    # elif state == 1 and line.startswith('</term>'):
-                    #     state += 1
-                    # elif line.startswith('</term>'):
-                    #     # ignore
-                    #     continue
-                    # elif state == 1 and line.startswith('__TERM_END__'):
-                    #     # empty term
-                    #     state = 0
-                    #     last_term_line = None
-                    # elif state == 2 and line.startswith('<s>'):
-                    #     output_file.write(encoded_line)
-                    #     output_file.write(last_term_line)
-                    #     last_term_line = None
-                    #     state = 0
-                    # elif state == 2 and line.startswith('<'):
-                    #     output_file.write(encoded_line)
-                    # elif line.startswith('__TERM_END__'):
-                    #     output_file.write(str('</term>\n'))
-                    # else:
-                    #     if last_term_line:
-                    #         output_file.write(last_term_line)
-                    #         last_term_line = None
-                    #     state = 0
-                    #     output_file.write(encoded_line)
-
-    def infere_terms_occurences(self):
+    def terms_dictionary_is_current(self):
+        """ Returns True if terms dictionary exists and isn't older than vertical
+        """
+        path = self.get_terms_dictionary_path()
+        return os.path.exists(path) and os.path.getmtime(path)\
+            >= os.path.getmtime(self.get_vertical_path())
+
+    @measured_stage('infere_terms_occurences',
+        inputs=('get_vertical_path',), outputs=('get_terms_vertical_path',))
+    def infere_terms_occurences(self, distributed=False, corpus_terms=False,
+            processes=1):
         """ Labels all occurences of terms in morfolgized vertical
 
         During terms-inference some postprocessing is done as well
         (removing desamb hacks, using actual numbers as lemmata).
+
+        :distributed: Boolean
+            if True, shards of vertical are processed by workers of the work
+            queue (see run_worker)
+        :corpus_terms: Boolean
+            if True, terms linked anywhere in the corpus are inferred as well
+            (terms dictionary is created first if it isn't current)
+        :processes: int
+            number of processes inferring terms in batches of documents
+            (the output is the same as of one process)
         """
         if self.language() != 'en':
             raise CorpusException('terms inference is currently supported only for English')
@@ -460,28 +849,29 @@ class WikiCorpus(object):
             logging.info('Terms occurences inference in {name} started'.format(
                 name=self.get_corpus_name()))
 
-            output_path = vertical_path + '.terms'
-            #call(('cp', vertical_path, original_vertical_path))
+            if corpus_terms and not self.terms_dictionary_is_current():
+                self.create_terms_dictionary()
 
-            # find tagset (throws exception if registry file not found)
-            #tagset = self.get_tagset()
-            tagset = TAGSETS.TREETAGGER
+            output_path = self.get_terms_vertical_path()
+            #call(('cp', vertical_path, original_vertical_path))
 
             with open(vertical_path) as input_file:
-                with open(output_path, 'w') as output_file:
-                    for line in input_file:
-                        line = line.decode('utf-8').strip()
-                        # TODO: ?osetrit prazdne radky a podobne veci??
-                        if line.startswith('<doc'):
-                            document = [line]
-                        else:
-                            document.append(line)
-                        # check if the end of document is reached
-                        if line == '</doc>':
-                            vertical = VerticalDocument(document,
-                                tagset=tagset,
-                                terms_inference=True)
-                            output_file.write(str(vertical))
+                if distributed:
+                    self._distribute('terms-inference', input_file,
+                        output_path, options={'corpus_terms': corpus_terms})
+                elif processes > 1:
+                    with self._terms_pool(processes, corpus_terms) as pool,\
+                            self._indexing(output_path) as index,\
+                            open(output_path, 'w') as output_file:
+                        output_file.writelines(index(self._count(
+                            self._infere_terms_parallel(input_file, pool,
+                                processes))))
+                else:
+                    with self._open_terms_dictionary(corpus_terms) as terms,\
+                            self._indexing(output_path) as index,\
+                            open(output_path, 'w') as output_file:
+                        output_file.writelines(index(self._count(
+                            infere_terms(input_file, terms))))
 
             logging.info('Terms occurences inference in {name} finished.'
                 .format(name=self.get_corpus_name()))
@@ -495,6 +885,51 @@ class WikiCorpus(object):
         except LanguageProcessorException as exc:
             raise CorpusException('Terms inference failed: ' + exc.message)
 
+    def _infere_terms_parallel(self, lines, pool, processes):
+        """ Labels occurences of terms in documents by a pool of processes
+
+        Batches of documents are processed by the pool while the input is
+        being read, results are yielded in the original order. Only a few
+        batches per process are pending at once, so memory is bounded.
+
+        :lines: iterable of encoded lines of vertical
+        :pool: multiprocessing.Pool (see _terms_pool)
+        :processes: int (number of processes of the pool)
+        :returns: generator of encoded batches of documents of vertical
+        """
+        pending = deque()
+        for batch in split_documents(lines, self.TERMS_BATCH_SIZE):
+            pending.append(pool.apply_async(infere_terms_in_batch, (batch,)))
+            if len(pending) > 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    @contextmanager
+    def _terms_pool(self, processes, corpus_terms=False):
+        """ Pool of processes inferring terms with statement manager
+
+        Processes are forked when the pool is created, so it has to be
+        created before any threads are started (e.g. threads feeding the
+        language pipeline), forked threads would hold their locks forever.
+        Yields None if terms are inferred by one process.
+
+        :processes: int
+        :corpus_terms: Boolean (if True, processes map terms dictionary)
+        """
+        if processes <= 1:
+            yield None
+            return
+        dictionary_path = self.get_terms_dictionary_path()\
+            if corpus_terms else None
+        pool = multiprocessing.Pool(processes, _init_terms_process,
+            (dictionary_path,))
+        try:
+            yield pool
+        finally:
+            pool.terminate()
+            pool.join()
+
     def create_registry(self):
         """ Creates registry file
         """
@@ -504,6 +939,8 @@ class WikiCorpus(object):
             vertical_path=self.get_vertical_path(),
             compiled_path=self.get_compiled_corpus_path())
 
+    @measured_stage('compile_corpus', inputs=('get_vertical_path',),
+        outputs=('get_compiled_corpus_path',))
     def compile_corpus(self):
         """ Compiles given corpora
         """
@@ -535,6 +972,52 @@ class WikiCorpus(object):
             '-a', 'word',   # only show words in the result
             '-s', 'p,doc'))  # only show p and doc structures
 
+    def get_document_index(self, path):
+        """ Returns index of documents of prevertical or vertical
+
+        Index is built alongside the file by the stage which creates it, it's
+        built again (by one pass through the file) if it's missing or older
+        than the file. Index can be used in with-statement (see
+        DocumentIndex), e.g. to read byte ranges of whole documents in
+        parallel (see DocumentIndex.shard_ranges and read_byte_range).
+
+        :path: unicode (path to prevertical or vertical)
+        :returns: DocumentIndex
+        """
+        if not os.path.exists(path):
+            raise CorpusException('Missing file: ' + path)
+        index_path = get_index_path(path)
+        if not os.path.exists(index_path)\
+                or os.path.getmtime(index_path) < os.path.getmtime(path):
+            logging.info('Indexing documents of {path}...'.format(path=path))
+            build_document_index(path, index_path)
+        return DocumentIndex(index_path)
+
+    def print_document(self, key, value, path=None):
+        """ Prints one document of prevertical or vertical (found by index)
+
+        :key: unicode
+            'n' (position of the document in the file, from 0) or one of
+            attributes 'id', 'url' and 'title'
+        :value: unicode
+        :path: unicode [optional] (default is the vertical)
+        """
+        path = path or self.get_vertical_path()
+        with self.get_document_index(path) as index,\
+                open(path, 'rb') as input_file:
+            if key == 'n':
+                number = int(value) if value.isdigit() else -1
+                if number >= len(index):
+                    number = -1
+            elif key in KEYS:
+                number = index.find(key, value)
+            else:
+                raise CorpusException('Unknown key of documents: ' + key)
+            if number is None or number < 0:
+                raise CorpusException('No document with {key}={value} in'
+                    ' {path}'.format(key=key, value=value, path=path))
+            sys.stdout.write(index.read_document(input_file, number))
+
     def print_info(self):
         """ Returns corpus summary
         """
@@ -567,10 +1050,172 @@ class WikiCorpus(object):
         else:
             print 'no'
 
+    # ------------------------------------------------------------------------
+    #  distributed processing
+    # ------------------------------------------------------------------------
+
+    def run_worker(self, idle_timeout=IDLE_TIMEOUT):
+        """ Processes tasks of the work queue of this corpus
+
+        Any number of workers can run at once on any node which shares
+        the directory of the corpus. Worker stops when no task appears
+        for :idle_timeout: seconds.
+        """
+        logging.info('Worker {name} of {corpus} started.'.format(
+            name=worker_name(), corpus=self.get_corpus_name()))
+        Worker(self._get_work_queue(), self.process_task).run(idle_timeout)
+
+    def process_task(self, task):
+        """ Processes one task (shard of a distributed stage)
+
+        :task: dict (published by _distribute)
+        """
+        queue = self._get_work_queue()
+        input_path = queue.get_data_path(task['input'])
+        output_path = queue.get_data_path(task['output'])
+        # documents of tasks processed by the publisher itself are counted
+        # when the outputs are merged
+        measurement, self._measurement = self._measurement, None
+        try:
+            self._process_task_files(task, input_path, output_path)
+        finally:
+            self._measurement = measurement
+
+    def _process_task_files(self, task, input_path, output_path):
+        with open(input_path) as input_file:
+            if task['stage'] == 'prevertical':
+                pages = (json.loads(line) for line in input_file)
+                write_atomically(output_path, (self._parse_page(*page)
+                    for page in pages))
+            elif task['stage'] == 'vertical':
+                with self._vertical_filters(
+                        filters=task.get('postprocessing'))\
+                        as (input_filter, output_filter),\
+                        self._open_tagger_cache() as cache,\
+                        NaturalLanguageProcessor(self.language(),
+                            shards=task.get('shards'), cache=cache) as lp:
+                    write_atomically(output_path, lp.process_stream(
+                        input_file, input_filter, output_filter))
+            elif task['stage'] == 'terms-inference':
+                with self._open_terms_dictionary(task.get('corpus_terms'))\
+                        as terms:
+                    write_atomically(output_path,
+                        infere_terms(input_file, terms))
+            else:
+                raise CorpusException('Unknown stage of task: {stage}'
+                    .format(stage=task['stage']))
+
+    def _distribute(self, stage, lines, output_path,
+            document_end=DOCUMENT_END, options=None, count_tokens=True):
+        """ Processes lines by workers of the work queue
+
+        Lines are split on document boundaries into shards, each shard is
+        published as a task as soon as it's written. This process works
+        on the tasks as well, while it waits for other workers. Outputs
+        of the tasks are merged to the output file in the original order.
+
+        :stage: unicode (name of the stage, see process_task)
+        :lines: iterable of encoded lines
+        :output_path: unicode
+        :document_end: str (shards end by lines ending by it)
+        :options: dict [optional] (additional items of tasks)
+        :count_tokens: Boolean (if False, only documents of output are counted)
+        """
+        queue = self._get_work_queue()
+        task_ids = []
+
+        def publish(shard):
+            task_id = '{stage}-{index:06d}'.format(stage=stage,
+                index=len(task_ids))
+            # remove remains of an interrupted run
+            queue.remove(task_id)
+            write_atomically(queue.get_data_path(task_id + '.in'), shard)
+            queue.publish(task_id, dict(options or {}, stage=stage,
+                input=task_id + '.in', output=task_id + '.out'))
+            task_ids.append(task_id)
+
+        def merge_outputs():
+            for task_id in task_ids:
+                with open(queue.get_data_path(task_id + '.out')) as shard:
+                    for line in shard:
+                        yield line
+
+        try:
+            for shard in split_documents(lines, self.SHARD_SIZE,
+                    document_end):
+                publish(shard)
+            logging.info('{n} tasks of {stage} of {name} published.'.format(
+                n=len(task_ids), stage=stage, name=self.get_corpus_name()))
+            queue.wait(task_ids, Worker(queue, self.process_task))
+            with self._indexing(output_path) as index:
+                write_atomically(output_path, index(self._count(
+                    merge_outputs(), tokens=count_tokens)))
+        except WorkQueueException as exc:
+            raise CorpusException('Distributed processing failed: '
+                + exc.message)
+        finally:
+            for task_id in task_ids:
+                queue.remove(task_id)
+                for extension in ('.in', '.out'):
+                    path = queue.get_data_path(task_id + extension)
+                    if os.path.exists(path):
+                        os.remove(path)
+
     # ------------------------------------------------------------------------
     #  private methods
     # ------------------------------------------------------------------------
 
+    def _find_dump_url(self):
+        """Returns url of the dump and its MD5 checksum (or None)
+        """
+        dump_url = WikiCorpus.DUMP_URL_GENERAL.format(lang=self.language())
+        md5_url = WikiCorpus.MD5_URL_GENERAL.format(lang=self.language())
+        md5sums = get_online_file(md5_url, lines=True)
+        for file_md5, file_name in map(lambda x: x.split(), md5sums):
+            if file_name.endswith(WikiCorpus.DUMP_ORIGINAL_NAME):
+                return dump_url, file_md5
+        logging.warning('no matching MD5 checksum for the dump found')
+        return dump_url, None
+
+    def _set_bandwidth_limit(self):
+        """Sets bandwidth limit shared by downloads of all processes
+
+        Token bucket of the limit is stored in the directory of verticals,
+        so all languages downloaded at once (e.g. by the scheduler or by
+        several cron jobs) share the limit.
+        """
+        verticals_path = environment.verticals_path()
+        makedirs(verticals_path)
+        set_bandwidth_limit(environment.download_bandwidth_limit(),
+            os.path.join(verticals_path, WikiCorpus.BANDWIDTH_STATE_NAME))
+
+    def _get_dump_store(self):
+        """Returns shared dump store (or None if it's not configured)
+        """
+        store_path = environment.dump_store_path()
+        if not store_path:
+            return None
+        return DumpStore(store_path, environment.dump_store_quota())
+
+    def _get_corpus_file_path(self, extension_key):
+        """Returns path to a file of this corpus
+
+        :extension_key: unicode (key of file extension in configuration)
+        """
+        file_name = '{name}.{ext}'.format(
+            name=self.get_corpus_name(),
+            ext=self._configuration.get('extensions', extension_key))
+        return os.path.join(self.get_uncompiled_corpus_path(), file_name)
+
+    def _load_category_index(self):
+        """Loads category index created during preverticalization
+        """
+        categories_path = self.get_categories_path()
+        if not os.path.exists(categories_path):
+            raise CorpusException('Missing category index (create prevertical'
+                + ' with category index first).')
+        return CategoryIndex.load(categories_path)
+
     @contextmanager
     def _open_dump(self):
         """Opened dump (prepared for reading) with statement manager
@@ -578,7 +1223,8 @@ class WikiCorpus(object):
         Allows to write:
             with self._open_dump() as dump_file:
                 do something
-        And dump will be closed automatically no matter what.
+        And dump will be closed automatically no matter what. Errors of
+        the body of with statement are propagated.
         """
         dump_path = self.get_dump_path()
         try:
@@ -587,16 +1233,142 @@ class WikiCorpus(object):
                 dump_file = bz2.BZ2File(dump_path, 'r')
             else:
                 dump_file = open(dump_path)
-            try:
-                yield dump_file
-                # [after yield, the body of with statement will be executed]
-            finally:
-                dump_file.close()
         except IOError as exc:
             # errno.ENOENT = "No such file or directory"
             if exc.errno == errno.ENOENT:
                 raise CorpusException('Dump file {name} doesn\'t exist.'
                     .format(name=dump_path))
+            raise
+        try:
+            yield dump_file
+            # [after yield, the body of with statement will be executed]
+        finally:
+            dump_file.close()
+
+    @contextmanager
+    def _vertical_filters(self, index=None, filters=None, processes=1):
+        """Filters applied on streams of the language pipeline with statement
+        manager
+
+        The output filter is the chain of post-processing filters (e.g.
+        TreeTagger term hack for English and counting of documents and tokens
+        of the measured stage, see postprocessing module), then documents of
+        the vertical are indexed (if an indexing function is given, see
+        _indexing). Pool of processes inferring terms is created on entry
+        (so it has to be entered before the language pipeline is started,
+        see _terms_pool) and terminated on exit.
+
+        Allows to write:
+            with self._vertical_filters() as (input_filter, output_filter):
+                process stream by the pipeline with the filters
+
+        :index: function [optional]
+        :filters: list of unicode [optional]
+            names of post-processing filters (default is configured)
+        :processes: int (number of processes inferring terms)
+        """
+        names = select_filters(filters if filters is not None
+            else self._configuration.get('postprocessing'), self.language())
+        # (term ends are marked for TreeTagger term hack, see treetaggerhack)
+        input_filter = mark_term_ends if TERM_TAGS in names else None
+        with self._terms_pool(processes if TERMS in names else 1) as pool:
+            if pool is not None:
+                terms_filter = lambda lines: self._infere_terms_parallel(
+                    lines, pool, processes)
+            else:
+                terms_filter = infere_terms
+            functions = {
+                TERM_TAGS: correct_terms,
+                DESAMB_HACKS: remove_desamb_hacks,
+                NUMBER_LEMMAS: use_number_lemmas,
+                TERMS: terms_filter,
+                STATS: self._count,
+            }
+
+            def output_filter(lines):
+                lines = chain(lines, [functions[name] for name in names])
+                return index(lines) if index else lines
+
+            yield input_filter, output_filter
+
+    def _count(self, lines, tokens=True):
+        """Counts documents (and tokens) of a stream in the measured stage
+
+        :lines: iterable of encoded lines (or chunks of whole lines)
+        :tokens: Boolean (if False, only documents are counted)
+        :returns: iterable of the same lines
+        """
+        if self._measurement is None:
+            return lines
+        return self._measurement.count(lines, tokens)
+
+    def _get_work_queue(self):
+        """Returns work queue of distributed stages of this corpus
+        """
+        return WorkQueue(self.get_queue_path())
+
+    @contextmanager
+    def _writing_titles(self, category_index=True):
+        """File of titles of documents with statement manager
+
+        Titles are written to a temporary file which replaces the titles file
+        only if the with-statement finishes (not on exception or if the
+        iteration over pages is stopped). Yields None if category index
+        isn't wanted.
+        """
+        if not category_index:
+            yield None
+            return
+        titles_path = self.get_titles_path()
+        tmp_titles_path = titles_path + '.tmp'
+        try:
+            with open(tmp_titles_path, 'w') as titles_file:
+                yield titles_file
+            os.rename(tmp_titles_path, titles_path)
+        finally:
+            if os.path.exists(tmp_titles_path):
+                os.remove(tmp_titles_path)
+
+    @contextmanager
+    def _indexing(self, path):
+        """Indexes documents of a stream written to given file
+
+        Allows to write:
+            with self._indexing(path) as index:
+                write index(lines) to the file
+        And the index of documents (see DocumentIndexWriter) is saved only if
+        the whole stream is written.
+        """
+        writer = DocumentIndexWriter(get_index_path(path))
+        yield writer.index
+        writer.save()
+
+    @contextmanager
+    def _open_terms_dictionary(self, corpus_terms=True):
+        """ Maps terms dictionary of the corpus (yields None if not wanted)
+        """
+        if not corpus_terms:
+            yield None
+            return
+        with MappedTermsTrie(self.get_terms_dictionary_path()) as terms:
+            yield terms
+
+    @contextmanager
+    def _open_tagger_cache(self):
+        """Opened cache of tagged paragraphs (None if it's not configured)
+
+        Allows to write:
+            with self._open_tagger_cache() as cache:
+                do something
+        And cache will be closed (and evicted) automatically.
+        """
+        cache_path = environment.tagger_cache_path()
+        if not cache_path:
+            yield None
+            return
+        makedirs(os.path.dirname(os.path.abspath(cache_path)))
+        with TaggerCache(cache_path, environment.tagger_cache_size()) as cache:
+            yield cache
 
     # ------------------------------------------------------------------------
     #  magic methods
@@ -612,6 +1384,123 @@ class WikiCorpus(object):
         return repr(self)
 
 
+# ---------------------------------------------------------------------------
+#  Processing of documents (also in processes of pools)
+# ---------------------------------------------------------------------------
+
+# terms dictionary mapped by a process of terms inference pool
+_process_terms_dictionary = None
+
+# documents larger than this are not kept in memory by terms inference
+# (in bytes, see infere_terms)
+STREAMING_DOCUMENT_SIZE = 16 * 2 ** 20
+
+
+def split_documents(lines, size, document_end=DOCUMENT_END):
+    """ Splits lines on document boundaries to batches of about :size: bytes
+
+    :lines: iterable of encoded lines
+    :size: int
+    :document_end: str (batches end by lines ending by it)
+    :returns: generator of lists of lines
+    """
+    batch = []
+    batch_size = 0
+    for line in lines:
+        batch.append(line)
+        batch_size += len(line)
+        if batch_size >= size and line.endswith(document_end):
+            yield batch
+            batch = []
+            batch_size = 0
+    if batch:
+        yield batch
+
+
+def infere_terms(lines, terms_dictionary=None):
+    """ Labels occurences of terms in documents of vertical
+
+    Documents larger than STREAMING_DOCUMENT_SIZE are spooled to temporary
+    files and their terms are inferred in a stream (see
+    infere_terms_in_stream), so huge documents (e.g. long lists) don't need
+    memory for all their tokens.
+
+    :lines: iterable of encoded lines of vertical
+    :terms_dictionary: TermsTrie [optional] (terms of the whole corpus)
+    :returns: generator of encoded documents (or lines of huge documents)
+        of vertical
+    """
+    # find tagset (throws exception if registry file not found)
+    #tagset = self.get_tagset()
+    tagset = TAGSETS.TREETAGGER
+
+    document = None
+    spool = None
+    try:
+        for event, line in read_vertical(lines):
+            if event == DOC_START:
+                document = [line]
+                size = len(line)
+            elif spool is not None:
+                spool.write(line)
+            elif document is None:
+                # lines outside documents (e.g. blank lines of a batch)
+                continue
+            else:
+                document.append(line)
+                size += len(line)
+                if size > STREAMING_DOCUMENT_SIZE:
+                    spool = tempfile.TemporaryFile()
+                    spool.writelines(document)
+                    document = None
+            # check if the end of document is reached
+            if event != DOC_END:
+                continue
+            if spool is None:
+                vertical = VerticalDocument(document,
+                    tagset=tagset,
+                    terms_inference=True,
+                    terms_dictionary=terms_dictionary)
+                yield str(vertical)
+            else:
+                for output_line in infere_terms_in_stream(
+                        lambda: _rewind(spool), tagset, terms_dictionary):
+                    yield output_line
+                spool.close()
+                spool = None
+            document = None
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+def _rewind(spool):
+    """ Returns spooled file of a document from its beginning
+    """
+    spool.seek(0)
+    return spool
+
+
+def infere_terms_in_batch(lines):
+    """ Labels occurences of terms in a batch of documents (in a pool)
+
+    :returns: str (encoded documents of vertical)
+    """
+    return b''.join(infere_terms(lines, _process_terms_dictionary))
+
+
+def _init_terms_process(terms_dictionary_path):
+    """ Initializes process of terms inference pool
+
+    :terms_dictionary_path: unicode (or None if corpus terms aren't wanted)
+    """
+    global _process_terms_dictionary
+    # interruption is handled by the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if terms_dictionary_path is not None:
+        _process_terms_dictionary = MappedTermsTrie(terms_dictionary_path)
+
+
 # ---------------------------------------------------------------------------
 #  Exceptions
 # ---------------------------------------------------------------------------
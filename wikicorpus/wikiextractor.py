@@ -93,6 +93,47 @@ def parse_wikimarkup(id_number, title, url_prefix, text):
     return parsed_doc
 
 
+def extract_categories(text, namespaces=('Category',)):
+    """Returns list of categories the article belongs to
+
+    :text: unicode (article text in WikiMarkup)
+    :namespaces: names of the category namespace (e.g. localized ones)
+
+    :returns list of unicodes (normalized category names)
+    """
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+    pattern = category_link_pattern(tuple(namespaces))
+    categories = []
+    for match in pattern.finditer(text):
+        category = normalize_category(match.group(1))
+        if category and category not in categories:
+            categories.append(category)
+    return categories
+
+
+def normalize_category(name):
+    """Returns category name in canonical form ("Greek mythology")
+    """
+    name = spaces.sub(' ', name.replace('_', ' ')).strip()
+    if name:
+        name = name[0].upper() + name[1:]
+    return name
+
+
+# compiled category link patterns for tuples of namespace names
+category_link_patterns = {}
+
+
+def category_link_pattern(namespaces):
+    if namespaces not in category_link_patterns:
+        category_link_patterns[namespaces] = re.compile(
+            r'\[\[\s*(?:%s)\s*:([^|\]\[]*)(?:\|[^\]\[]*)?\]\]'
+            % '|'.join(re.escape(ns) for ns in namespaces),
+            re.IGNORECASE | re.UNICODE)
+    return category_link_patterns[namespaces]
+
+
 def get_term_element(title, name):
     wuri = term2wuri(title)
     term_element = '<term wuri="%s">%s</term>' % (wuri, name)
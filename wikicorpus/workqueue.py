@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Module for queue of tasks shared by workers on several nodes.
+
+The queue is a directory (typically on a filesystem shared by all nodes, such
+as NFS) where each task is a small JSON file. State of a task is given by the
+subdirectory its file is in:
+    pending/  tasks waiting for a worker
+    claimed/  tasks being processed by a worker
+    done/     finished tasks
+    failed/   tasks whose processing failed (with an error message)
+Tasks are moved between the subdirectories by renaming, which is atomic (even
+on NFS), so exactly one worker succeeds in claiming a task. Modification time
+of a claimed task is its lease: the worker renews it while processing the
+task, and tasks whose lease expired (e.g. because the worker or its node died)
+are moved back to pending/ by anyone who notices. Input and output data of
+tasks are stored in data/ and outputs are written to temporary files and then
+renamed, so an output is never seen half-written (even if a requeued task is
+processed twice).
+"""
+
+from __future__ import unicode_literals
+from utils.system_utils import makedirs
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+# time after which a task claimed by a silent worker is requeued (in seconds)
+LEASE = 600
+
+# interval of checking the queue for new or finished tasks (in seconds)
+POLL_INTERVAL = 5.0
+
+# time after which an idle worker stops (in seconds)
+IDLE_TIMEOUT = 600
+
+# number of consecutive polls after which a task not found in any state is
+# missing (it isn't found while it's being moved between states)
+MISSING_POLLS = 3
+
+# subdirectories of the queue
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+DATA = 'data'
+STATES = (PENDING, CLAIMED, DONE, FAILED)
+
+TASK_EXTENSION = '.json'
+
+
+def worker_name():
+    """Returns name of this worker process unique across nodes
+    """
+    return '{host}-{pid}'.format(host=socket.gethostname(), pid=os.getpid())
+
+
+class WorkQueue(object):
+
+    """Queue of tasks stored as files in a (shared) directory
+
+    Task is a dictionary which can be stored as JSON. Publisher adds tasks
+    and waits until they are done:
+
+        queue = WorkQueue(path)
+        queue.publish('vertical-00001', {'input': ..., 'output': ...})
+        queue.wait(['vertical-00001'])
+
+    Workers (any number of them on any node) process the tasks:
+
+        Worker(queue, handler).run()
+    """
+
+    def __init__(self, path, lease=LEASE):
+        """
+        :path: unicode (directory of the queue)
+        :lease: int (time after which silent worker loses its task in seconds)
+        """
+        self._path = path
+        self._lease = lease
+        for state in STATES + (DATA,):
+            makedirs(os.path.join(path, state))
+
+    def get_path(self):
+        return self._path
+
+    def get_lease(self):
+        return self._lease
+
+    def get_data_path(self, name):
+        """Returns path to data file of given name (stored in the queue)
+        """
+        return os.path.join(self._path, DATA, name)
+
+    def _task_path(self, state, task_id):
+        return os.path.join(self._path, state, task_id + TASK_EXTENSION)
+
+    def _task_ids(self, state):
+        return sorted(name[:-len(TASK_EXTENSION)]
+            for name in os.listdir(os.path.join(self._path, state))
+            if name.endswith(TASK_EXTENSION))
+
+    # ------------------------------------------------------------------------
+    #  publishing
+    # ------------------------------------------------------------------------
+
+    def publish(self, task_id, task):
+        """Adds task to the queue
+
+        :task_id: unicode (unique identifier, tasks are claimed in its order)
+        :task: dict (serializable to JSON)
+        """
+        task = dict(task, id=task_id)
+        self._write_task(self._task_path(PENDING, task_id), task)
+
+    def get_state(self, task_id):
+        """Returns state of given task (one of STATES or None if unknown)
+
+        None can be returned transiently, when the task is moved to another
+        state meanwhile.
+        """
+        for state in (DONE, FAILED, CLAIMED, PENDING):
+            if os.path.exists(self._task_path(state, task_id)):
+                return state
+        return None
+
+    def wait(self, task_ids, worker=None, poll_interval=POLL_INTERVAL):
+        """Waits until all given tasks are done
+
+        Expired leases are requeued meanwhile. If a worker is given, it
+        processes pending tasks while waiting (so the publisher works as well).
+
+        :task_ids: list of identifiers of tasks
+        :worker: Worker [optional]
+        :poll_interval: float (interval of checking finished tasks)
+        """
+        remaining = set(task_ids)
+        # number of consecutive polls which didn't find the task
+        misses = {}
+        while remaining:
+            for task_id in sorted(remaining):
+                state = self.get_state(task_id)
+                if state is None:
+                    misses[task_id] = misses.get(task_id, 0) + 1
+                    if misses[task_id] >= MISSING_POLLS:
+                        raise WorkQueueException('Task {id} is missing in'
+                            ' the queue.'.format(id=task_id))
+                    continue
+                misses.pop(task_id, None)
+                if state == DONE:
+                    remaining.discard(task_id)
+                elif state == FAILED:
+                    task = self._read_task(self._task_path(FAILED, task_id))
+                    raise WorkQueueException('Task {id} failed: {error}'
+                        .format(id=task_id, error=task.get('error')))
+            if not remaining:
+                break
+            self.requeue_expired()
+            if worker is None or not worker.process_next():
+                time.sleep(poll_interval)
+
+    def remove(self, task_id):
+        """Removes task (in any state) from the queue
+        """
+        for state in STATES:
+            self._remove_task(state, task_id)
+
+    # ------------------------------------------------------------------------
+    #  processing
+    # ------------------------------------------------------------------------
+
+    def claim(self):
+        """Claims the first pending task
+
+        :returns: dict (task) or None if there is no pending task
+        """
+        for task_id in self._task_ids(PENDING):
+            pending_path = self._task_path(PENDING, task_id)
+            claimed_path = self._task_path(CLAIMED, task_id)
+            try:
+                # lease starts now (renaming keeps the modification time)
+                os.utime(pending_path, None)
+                os.rename(pending_path, claimed_path)
+            except OSError as exc:
+                if exc.errno == errno.ENOENT:
+                    # claimed by another worker
+                    continue
+                raise
+            try:
+                return self._read_task(claimed_path)
+            except (IOError, OSError) as exc:
+                if exc.errno == errno.ENOENT:
+                    # requeued meanwhile (lease of our own claim expired)
+                    continue
+                raise
+        return None
+
+    def renew(self, task_id):
+        """Renews lease of claimed task
+
+        :returns: True if the task is still claimed
+        """
+        try:
+            os.utime(self._task_path(CLAIMED, task_id), None)
+            return True
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return False
+            raise
+
+    def complete(self, task_id):
+        """Marks claimed task as done (its output has to be written already)
+        """
+        try:
+            os.rename(self._task_path(CLAIMED, task_id),
+                self._task_path(DONE, task_id))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            # lease expired, but the output is written anyway
+            pending_path = self._task_path(PENDING, task_id)
+            try:
+                os.rename(pending_path, self._task_path(DONE, task_id))
+            except OSError as exc:
+                # already claimed (or done) again, the other worker finishes
+                if exc.errno != errno.ENOENT:
+                    raise
+
+    def fail(self, task_id, error):
+        """Marks claimed task as failed
+
+        :error: unicode (error message)
+        """
+        claimed_path = self._task_path(CLAIMED, task_id)
+        try:
+            task = self._read_task(claimed_path)
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            task = {'id': task_id}
+        task['error'] = error
+        self._write_task(self._task_path(FAILED, task_id), task)
+        self._remove_task(CLAIMED, task_id)
+
+    def requeue_expired(self):
+        """Moves claimed tasks with expired leases back to pending tasks
+
+        :returns: int (number of requeued tasks)
+        """
+        now = self._now()
+        count = 0
+        for task_id in self._task_ids(CLAIMED):
+            claimed_path = self._task_path(CLAIMED, task_id)
+            try:
+                if os.path.getmtime(claimed_path) + self._lease > now:
+                    continue
+                os.rename(claimed_path, self._task_path(PENDING, task_id))
+            except OSError as exc:
+                if exc.errno == errno.ENOENT:
+                    # finished or requeued by someone else meanwhile
+                    continue
+                raise
+            logging.warning('Lease of task {id} expired, task requeued.'
+                .format(id=task_id))
+            count += 1
+        return count
+
+    def _now(self):
+        """Returns current time of the filesystem of the queue
+
+        Clocks of nodes can differ, so leases are compared with modification
+        time of a freshly touched file (set by the file server).
+        """
+        clock_path = os.path.join(self._path, 'clock')
+        with open(clock_path, 'a'):
+            os.utime(clock_path, None)
+        return os.path.getmtime(clock_path)
+
+    # ------------------------------------------------------------------------
+    #  task files
+    # ------------------------------------------------------------------------
+
+    def _remove_task(self, state, task_id):
+        try:
+            os.remove(self._task_path(state, task_id))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def _read_task(self, path):
+        with open(path) as task_file:
+            return json.load(task_file)
+
+    def _write_task(self, path, task):
+        tmp_path = '{path}.{worker}.tmp'.format(path=path, worker=worker_name())
+        with open(tmp_path, 'w') as task_file:
+            json.dump(task, task_file)
+        os.rename(tmp_path, path)
+
+
+class Worker(object):
+
+    """Worker processing tasks of a queue by given handler
+
+    Lease of the task being processed is renewed from another thread. If the
+    handler raises an exception, the task is marked as failed.
+    """
+
+    def __init__(self, queue, handler, poll_interval=POLL_INTERVAL):
+        """
+        :queue: WorkQueue
+        :handler: function (task) -> None
+            processes the task; it writes output atomically, e.g. by
+            write_atomically (the task can be processed more than once)
+        :poll_interval: float (interval of checking the queue for new tasks)
+        """
+        self._queue = queue
+        self._handler = handler
+        self._poll_interval = poll_interval
+        self.processed = 0
+
+    def run(self, idle_timeout=IDLE_TIMEOUT):
+        """Processes tasks until no task appears for :idle_timeout: seconds
+        """
+        idle_since = time.time()
+        while time.time() - idle_since < idle_timeout:
+            self._queue.requeue_expired()
+            if self.process_next():
+                idle_since = time.time()
+            else:
+                time.sleep(self._poll_interval)
+        logging.info('Worker {name} processed {n} tasks.'.format(
+            name=worker_name(), n=self.processed))
+
+    def process_next(self):
+        """Claims and processes one pending task
+
+        :returns: True if a task was processed
+        """
+        task = self._queue.claim()
+        if task is None:
+            return False
+        task_id = task['id']
+        logging.info('Worker {name} processes task {id}.'.format(
+            name=worker_name(), id=task_id))
+        stopped = threading.Event()
+        renewal = threading.Thread(target=self._renew_lease,
+            args=(task_id, stopped))
+        renewal.daemon = True
+        renewal.start()
+        try:
+            self._handler(task)
+        except Exception as exc:
+            logging.exception('Task {id} failed.'.format(id=task_id))
+            self._queue.fail(task_id, unicode(exc))
+        else:
+            self._queue.complete(task_id)
+        finally:
+            stopped.set()
+            renewal.join()
+        self.processed += 1
+        return True
+
+    def _renew_lease(self, task_id, stopped):
+        interval = max(self._queue.get_lease() / 3.0, 0.1)
+        while not stopped.wait(interval):
+            if not self._queue.renew(task_id):
+                logging.warning('Lease of task {id} was lost.'.format(
+                    id=task_id))
+                return
+
+
+def write_atomically(path, lines):
+    """Writes lines to file on given path (through a temporary file)
+
+    :path: unicode
+    :lines: iterable of encoded lines
+    """
+    tmp_path = '{path}.{worker}.tmp'.format(path=path, worker=worker_name())
+    try:
+        with open(tmp_path, 'wb') as output_file:
+            output_file.writelines(lines)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# ----------------------------------------------------------------------------
+#  Exceptions
+# ----------------------------------------------------------------------------
+
+class WorkQueueException(Exception):
+    """ Class for reprezentation of exception raised by work queue
+    """
+    pass